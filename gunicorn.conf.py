@@ -0,0 +1,48 @@
+# Gunicorn settings, see the Procfile
+#
+# With DETECTION_FORK_PRELOAD=True (or gunicorn --preload) the application and the DETECTION_PRELOAD_MODELS
+# are loaded once in the master process and the workers are forked from it, sharing the model weights
+# copy-on-write. The variable is read here rather than from the Django settings, which gunicorn only loads
+# after deciding whether to preload; the hooks follow the resulting preload_app setting.
+# Each worker logs its memory when it is ready and when it exits; compare pss/uss with and without
+# preloading (or run `manage.py bench_fork_preload`) to size WEB_CONCURRENCY.
+import os
+
+preload_app = os.environ.get('DETECTION_FORK_PRELOAD', 'False') == 'True'
+
+
+def when_ready(server):
+    # Runs in the master after the application is loaded and before the first worker is forked
+    server.log.info(f"Master memory: {_memory_usage()}")
+    if server.cfg.preload_app:
+        from detection.services.preload import preload_for_fork
+
+        report = preload_for_fork(workers=server.cfg.workers)
+        server.log.info(f"Preloaded {report['models']} in {report['load_time']}s, "
+                        f"master memory {report['memory_before']} -> {report['memory_after']}")
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from detection.services.preload import after_fork
+
+        # Size the worker's thread pools for its share of the cores
+        after_fork(server.cfg.workers)
+
+
+def post_worker_init(server, worker):
+    server.log.info(f"Worker {worker.pid} ready, memory: {_memory_usage()}")
+
+
+def worker_exit(server, worker):
+    server.log.info(f"Worker {worker.pid} exiting, memory: {_memory_usage()}")
+
+
+def _memory_usage():
+    try:
+        from detection.services.preload import memory_usage
+    except ImportError:
+        # Django is not set up in the master unless the application is preloaded
+        import resource
+        return {'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    return memory_usage()
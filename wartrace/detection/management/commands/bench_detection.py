@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import glob
+import shutil
+import platform
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from content.models import Marker, MarkerFile
+from detection.services.main import MODEL_CONFIG, default_model_name, model_service, _create_detection_records
+from detection.services.images import open_image
+from detection.services.rendering import draw_modern_annotations
+from detection.services.stub import COCO_LABELS, StubDetector
+from detection.services.threads import available_cores
+
+User = get_user_model()
+
+STAGES = ('decode', 'inference', 'postprocess', 'annotate', 'encode', 'db_write')
+
+BENCH_USERNAME = 'bench_detection'
+
+class Command(BaseCommand):
+    help = ('Benchmarks the detection pipeline stage by stage (decode, inference, postprocess, annotate, '
+            'encode, DB write) over synthetic or fixture images, and reports p50/p95 and throughput as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--detector-type', default='object_detection', help='Detector type whose pipeline is measured')
+        parser.add_argument('--model', choices=['stub', 'real'], default='stub',
+                            help="'stub' needs no weights or network; 'real' loads the configured model")
+        parser.add_argument('--sizes', nargs='+', default=['640x480', '1920x1080', '4000x3000'],
+                            help='Synthetic image sizes (WIDTHxHEIGHT)')
+        parser.add_argument('--detections', nargs='+', type=int, default=[0, 10, 100],
+                            help='Detections per image returned by the stub model')
+        parser.add_argument('--fixtures', help='Directory of images to use instead of synthetic ones')
+        parser.add_argument('--images', type=int, default=16, help='Images per configuration')
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'DETECTION_BATCH_SIZE', 8),
+                            help='Images per forward pass')
+        parser.add_argument('--latency-ms', type=float, default=0.0, help='Simulated stub inference time per image')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic images and stub boxes')
+        parser.add_argument('--output', help="Write the JSON report to this file ('-' for stdout)")
+
+    def handle(self, *args, **options):
+        detector_type = options['detector_type']
+        if detector_type not in MODEL_CONFIG:
+            raise CommandError(f"Unknown detector type: {detector_type}")
+
+        model_name = default_model_name(detector_type)
+        config = MODEL_CONFIG[detector_type][model_name]
+
+        if options['model'] == 'real':
+            model_data = model_service.get_model(detector_type)
+            if not model_data:
+                raise CommandError(f"Could not load the {detector_type} model")
+            config = model_data['config']
+            # A real model decides the number of detections itself
+            detection_counts = [None]
+        else:
+            detection_counts = options['detections']
+
+        quiet = options['output'] == '-'
+        tmp_dir = tempfile.mkdtemp(prefix='bench_detection_')
+        user, created_user = User.objects.get_or_create(username=BENCH_USERNAME)
+        marker = Marker.objects.create(user=user, title='Detection benchmark', description='Temporary benchmark marker')
+
+        runs = []
+        try:
+            for size_label, image_paths in self.image_sets(tmp_dir, options):
+                marker_files = [
+                    MarkerFile.objects.create(marker=marker, file=os.path.basename(path)) for path in image_paths
+                ]
+                for count in detection_counts:
+                    if options['model'] == 'real':
+                        model = model_data['model']
+                    else:
+                        labels = config.get('classes') or COCO_LABELS
+                        model = StubDetector(labels, count, options['latency_ms'], options['seed'])
+
+                    run = self.run_pipeline(detector_type, model_name, model, config, image_paths, marker_files, options)
+                    run.update(size=size_label, detections=count)
+                    runs.append(run)
+                    if not quiet:
+                        self.write_run(run)
+        finally:
+            marker.delete()
+            if created_user:
+                user.delete()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'detector_type': detector_type,
+            'model': options['model'] if options['model'] == 'stub' else f"{model_name} ({config['type']})",
+            'batch_size': options['batch_size'],
+            'images': options['images'],
+            'stub_latency_ms': options['latency_ms'],
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cores': available_cores(),
+                'numpy': np.__version__,
+                'opencv': cv2.__version__,
+                'torch': getattr(sys.modules.get('torch'), '__version__', None),
+                'database': settings.DATABASES['default']['ENGINE']
+            },
+            'runs': runs
+        }
+
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def image_sets(self, tmp_dir, options):
+        """Yield (label, image paths) for each image size, or once for the fixture directory"""
+        if options['fixtures']:
+            paths = sorted(
+                path for path in glob.glob(os.path.join(options['fixtures'], '*'))
+                if os.path.splitext(path)[1].lower() in ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+            )[:options['images']]
+            if not paths:
+                raise CommandError(f"No images found in {options['fixtures']}")
+            yield 'fixtures', paths
+            return
+
+        rng = np.random.default_rng(options['seed'])
+        for size in options['sizes']:
+            try:
+                width, height = (int(value) for value in size.lower().split('x'))
+            except ValueError:
+                raise CommandError(f"Invalid size {size}, expected WIDTHxHEIGHT")
+
+            paths = []
+            for index in range(options['images']):
+                path = os.path.join(tmp_dir, f"{width}x{height}_{index}.jpg")
+                cv2.imwrite(path, synthetic_image(rng, width, height))
+                paths.append(path)
+            yield f"{width}x{height}", paths
+
+    def run_pipeline(self, detector_type, model_name, model, config, image_paths, marker_files, options):
+        """Run the detection pipeline over the images, timing every stage of every image"""
+        timings = {stage: [] for stage in STAGES}
+        threshold = config.get('threshold', 0.30)
+        iou = config.get('iou', 0.45)
+        max_side = getattr(settings, 'DETECTION_INFERENCE_MAX_SIDE', 0)
+        batch_size = max(1, options['batch_size'])
+        total_objects = 0
+
+        start_time = time.perf_counter()
+        for batch_start in range(0, len(image_paths), batch_size):
+            batch_paths = image_paths[batch_start:batch_start + batch_size]
+            batch_files = marker_files[batch_start:batch_start + batch_size]
+
+            images = []
+            for path in batch_paths:
+                stage_start = time.perf_counter()
+                image = open_image(path, max_side=max_side)
+                image.inference_array
+                timings['decode'].append(elapsed_ms(stage_start))
+                images.append(image)
+
+            stage_start = time.perf_counter()
+            results = model([image.inference_array for image in images], conf=threshold, iou=iou,
+                            batch=len(images), verbose=False)
+            per_image = elapsed_ms(stage_start) / len(images)
+            timings['inference'].extend([per_image] * len(images))
+
+            for image, result, marker_file in zip(images, results, batch_files):
+                stage_start = time.perf_counter()
+                detections = model_service._yolo_result_to_detections(result, config)
+                for det in detections:
+                    det['bbox'] = image.to_full_resolution(det['bbox'])
+                # Rendering is measured on its own below
+                with override_settings(DETECTION_RENDER_IMAGES=False):
+                    output = model_service._save_yolo_result(image, detector_type, detections)
+                timings['postprocess'].append(elapsed_ms(stage_start))
+                total_objects += len(detections)
+
+                stage_start = time.perf_counter()
+                canvas, scale = image.annotation_view()
+                if scale != 1.0:
+                    detections = [dict(det, bbox=[coord * scale for coord in det['bbox']]) for det in detections]
+                annotated = draw_modern_annotations(canvas, detections, detector_type, model_name)
+                timings['annotate'].append(elapsed_ms(stage_start))
+
+                stage_start = time.perf_counter()
+                cv2.imencode('.jpg', annotated)
+                timings['encode'].append(elapsed_ms(stage_start))
+
+                stage_start = time.perf_counter()
+                output['inference_time'] = per_image / 1000
+                _create_detection_records(marker_file, {detector_type: {'model_name': model_name, 'result': output}}, [detector_type])
+                timings['db_write'].append(elapsed_ms(stage_start))
+
+                image.release()
+
+        elapsed = time.perf_counter() - start_time
+        return {
+            'throughput': len(image_paths) / elapsed,
+            'objects_per_image': total_objects / len(image_paths),
+            'stages': {
+                stage: {
+                    'p50': float(np.percentile(values, 50)),
+                    'p95': float(np.percentile(values, 95)),
+                    'mean': float(np.mean(values))
+                }
+                for stage, values in timings.items()
+            }
+        }
+
+    def write_run(self, run):
+        detections = 'model' if run['detections'] is None else run['detections']
+        self.stdout.write(f"{run['size']}, {detections} detections: {run['throughput']:.1f} images/s")
+        for stage, stats in run['stages'].items():
+            self.stdout.write(f"  {stage:<12} p50 {stats['p50']:8.2f}ms  p95 {stats['p95']:8.2f}ms")
+
+
+def elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+
+def synthetic_image(rng, width: int, height: int) -> np.ndarray:
+    """Smooth background with rectangles and sensor noise, so JPEG size and decode cost are photo-like"""
+    base = rng.integers(0, 256, (max(2, height // 64), max(2, width // 64), 3), dtype=np.uint8)
+    img = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(20):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        w, h = int(rng.integers(8, max(9, width // 8))), int(rng.integers(8, max(9, height // 8)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.rectangle(img, (x, y), (x + w, y + h), color, -1)
+    noise = rng.integers(-8, 9, img.shape, dtype=np.int16)
+    return np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
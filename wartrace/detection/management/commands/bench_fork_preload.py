@@ -0,0 +1,126 @@
+import json
+import queue
+import multiprocessing
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.services.main import MODEL_CONFIG
+from detection.services.backends import sample_upload_images
+from detection.services.preload import benchmark_fork_worker, memory_usage, preload_for_fork
+
+MEMORY_FIELDS = ('rss_mb', 'pss_mb', 'uss_mb', 'shared_mb')
+
+class Command(BaseCommand):
+    help = ('Compares the memory of forked detection workers that each load their own models against '
+            'workers sharing models preloaded in the parent (DETECTION_FORK_PRELOAD)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--detector-types', nargs='+',
+                            default=getattr(settings, 'DETECTION_PRELOAD_MODELS', None) or ['object_detection'],
+                            help='Detector types each worker runs')
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes forked per mode')
+        parser.add_argument('--frames', type=int, default=4, help='Frames each worker runs the detectors over')
+        parser.add_argument('--output', help="Write the JSON report to this file ('-' for stdout)")
+
+    def handle(self, *args, **options):
+        for detector_type in options['detector_types']:
+            if detector_type not in MODEL_CONFIG:
+                raise CommandError(f"Unknown detector type: {detector_type}")
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError("Forking worker processes is not supported on this platform")
+
+        quiet = options['output'] == '-'
+        frames = sample_upload_images(options['frames'])
+        # Each worker loading its own models first: once preloaded, the models stay in this process
+        runs = []
+        for mode in ('per_worker', 'preload'):
+            preload = None
+            if mode == 'preload':
+                preload = preload_for_fork(options['detector_types'], workers=options['workers'])
+                if preload['skipped']:
+                    self.stderr.write(f"Not shared (loaded per worker): {', '.join(preload['skipped'])}")
+            run = self.run_mode(mode, frames, options)
+            run['preload'] = preload
+            runs.append(run)
+            if not quiet:
+                self.write_run(run)
+
+        if not quiet:
+            before, after = runs[0]['total_pss_mb'], runs[1]['total_pss_mb']
+            if before is not None and after is not None:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Preloading saves {before - after:.1f}MB for {options['workers']} workers, "
+                    f"each extra worker costs {runs[1]['worker_mean']['uss_mb']:.1f}MB instead of "
+                    f"{runs[0]['worker_mean']['uss_mb']:.1f}MB"
+                ))
+
+        report = {
+            'detector_types': options['detector_types'],
+            'workers': options['workers'],
+            'frames': options['frames'],
+            'runs': runs
+        }
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def run_mode(self, mode, frames, options):
+        """Fork the workers, let them run the detectors and measure every process while all are alive"""
+        workers = options['workers']
+        context = multiprocessing.get_context('fork')
+        # This process takes part too, so it is measured at the same moment as the workers
+        barrier = context.Barrier(workers + 1)
+        results = context.Queue()
+
+        processes = [
+            context.Process(target=benchmark_fork_worker, args=(
+                options['detector_types'], frames, mode == 'preload', workers, barrier, results
+            ))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+
+        worker_runs = []
+        try:
+            barrier.wait(timeout=600)
+            parent = memory_usage()
+            while len(worker_runs) < workers:
+                try:
+                    worker_runs.append(results.get(timeout=5))
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes):
+                        raise CommandError(f"Benchmark workers exited without results ({mode})")
+            barrier.wait(timeout=600)
+        finally:
+            for process in processes:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+
+        worker_mean = {}
+        for field in MEMORY_FIELDS:
+            values = [run['memory'][field] for run in worker_runs]
+            worker_mean[field] = round(float(np.mean(values)), 1) if None not in values else None
+        pss = [run['memory']['pss_mb'] for run in worker_runs] + [parent['pss_mb']]
+        return {
+            'mode': mode,
+            'parent': parent,
+            'worker_mean': worker_mean,
+            'total_pss_mb': round(sum(pss), 1) if None not in pss else None,
+            'detect_s_mean': round(float(np.mean([run['elapsed'] for run in worker_runs])), 3),
+            'worker_runs': worker_runs
+        }
+
+    def write_run(self, run):
+        mean = run['worker_mean']
+        self.stdout.write(
+            f"{run['mode']:<10} per worker: rss {mean['rss_mb']}MB  pss {mean['pss_mb']}MB  uss {mean['uss_mb']}MB  "
+            f"shared {mean['shared_mb']}MB  |  parent rss {run['parent']['rss_mb']}MB  |  "
+            f"total pss {run['total_pss_mb']}MB  |  detect {run['detect_s_mean']}s"
+        )
@@ -0,0 +1,94 @@
+import json
+import time
+
+import cv2
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.services.rendering import COLOR_PALETTE, draw_modern_annotations
+
+class Command(BaseCommand):
+    help = ('Measures how long annotated detection images take to draw and JPEG-encode, '
+            'across frame sizes and detection counts (boxes are random and may overlap)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', default=['640x480', '1920x1080', '4000x3000'],
+                            help='Frame sizes (WIDTHxHEIGHT)')
+        parser.add_argument('--detections', nargs='+', type=int, default=[0, 1, 10, 50, 200],
+                            help='Detections drawn per frame')
+        parser.add_argument('--runs', type=int, default=5, help='Renders timed per size and detection count')
+        parser.add_argument('--output', help="Write the JSON report to this file ('-' for stdout)")
+
+    def handle(self, *args, **options):
+        sizes = []
+        for size in options['sizes']:
+            try:
+                width, height = (int(value) for value in size.lower().split('x'))
+            except ValueError:
+                raise CommandError(f"Invalid size {size}, expected WIDTHxHEIGHT")
+            sizes.append((width, height))
+        if options['runs'] < 1:
+            raise CommandError("--runs must be at least 1")
+
+        quiet = options['output'] == '-'
+        rng = np.random.default_rng(0)
+        labels = [label for label in COLOR_PALETTE if label != 'default']
+        runs = []
+        if not quiet:
+            self.stdout.write(f"{'size':>10} {'detections':>10} {'draw ms':>9} {'encode ms':>10} {'jpeg kB':>8}")
+
+        for width, height in sizes:
+            frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+            for count in options['detections']:
+                detections = self.random_detections(rng, labels, width, height, count)
+                run = self.run_render(frame, detections, options['runs'])
+                run.update(size=f"{width}x{height}", detections=count)
+                runs.append(run)
+                if not quiet:
+                    self.stdout.write(f"{run['size']:>10} {count:>10} {run['draw_ms']:>9.1f} "
+                                      f"{run['encode_ms']:>10.1f} {run['jpeg_kb']:>8.1f}")
+
+        report = {'runs_per_case': options['runs'], 'results': runs}
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def random_detections(self, rng, labels, width, height, count):
+        """Boxes up to a quarter of the frame on each side, so larger counts overlap"""
+        detections = []
+        for _ in range(count):
+            box_w = int(rng.integers(8, max(9, width // 4)))
+            box_h = int(rng.integers(8, max(9, height // 4)))
+            x_min = int(rng.integers(0, max(1, width - box_w)))
+            y_min = int(rng.integers(0, max(1, height - box_h)))
+            detections.append({
+                'label': labels[int(rng.integers(len(labels)))],
+                'confidence': float(rng.uniform(0.25, 1.0)),
+                'bbox': [x_min, y_min, x_min + box_w, y_min + box_h]
+            })
+        return detections
+
+    def run_render(self, frame, detections, runs):
+        """Median draw and encode times of the annotated frame"""
+        draw_times, encode_times = [], []
+        size = 0
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            annotated = draw_modern_annotations(frame, detections, 'object_detection', 'benchmark')
+            draw_times.append(time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            success, buffer = cv2.imencode('.jpg', annotated)
+            encode_times.append(time.perf_counter() - start_time)
+            if not success:
+                raise CommandError("Could not encode the annotated frame")
+            size = buffer.nbytes
+
+        return {
+            'draw_ms': round(float(np.median(draw_times)) * 1000, 1),
+            'encode_ms': round(float(np.median(encode_times)) * 1000, 1),
+            'jpeg_kb': round(size / 1024, 1)
+        }
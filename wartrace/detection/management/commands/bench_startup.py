@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.services.workers import _init_worker, _model_status
+
+# Modules that should only load once something runs inference or renders an image
+HEAVY_MODULES = ('numpy', 'cv2', 'tifffile', 'torch', 'ultralytics', 'tensorflow', 'onnxruntime', 'openvino')
+
+# Run in a fresh interpreter; the JSON report is the last line of its output
+STARTUP_SCRIPT = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+{body}
+print()
+print(json.dumps({{
+    'startup_ms': (time.perf_counter() - start) * 1000,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'heavy_modules': [name for name in {heavy!r} if name in sys.modules]
+}}))
+'''
+
+SCENARIOS = {
+    # What every management command and deploy step pays
+    'check': "from django.core.management import call_command\ncall_command('check')",
+    # A web worker: the WSGI application, then the URLconf and views its first request loads
+    'web_worker': ("from django.core.wsgi import get_wsgi_application\nget_wsgi_application()\n"
+                   "from django.urls import get_resolver\nget_resolver().url_patterns")
+}
+
+class Command(BaseCommand):
+    help = ('Measures startup time of `manage.py check`, a web worker and an inference worker, '
+            'and which heavy modules (numpy, cv2, torch, ...) each one imports')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters started per scenario')
+        parser.add_argument('--skip-inference-worker', action='store_true',
+                            help='Only measure check and the web worker (no models are loaded)')
+        parser.add_argument('--output', help="Write the JSON report to this file ('-' for stdout)")
+
+    def handle(self, *args, **options):
+        quiet = options['output'] == '-'
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'wartrace.settings')
+        env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+
+        scenarios = {}
+        for name, body in SCENARIOS.items():
+            runs = [self.run_interpreter(name, body, env) for _ in range(options['runs'])]
+            scenarios[name] = self.summarize(runs)
+            if not quiet:
+                self.write_scenario(name, scenarios[name])
+
+        if not options['skip_inference_worker']:
+            scenarios['inference_worker'] = self.run_inference_worker()
+            if not quiet:
+                self.write_scenario('inference_worker', scenarios['inference_worker'])
+
+        report = {
+            'runs': options['runs'],
+            'preload_models': getattr(settings, 'DETECTION_PRELOAD_MODELS', []),
+            'scenarios': scenarios
+        }
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def run_interpreter(self, name, body, env):
+        """Start a fresh interpreter for the scenario, timing it from launch to exit"""
+        script = STARTUP_SCRIPT.format(body=body, heavy=HEAVY_MODULES)
+        start_time = time.perf_counter()
+        completed = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True)
+        wall_ms = (time.perf_counter() - start_time) * 1000
+        if completed.returncode != 0:
+            raise CommandError(f"{name} failed:\n{completed.stderr}")
+
+        run = json.loads(completed.stdout.strip().splitlines()[-1])
+        run['wall_ms'] = wall_ms
+        return run
+
+    def summarize(self, runs):
+        return {
+            'wall_ms': round(float(np.median([run['wall_ms'] for run in runs])), 1),
+            'startup_ms': round(float(np.median([run['startup_ms'] for run in runs])), 1),
+            'peak_rss_mb': round(max(run['peak_rss_mb'] for run in runs), 1),
+            'heavy_modules': runs[-1]['heavy_modules']
+        }
+
+    def run_inference_worker(self):
+        """Start one spawned inference worker, timing it until it has loaded DETECTION_PRELOAD_MODELS"""
+        context = multiprocessing.get_context('spawn')
+        start_time = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker,
+                                 initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'wartrace.settings'),)) as executor:
+            status = executor.submit(_model_status).result()
+        wall_ms = (time.perf_counter() - start_time) * 1000
+        return {
+            'wall_ms': round(wall_ms, 1),
+            'models': [model['key'] for model in status['models']],
+            'peak_rss_mb': status['memory']['rss_mb']
+        }
+
+    def write_scenario(self, name, scenario):
+        line = f"{name:<17} {scenario['wall_ms']:9.1f}ms"
+        if 'startup_ms' in scenario:
+            line += f"  (django setup and load {scenario['startup_ms']:.1f}ms)"
+        line += f"  rss {scenario['peak_rss_mb']:.1f}MB"
+        if 'heavy_modules' in scenario:
+            line += f"  heavy modules: {', '.join(scenario['heavy_modules']) or 'none'}"
+        if 'models' in scenario:
+            line += f"  models: {', '.join(scenario['models']) or 'none'}"
+        self.stdout.write(line)
@@ -0,0 +1,98 @@
+import os
+import queue
+import shutil
+import tempfile
+import multiprocessing
+
+import cv2
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.services.main import MODEL_CONFIG
+from detection.services.backends import sample_upload_images
+from detection.services.threads import available_cores, benchmark_worker
+
+class Command(BaseCommand):
+    help = ('Measures detection throughput of concurrent worker processes across thread budgets, '
+            'to pick DETECTION_INTRA_OP_THREADS / DETECTION_INTER_OP_THREADS for this machine')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--detector-types', nargs='+', default=['object_detection'],
+                            help='Detector types each worker runs')
+        parser.add_argument('--workers', nargs='+', type=int,
+                            default=[getattr(settings, 'DETECTION_WORKER_PROCESSES', 2)],
+                            help='Worker process counts to compare')
+        parser.add_argument('--intra-op', nargs='+', type=int,
+                            help='Intra-op threads per worker to compare (defaults to 1, the automatic share and all cores)')
+        parser.add_argument('--inter-op', nargs='+', type=int, default=[1], help='Inter-op threads per worker to compare')
+        parser.add_argument('--images', type=int, default=16, help='Images processed by each worker per round')
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'DETECTION_BATCH_SIZE', 8),
+                            help='Images per forward pass')
+        parser.add_argument('--rounds', type=int, default=2, help='Passes over the images per worker')
+
+    def handle(self, *args, **options):
+        for detector_type in options['detector_types']:
+            if detector_type not in MODEL_CONFIG:
+                raise CommandError(f"Unknown detector type: {detector_type}")
+
+        cores = available_cores()
+        tmp_dir = tempfile.mkdtemp(prefix='bench_threads_')
+        try:
+            image_paths = []
+            for index, img in enumerate(sample_upload_images(options['images'])):
+                path = os.path.join(tmp_dir, f"{index}.jpg")
+                cv2.imwrite(path, img)
+                image_paths.append(path)
+
+            self.stdout.write(f"{cores} cores, {len(image_paths)} images x {options['rounds']} rounds per worker, "
+                              f"detectors: {', '.join(options['detector_types'])}")
+            self.stdout.write(f"{'workers':>7} {'intra':>5} {'inter':>5} {'threads/core':>12} {'img/s':>8} {'cpu':>6}")
+
+            for workers in options['workers']:
+                intra_ops = options['intra_op'] or sorted({1, max(1, cores // workers), cores})
+                for intra_op in intra_ops:
+                    for inter_op in options['inter_op']:
+                        run = self.run_budget(workers, {'intra_op': intra_op, 'inter_op': inter_op}, image_paths, options)
+                        self.stdout.write(
+                            f"{workers:>7} {intra_op:>5} {inter_op:>5} {workers * intra_op / cores:>12.2f} "
+                            f"{run['throughput']:>8.2f} {run['cpu_utilization']:>5.0%}"
+                        )
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def run_budget(self, workers, budget, image_paths, options):
+        """Start the workers with the budget, run them at the same time and measure their combined throughput"""
+        context = multiprocessing.get_context('spawn')
+        barrier = context.Barrier(workers)
+        results = context.Queue()
+
+        processes = [
+            context.Process(target=benchmark_worker, args=(
+                os.environ.get('DJANGO_SETTINGS_MODULE', 'wartrace.settings'), options['detector_types'], budget,
+                image_paths, options['batch_size'], options['rounds'], barrier, results
+            ))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+
+        runs = []
+        try:
+            while len(runs) < workers:
+                try:
+                    runs.append(results.get(timeout=5))
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes):
+                        raise CommandError(f"Benchmark workers exited without results (budget {budget})")
+        finally:
+            for process in processes:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+
+        # The workers start together, so the slowest one bounds the combined throughput
+        elapsed = max(run['elapsed'] for run in runs)
+        return {
+            'throughput': sum(run['images'] for run in runs) / elapsed,
+            'cpu_utilization': sum(run['cpu_time'] for run in runs) / (elapsed * available_cores())
+        }
@@ -0,0 +1,118 @@
+import os
+import traceback
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.services.main import MODEL_CONFIG, default_model_name
+from detection.services.backends import benchmark_yolo, register_export, sample_upload_images
+
+class Command(BaseCommand):
+    help = 'Exports the YOLO detectors to ONNX/OpenVINO for CPU inference, checks output parity and registers the exports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--detector-types', nargs='+', default=['object_detection', 'military_detection'],
+                            help='Detector types whose models are exported')
+        parser.add_argument('--formats', nargs='+', default=['onnx'], choices=['onnx', 'openvino'],
+                            help='Export formats')
+        parser.add_argument('--imgsz', type=int, default=640, help='Model input size')
+        parser.add_argument('--samples', type=int, default=8,
+                            help='Uploaded images used for the parity check and the latency benchmark')
+        parser.add_argument('--runs', type=int, default=20, help='Timed predictions per backend')
+        parser.add_argument('--box-tolerance', type=float, default=1.0,
+                            help='Maximum difference of raw box coordinates, in pixels')
+        parser.add_argument('--score-tolerance', type=float, default=0.01,
+                            help='Maximum difference of raw class scores')
+
+    def handle(self, *args, **options):
+        from ultralytics import YOLO
+
+        samples = sample_upload_images(options['samples'])
+        failures = 0
+
+        for detector_type in options['detector_types']:
+            if detector_type not in MODEL_CONFIG:
+                raise CommandError(f"Unknown detector type: {detector_type}")
+
+            model_name = default_model_name(detector_type)
+            config = MODEL_CONFIG[detector_type][model_name]
+            if config['type'] != 'ultralytics':
+                self.stdout.write(self.style.WARNING(f"Skipping {detector_type}: {config['type']} models cannot be exported"))
+                continue
+            if not os.path.exists(config['model_path']):
+                self.stdout.write(self.style.ERROR(f"Skipping {detector_type}: weights not found at {config['model_path']}"))
+                failures += 1
+                continue
+
+            self.stdout.write(f"Exporting {detector_type}/{model_name} from {config['model_path']}")
+            source_latency = benchmark_yolo(YOLO(config['model_path']), samples, config, options['runs'])
+            self.stdout.write(f"  pytorch: {source_latency:.1f}ms per image")
+
+            for export_format in options['formats']:
+                try:
+                    export_path = str(YOLO(config['model_path']).export(
+                        format=export_format,
+                        imgsz=options['imgsz'],
+                        dynamic=True,
+                        simplify=False
+                    ))
+                    parity = self.check_parity(config['model_path'], export_path, samples, options)
+                    latency = benchmark_yolo(YOLO(export_path, task='detect'), samples, config, options['runs'])
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f"  {export_format}: export failed: {str(e)}"))
+                    self.stderr.write(traceback.format_exc())
+                    failures += 1
+                    continue
+
+                register_export(detector_type, model_name, config, export_format, export_path,
+                                latency, source_latency, parity)
+
+                style = self.style.SUCCESS if parity['passed'] else self.style.ERROR
+                self.stdout.write(style(
+                    f"  {export_format}: {latency:.1f}ms per image ({source_latency / latency:.2f}x), "
+                    f"max box diff {parity['max_box_diff']:.4f}px, max score diff {parity['max_score_diff']:.5f}, "
+                    f"parity {'passed' if parity['passed'] else 'FAILED'} -> {export_path}"
+                ))
+                if not parity['passed']:
+                    failures += 1
+
+        if failures:
+            raise CommandError(f"{failures} export(s) failed or did not match the PyTorch outputs")
+        self.stdout.write(self.style.SUCCESS('Exports registered, get_model will pick the fastest backend'))
+
+    def check_parity(self, source_path, export_path, samples, options):
+        """Compare the raw outputs (boxes and class scores before NMS) of both models on the samples"""
+        import cv2
+        import torch
+        from ultralytics.nn.autobackend import AutoBackend
+
+        device = torch.device('cpu')
+        source = AutoBackend(source_path, device=device, verbose=False)
+        exported = AutoBackend(export_path, device=device, verbose=False)
+
+        imgsz = options['imgsz']
+        batch = np.stack([
+            cv2.cvtColor(cv2.resize(img, (imgsz, imgsz), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+            for img in samples
+        ])
+        inputs = torch.from_numpy(batch).permute(0, 3, 1, 2).float() / 255.0
+
+        max_box_diff = 0.0
+        max_score_diff = 0.0
+        with torch.no_grad():
+            for sample in inputs.split(1):
+                expected, actual = source(sample), exported(sample)
+                expected = expected[0] if isinstance(expected, (list, tuple)) else expected
+                actual = actual[0] if isinstance(actual, (list, tuple)) else actual
+                diff = (torch.as_tensor(expected) - torch.as_tensor(actual)).abs()
+                max_box_diff = max(max_box_diff, float(diff[:, :4].max()))
+                max_score_diff = max(max_score_diff, float(diff[:, 4:].max()))
+
+        return {
+            'passed': max_box_diff <= options['box_tolerance'] and max_score_diff <= options['score_tolerance'],
+            'max_box_diff': max_box_diff,
+            'max_score_diff': max_score_diff,
+            'box_tolerance': options['box_tolerance'],
+            'score_tolerance': options['score_tolerance'],
+            'samples': len(samples)
+        }
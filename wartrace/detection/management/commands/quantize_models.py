@@ -0,0 +1,245 @@
+import os
+import time
+import traceback
+
+import cv2
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.models import Detection
+from detection.services.main import MODEL_CONFIG, default_model_name, model_service, _process_rss_mb, _processable_path
+from detection.services.backends import benchmark_yolo, load_registry, register_export, sample_upload_images
+from detection.services.quantization import (
+    TFLiteClassifier, mean_average_precision, quantize_keras_model, quantize_onnx_model, top1_agreement
+)
+
+class Command(BaseCommand):
+    help = ('Quantizes the YOLO and Keras models to INT8 using uploads as calibration data, '
+            'reports the accuracy delta against stored detections and registers the quantized variants')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--detector-types', nargs='+', default=list(MODEL_CONFIG.keys()),
+                            help='Detector types whose models are quantized')
+        parser.add_argument('--calibration-size', type=int, default=64, help='Uploaded images used for calibration')
+        parser.add_argument('--eval-size', type=int, default=100,
+                            help='Stored detections the quantized models are evaluated against')
+        parser.add_argument('--runs', type=int, default=20, help='Timed predictions per model')
+        parser.add_argument('--imgsz', type=int, default=640, help='YOLO input size')
+        parser.add_argument('--max-drop', type=float, default=0.02,
+                            help='Largest mAP@0.5 / top-1 accuracy drop at which a quantized model can be selected')
+
+    def handle(self, *args, **options):
+        calibration = sample_upload_images(options['calibration_size'])
+        self.stdout.write(f"Calibrating with {len(calibration)} images")
+
+        for detector_type in options['detector_types']:
+            if detector_type not in MODEL_CONFIG:
+                raise CommandError(f"Unknown detector type: {detector_type}")
+
+            model_name = default_model_name(detector_type)
+            config = MODEL_CONFIG[detector_type][model_name]
+            if not os.path.exists(config['model_path']):
+                self.stdout.write(self.style.ERROR(f"Skipping {detector_type}: weights not found at {config['model_path']}"))
+                continue
+
+            try:
+                if config['type'] == 'ultralytics':
+                    report = self.quantize_yolo(detector_type, model_name, config, calibration, options)
+                elif config['type'] == 'keras':
+                    report = self.quantize_keras(detector_type, model_name, config, calibration, options)
+                else:
+                    self.stdout.write(self.style.WARNING(f"Skipping {detector_type}: {config['type']} models are not supported"))
+                    continue
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"{detector_type}: quantization failed: {str(e)}"))
+                self.stderr.write(traceback.format_exc())
+                continue
+
+            self.write_report(detector_type, model_name, report)
+
+    def stored_detections(self, detector_type, model_name, limit):
+        """Images with stored results of this model, used as the reference for the accuracy delta"""
+        detections = (
+            Detection._default_manager
+            .filter(detector_type=detector_type, model_name=model_name)
+            .select_related('marker_file')
+            .prefetch_related('objects', 'classifications')
+            .order_by('-created_at')[:limit]
+        )
+
+        samples = []
+        for detection in detections:
+            file_path = _processable_path(detection.marker_file)
+            img = cv2.imread(file_path) if file_path else None
+            if img is not None:
+                samples.append((img, detection))
+        return samples
+
+    def quantize_yolo(self, detector_type, model_name, config, calibration, options):
+        from ultralytics import YOLO
+
+        # Start from the registered FP32 ONNX export, exporting one if there is none
+        export = load_registry().get(f"{detector_type}/{model_name}", {}).get('exports', {}).get('onnx')
+        models_root = os.path.dirname(config['model_path'])
+        if export and os.path.exists(os.path.join(models_root, export['path'])):
+            fp32_path = os.path.join(models_root, export['path'])
+        else:
+            fp32_path = str(YOLO(config['model_path']).export(format='onnx', imgsz=options['imgsz'], dynamic=True, simplify=False))
+
+        int8_path = f"{os.path.splitext(fp32_path)[0]}_int8.onnx"
+        quantize_onnx_model(fp32_path, int8_path, calibration, options['imgsz'])
+
+        source, source_rss = self.load_measured(lambda: YOLO(config['model_path']))
+        quantized, quantized_rss = self.load_measured(lambda: YOLO(int8_path, task='detect'))
+
+        # mAP@0.5 of both models against the stored boxes, at a low confidence for the full PR curve
+        samples = self.stored_detections(detector_type, model_name, options['eval_size'])
+        references = [
+            [{'label': obj.label, 'bbox': [obj.x_min, obj.y_min, obj.x_max, obj.y_max]} for obj in detection.objects.all()]
+            for _, detection in samples
+        ]
+
+        def predict_all(model):
+            return [
+                model_service._yolo_result_to_detections(model(img, conf=0.001, iou=config.get('iou', 0.45), verbose=False)[0], config)
+                for img, _ in samples
+            ]
+
+        reference_map = quantized_map = None
+        if any(references):
+            reference_map = mean_average_precision(predict_all(source), references)[0]
+            quantized_map = mean_average_precision(predict_all(quantized), references)[0]
+
+        source_latency = benchmark_yolo(source, calibration, config, options['runs'])
+        latency = benchmark_yolo(quantized, calibration, config, options['runs'])
+
+        delta = None if reference_map is None else quantized_map - reference_map
+        accuracy = {
+            # Without stored detections the accuracy cannot be checked, so the variant is never auto-selected
+            'passed': delta is not None and -delta <= options['max_drop'],
+            'metric': 'map50',
+            'reference': reference_map,
+            'quantized': quantized_map,
+            'delta': delta,
+            'eval_images': len(samples),
+            'calibration_images': len(calibration)
+        }
+        register_export(detector_type, model_name, config, 'onnx_int8', int8_path, latency, source_latency, accuracy)
+
+        return {
+            'backend': 'onnx_int8',
+            'path': int8_path,
+            'accuracy': accuracy,
+            'source_latency': source_latency,
+            'latency': latency,
+            'source_size_mb': os.path.getsize(config['model_path']) / (1024 * 1024),
+            'size_mb': os.path.getsize(int8_path) / (1024 * 1024),
+            'source_rss_mb': source_rss,
+            'rss_mb': quantized_rss
+        }
+
+    def quantize_keras(self, detector_type, model_name, config, calibration, options):
+        import tensorflow as tf
+
+        model, source_rss = self.load_measured(lambda: tf.keras.models.load_model(config['model_path']))
+
+        def prepare(images):
+            height, width = model_service._keras_input_size(model, config)
+            batch = np.stack([
+                cv2.cvtColor(cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+                for img in images
+            ])
+            return model_service._normalize_keras_batch(batch, config)
+
+        batches = [prepare(calibration[start:start + 32]) for start in range(0, len(calibration), 32)]
+        int8_path = f"{os.path.splitext(config['model_path'])[0]}_int8.tflite"
+        quantize_keras_model(model, int8_path, batches)
+        quantized, quantized_rss = self.load_measured(lambda: TFLiteClassifier(int8_path))
+
+        # Top-1 agreement of both models with the stored top classification
+        samples = [
+            (img, detection) for img, detection in self.stored_detections(detector_type, model_name, options['eval_size'])
+            if detection.classifications.all()
+        ]
+        references = [max(detection.classifications.all(), key=lambda c: c.confidence).label for _, detection in samples]
+        labels = config.get('labels', [])
+
+        reference_accuracy = quantized_accuracy = None
+        if samples:
+            eval_batch = prepare([img for img, _ in samples])
+            reference_accuracy = top1_agreement(list(model.predict(eval_batch, verbose=0)), references, labels)
+            quantized_accuracy = top1_agreement(list(quantized.predict(eval_batch)), references, labels)
+
+        source_latency = self.benchmark_classifier(lambda batch: model.predict(batch, verbose=0), batches[0], options['runs'])
+        latency = self.benchmark_classifier(quantized.predict, batches[0], options['runs'])
+
+        delta = None if reference_accuracy is None else quantized_accuracy - reference_accuracy
+        accuracy = {
+            'passed': delta is not None and -delta <= options['max_drop'],
+            'metric': 'top1',
+            'reference': reference_accuracy,
+            'quantized': quantized_accuracy,
+            'delta': delta,
+            'eval_images': len(samples),
+            'calibration_images': len(calibration)
+        }
+        register_export(detector_type, model_name, config, 'tflite_int8', int8_path, latency, source_latency, accuracy)
+
+        return {
+            'backend': 'tflite_int8',
+            'path': int8_path,
+            'accuracy': accuracy,
+            'source_latency': source_latency,
+            'latency': latency,
+            'source_size_mb': os.path.getsize(config['model_path']) / (1024 * 1024),
+            'size_mb': os.path.getsize(int8_path) / (1024 * 1024),
+            'source_rss_mb': source_rss,
+            'rss_mb': quantized_rss
+        }
+
+    def load_measured(self, load):
+        """Load a model and return it with the RSS growth it caused, in MB"""
+        rss_before = _process_rss_mb()
+        model = load()
+        return model, max(_process_rss_mb() - rss_before, 0.0)
+
+    def benchmark_classifier(self, predict, batch, runs):
+        """Median per-image prediction time in milliseconds over whole batches"""
+        predict(batch)
+        timings = []
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            predict(batch)
+            timings.append((time.perf_counter() - start_time) * 1000 / len(batch))
+        return float(np.median(timings))
+
+    def write_report(self, detector_type, model_name, report):
+        accuracy = report['accuracy']
+        metric = 'mAP@0.5' if accuracy['metric'] == 'map50' else 'top-1'
+
+        self.stdout.write(f"{detector_type}/{model_name} -> {report['backend']} ({report['path']})")
+        self.stdout.write(
+            f"  latency: {report['source_latency']:.1f}ms -> {report['latency']:.1f}ms per image "
+            f"({report['source_latency'] / report['latency']:.2f}x)"
+        )
+        self.stdout.write(
+            f"  weights: {report['source_size_mb']:.1f}MB -> {report['size_mb']:.1f}MB, "
+            f"RSS on load: {report['source_rss_mb']:.1f}MB -> {report['rss_mb']:.1f}MB"
+        )
+
+        if accuracy['delta'] is None:
+            self.stdout.write(self.style.WARNING(
+                f"  {metric}: no stored {detector_type} results to compare against, variant registered but not selectable"
+            ))
+            return
+
+        style = self.style.SUCCESS if accuracy['passed'] else self.style.ERROR
+        self.stdout.write(style(
+            f"  {metric}: {accuracy['reference']:.3f} -> {accuracy['quantized']:.3f} "
+            f"(delta {accuracy['delta']:+.3f} on {accuracy['eval_images']} images), "
+            f"{'selectable' if accuracy['passed'] else 'not selected: accuracy drop too large'}"
+        ))
+        if accuracy['passed']:
+            self.stdout.write(
+                f"  set 'backend': '{report['backend']}' or 'allow_int8': True in the model's MODEL_CONFIG entry to use it"
+            )
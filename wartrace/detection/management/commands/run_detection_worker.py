@@ -0,0 +1,79 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.services.config import MODEL_CONFIG
+from detection.services.runner import DetectionWorker
+
+class Command(BaseCommand):
+    help = ('Runs queued detection jobs (whole markers and single files) in this process, with the models '
+            'preloaded. SIGTERM drains: no new jobs are claimed and running ones finish, or go back to the '
+            'queue after DETECTION_WORKER_DRAIN_SECONDS; a second SIGTERM requeues them at once')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Jobs run at the same time')
+        parser.add_argument('--detector-types', nargs='+',
+                            help='Models to load before claiming jobs (defaults to DETECTION_PRELOAD_MODELS)')
+        parser.add_argument('--worker-id', help='Identifier stored on claimed jobs (defaults to host:pid)')
+        parser.add_argument('--poll-interval', type=float, help='Seconds between queue polls when idle')
+        parser.add_argument('--heartbeat-interval', type=float, help='Seconds between heartbeats and throughput reports')
+        parser.add_argument('--drain-timeout', type=float,
+                            help='Seconds running jobs get to finish on SIGTERM (0 waits for them)')
+        parser.add_argument('--max-jobs', type=int, help='Exit after claiming this many jobs')
+        parser.add_argument('--exit-when-idle', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--status-file', help='JSON file rewritten at every heartbeat, for health checks')
+
+    def handle(self, *args, **options):
+        from detection.services.main import model_service
+
+        detector_types = options['detector_types']
+        if detector_types is None:
+            detector_types = getattr(settings, 'DETECTION_PRELOAD_MODELS', [])
+        for detector_type in detector_types:
+            if detector_type not in MODEL_CONFIG:
+                raise CommandError(f"Unknown detector type: {detector_type}")
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1")
+
+        worker = DetectionWorker(
+            worker_id=options['worker_id'],
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            heartbeat_interval=options['heartbeat_interval'],
+            drain_timeout=options['drain_timeout'],
+            max_jobs=options['max_jobs'],
+            exit_when_idle=options['exit_when_idle'],
+            status_file=options['status_file'],
+            on_heartbeat=self.write_heartbeat
+        )
+
+        def on_signal(signum, frame):
+            if worker.state == 'draining':
+                self.stdout.write(f"{signal.Signals(signum).name} again, requeueing running jobs")
+                worker.abort()
+            else:
+                self.stdout.write(f"{signal.Signals(signum).name} received, draining")
+                worker.drain()
+
+        signal.signal(signal.SIGTERM, on_signal)
+        signal.signal(signal.SIGINT, on_signal)
+
+        # Concurrent jobs share the cores; load the models before the first job is claimed
+        model_service.configure_threads(options['concurrency'])
+        loaded = model_service.preload(detector_types)
+        self.stdout.write(f"Worker {worker.worker_id} loaded {', '.join(loaded) or 'no models'}")
+
+        stats = worker.run()
+        self.stdout.write(self.style.SUCCESS(
+            f"Worker {worker.worker_id} stopped: {stats['jobs_completed']} jobs completed, {stats['jobs_failed']} failed, "
+            f"{stats['jobs_released']} requeued, {stats['files']} files in {stats['uptime_s']}s"
+        ))
+
+    def write_heartbeat(self, report):
+        self.stdout.write(
+            f"[{report['state']}] {len(report['in_flight'])} running  {report['jobs_completed']} done  "
+            f"{report['jobs_failed']} failed  {report['jobs_per_min']:.1f} jobs/min  {report['files_per_s']:.2f} files/s "
+            f"(overall {report['total_files_per_s']:.2f})  busy {report['utilization']:.0%}  "
+            f"rss {report['memory']['rss_mb']}MB"
+        )
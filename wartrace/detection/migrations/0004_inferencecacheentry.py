@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0003_processingjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InferenceCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_sha256', models.CharField(max_length=64)),
+                ('detector_type', models.CharField(max_length=50)),
+                ('model_name', models.CharField(max_length=100)),
+                ('model_version', models.CharField(max_length=64)),
+                ('params_key', models.CharField(max_length=64)),
+                ('result', models.JSONField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'unique_together': {('file_sha256', 'detector_type', 'model_name', 'model_version', 'params_key')},
+            },
+        ),
+    ]
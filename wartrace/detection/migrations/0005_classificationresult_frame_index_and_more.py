@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0004_inferencecacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classificationresult',
+            name='frame_index',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='classificationresult',
+            name='timestamp',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='objectdetection',
+            name='frame_index',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='objectdetection',
+            name='timestamp',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0004_comment_upvotes_marker_damage_assessment_and_more'),
+        ('detection', '0005_classificationresult_frame_index_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='marker_file',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='processing_jobs', to='content.markerfile'),
+        ),
+    ]
@@ -1,6 +1,6 @@
 from django.db import models
 from django.conf import settings
-from content.models import MarkerFile
+from content.models import Marker, MarkerFile
 import os
 import json
 
@@ -111,6 +111,10 @@ class ObjectDetection(models.Model):
     x_max = models.FloatField()
     y_max = models.FloatField()
     
+    # Video frame the object was found in and its time in seconds (empty for images)
+    frame_index = models.IntegerField(null=True, blank=True)
+    timestamp = models.FloatField(null=True, blank=True)
+    
     # Optional metadata/attributes
     metadata = models.JSONField(null=True, blank=True)
     
@@ -174,6 +178,10 @@ class ClassificationResult(models.Model):
     # Confidence score (0-1) of the classification
     confidence = models.FloatField()
     
+    # Video frame that was classified and its time in seconds (empty for images)
+    frame_index = models.IntegerField(null=True, blank=True)
+    timestamp = models.FloatField(null=True, blank=True)
+    
     # Optional metadata/attributes
     metadata = models.JSONField(null=True, blank=True)
     
@@ -226,3 +234,126 @@ class DetectionConfig(models.Model):
     def get_config(self):
         """Return the configuration as a dictionary"""
         return self.config if isinstance(self.config, dict) else {}
+
+
+class ProcessingJob(models.Model):
+    """
+    A queued request to run AI detection on a marker.
+    Jobs are stored in the database so every web and worker process sees the same state,
+    and workers claim them atomically so a marker is never processed twice at once.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('error', 'Error'),
+    ]
+    
+    # Statuses of jobs that still hold the marker
+    ACTIVE_STATUSES = ['queued', 'processing']
+    
+    # Marker whose files are processed
+    marker = models.ForeignKey(
+        Marker, 
+        on_delete=models.CASCADE, 
+        related_name='processing_jobs'
+    )
+    
+    # Set to process a single file of the marker instead of all of them
+    marker_file = models.ForeignKey(
+        MarkerFile,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='processing_jobs'
+    )
+    
+    # Detector types requested for this job
+    detector_types = models.JSONField(default=list)
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    
+    # Number of times a worker has claimed this job, and how many claims are allowed
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    
+    # Per-file progress
+    files_total = models.PositiveIntegerField(default=0)
+    files_done = models.PositiveIntegerField(default=0)
+    
+    # Summary returned by process_marker (or of the file's detections), or the last error message
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    
+    # Identifier of the worker process that claimed the job
+    worker_id = models.CharField(max_length=100, blank=True)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        constraints = [
+            # Only one queued or running job per marker
+            models.UniqueConstraint(
+                fields=['marker'],
+                condition=models.Q(status__in=['queued', 'processing']),
+                name='unique_active_processing_job'
+            )
+        ]
+    
+    def __str__(self):
+        return f"Processing job {self.id} for {self.marker} ({self.status})"
+    
+    @property
+    def is_active(self):
+        """Check if the job is still queued or running"""
+        return self.status in self.ACTIVE_STATUSES
+    
+    @property
+    def progress(self):
+        """Return progress as a percentage of processed files"""
+        if self.status == 'completed':
+            return 100
+        if not self.files_total:
+            return 0
+        return int(100 * self.files_done / self.files_total)
+
+
+class InferenceCacheEntry(models.Model):
+    """
+    Cached detector output for an image file.
+    Entries are keyed by the file contents, detector, model weights and inference parameters,
+    so identical uploads (also across markers) are not run through the model again.
+    """
+    # SHA-256 of the image file
+    file_sha256 = models.CharField(max_length=64)
+    
+    # Detector and model that produced the result
+    detector_type = models.CharField(max_length=50)
+    model_name = models.CharField(max_length=100)
+    
+    # SHA-256 of the model weights file
+    model_version = models.CharField(max_length=64)
+    
+    # SHA-256 of the thresholds and other inference parameters
+    params_key = models.CharField(max_length=64)
+    
+    # Result dictionary as produced by ModelService (summary, detections, image size, ...)
+    result = models.JSONField()
+    
+    # Number of times this entry was reused
+    hits = models.PositiveIntegerField(default=0)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_hit_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = ('file_sha256', 'detector_type', 'model_name', 'model_version', 'params_key')
+    
+    def __str__(self):
+        return f"{self.detector_type}/{self.model_name} result for {self.file_sha256[:12]}"
@@ -0,0 +1,237 @@
+import os
+import json
+import logging
+import importlib.util
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import model_version
+from .stub import STUB_MODEL_TYPE, stub_model_config, stub_task
+
+logger = logging.getLogger(__name__)
+
+# Model types that run through the ultralytics YOLO wrapper
+YOLO_MODEL_TYPES = ('ultralytics', 'onnx', 'openvino')
+
+# Model types that classify whole images
+CLASSIFIER_MODEL_TYPES = ('keras', 'tflite')
+
+# What to do when a model's weights file is missing: download it by name (YOLO only), fail, or run a stub
+MISSING_WEIGHTS_POLICIES = ('download', 'fail', 'stub')
+
+# Python package each exported backend needs at runtime
+BACKEND_RUNTIMES = {
+    'onnx': 'onnxruntime',
+    'onnx_int8': 'onnxruntime',
+    'openvino': 'openvino',
+    'tflite_int8': 'tensorflow'
+}
+
+# Model type an exported backend is loaded as
+BACKEND_MODEL_TYPES = {
+    'onnx': 'onnx',
+    'onnx_int8': 'onnx',
+    'openvino': 'openvino',
+    'tflite_int8': 'tflite'
+}
+
+# Backend preferences that keep the original weights
+SOURCE_BACKENDS = ('source', 'ultralytics', 'keras')
+
+# Quantized exports, only picked by 'auto' for models with 'allow_int8' in their config
+INT8_BACKENDS = ('onnx_int8', 'tflite_int8')
+
+_registry_cache = {'mtime': None, 'data': {}}
+_registry_lock = threading.Lock()
+
+
+def registry_path() -> str:
+    """Exported models are registered next to the weights they were exported from"""
+    return os.path.join(settings.BASE_DIR, 'detection', 'cv_models', 'exports.json')
+
+
+def load_registry() -> Dict[str, Any]:
+    """Read the export registry, re-reading it only when the file changes"""
+    path = registry_path()
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+
+    with _registry_lock:
+        if _registry_cache['mtime'] != mtime:
+            try:
+                with open(path) as f:
+                    _registry_cache['data'] = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not read model export registry {path}: {str(e)}")
+                _registry_cache['data'] = {}
+            _registry_cache['mtime'] = mtime
+        return _registry_cache['data']
+
+
+def register_export(detector_type: str, model_name: str, source_config: Dict[str, Any], backend: str,
+                    export_path: str, latency_ms: float, source_latency_ms: float, parity: Dict[str, Any]):
+    """
+    Record an exported model in the registry
+
+    Paths are stored relative to the models directory so the registry can be deployed with it.
+    """
+    path = registry_path()
+    models_root = os.path.dirname(path)
+    registry = dict(load_registry())
+
+    entry = registry.setdefault(f"{detector_type}/{model_name}", {})
+    entry['source'] = {
+        'path': os.path.relpath(source_config['model_path'], models_root),
+        'sha256': model_version(source_config, model_name),
+        'latency_ms': source_latency_ms
+    }
+    entry.setdefault('exports', {})[backend] = {
+        'path': os.path.relpath(export_path, models_root),
+        'latency_ms': latency_ms,
+        'parity': parity,
+        'exported_at': timezone.now().isoformat()
+    }
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(registry, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def missing_weights_policy() -> str:
+    policy = getattr(settings, 'DETECTION_MISSING_WEIGHTS', 'download')
+    if policy not in MISSING_WEIGHTS_POLICIES:
+        logger.warning(f"Unknown DETECTION_MISSING_WEIGHTS {policy!r}, expected one of {MISSING_WEIGHTS_POLICIES}")
+        return 'fail'
+    return policy
+
+
+def model_task(model_config: Dict[str, Any]) -> Optional[str]:
+    """Whether a model detects objects ('detect') or classifies whole images ('classify')"""
+    model_type = model_config.get('type')
+    if model_type in YOLO_MODEL_TYPES:
+        return 'detect'
+    if model_type in CLASSIFIER_MODEL_TYPES:
+        return 'classify'
+    if model_type == STUB_MODEL_TYPE:
+        return stub_task(model_config)
+    return None
+
+
+def backend_available(backend: str) -> bool:
+    """Whether the runtime of an exported backend is installed"""
+    runtime = BACKEND_RUNTIMES.get(backend)
+    return runtime is not None and importlib.util.find_spec(runtime) is not None
+
+
+def resolve_model_config(detector_type: str, model_name: str, model_config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pick the backend a model runs on
+
+    With the preference set to 'auto', the registered export with the lowest measured
+    latency is used. Exports only count if they passed the parity (or accuracy) check,
+    their file and runtime are present, and they were exported from the current weights.
+    INT8 exports are left out of 'auto' unless the model config sets 'allow_int8'.
+    A backend name forces that backend when it is usable. The preference is the model's
+    'backend' config entry, or DETECTION_BACKEND.
+
+    With DETECTION_STUB_MODELS, or DETECTION_MISSING_WEIGHTS set to 'stub' and no weights
+    file, a deterministic stub replaces the model (see services/stub.py).
+
+    Returns:
+        The model config, with 'type' and 'model_path' pointing at the chosen backend
+    """
+    if model_config.get('type') == STUB_MODEL_TYPE:
+        return model_config
+    if getattr(settings, 'DETECTION_STUB_MODELS', False) or (
+        missing_weights_policy() == 'stub' and not os.path.exists(model_config['model_path'])
+    ):
+        return stub_model_config(model_config)
+
+    preference = model_config.get('backend', getattr(settings, 'DETECTION_BACKEND', 'auto'))
+    if model_config.get('type') not in ('ultralytics', 'keras') or preference in SOURCE_BACKENDS:
+        return model_config
+
+    entry = load_registry().get(f"{detector_type}/{model_name}")
+    if not entry:
+        return model_config
+
+    if entry['source'].get('sha256') != model_version(model_config, model_name):
+        logger.warning(f"Exports of {detector_type}/{model_name} are stale (weights changed), using the original weights")
+        return model_config
+
+    models_root = os.path.dirname(registry_path())
+    best_backend = None
+    best_latency = entry['source'].get('latency_ms') or float('inf')
+
+    for backend, export in entry.get('exports', {}).items():
+        export_path = os.path.join(models_root, export['path'])
+        if not export.get('parity', {}).get('passed') or not os.path.exists(export_path) or not backend_available(backend):
+            continue
+        if backend == preference:
+            best_backend = backend
+            break
+        if backend in INT8_BACKENDS and not model_config.get('allow_int8'):
+            continue
+        if preference == 'auto' and export['latency_ms'] < best_latency:
+            best_backend, best_latency = backend, export['latency_ms']
+
+    if best_backend is None:
+        return model_config
+
+    export = entry['exports'][best_backend]
+    logger.info(f"Using {best_backend} backend for {detector_type}/{model_name} ({export['latency_ms']:.1f}ms per image)")
+    return dict(
+        model_config,
+        type=BACKEND_MODEL_TYPES.get(best_backend, best_backend),
+        backend=best_backend,
+        model_path=os.path.join(models_root, export['path']),
+        source_model_path=model_config['model_path']
+    )
+
+
+def sample_upload_images(count: int, seed: int = 0) -> List[np.ndarray]:
+    """
+    Decode up to `count` recent uploads to check or calibrate exported models on real data
+
+    Falls back to random noise images when there are not enough uploads.
+    """
+    from content.models import MarkerFile
+    from .main import _processable_path
+
+    images = []
+    for marker_file in MarkerFile.objects.order_by('-id').iterator():
+        if len(images) >= count:
+            break
+        file_path = _processable_path(marker_file)
+        img = cv2.imread(file_path) if file_path else None
+        if img is not None:
+            images.append(img)
+
+    if len(images) < count:
+        logger.warning(f"Only {len(images)} uploaded images available, adding {count - len(images)} random images")
+        rng = np.random.default_rng(seed)
+        images.extend(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8) for _ in range(count - len(images)))
+    return images
+
+
+def benchmark_yolo(model, samples: List[np.ndarray], config: Dict[str, Any], runs: int) -> float:
+    """Median end-to-end YOLO prediction time per image in milliseconds, after one warm-up run"""
+    def predict(img):
+        return model(img, conf=config.get('threshold', 0.30), iou=config.get('iou', 0.45), verbose=False)
+
+    predict(samples[0])
+    timings = []
+    for run in range(runs):
+        start_time = time.perf_counter()
+        predict(samples[run % len(samples)])
+        timings.append((time.perf_counter() - start_time) * 1000)
+    return float(np.median(timings))
@@ -0,0 +1,126 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from ..models import InferenceCacheEntry
+from .stub import STUB_MODEL_TYPE, stub_version
+from .tiling import tile_config
+
+logger = logging.getLogger(__name__)
+
+# Result keys that point at files written for one specific upload and are not reused
+UNCACHED_RESULT_KEYS = ('output_path', 'relative_path')
+
+# Model config entries that don't change a model's output: the weights file is identified
+# by model_version, the rest only affect speed or the admin display
+NON_OUTPUT_CONFIG_KEYS = ('model_path', 'description', 'batch_size', 'latency_ms', 'stub')
+
+# Weights hashes by (path, size, mtime), hashing a model file takes a while
+_model_versions = {}
+_model_versions_lock = threading.Lock()
+
+
+def cache_enabled() -> bool:
+    return getattr(settings, 'DETECTION_RESULT_CACHE', True)
+
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash a file in chunks without loading it into memory"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_version(model_config: Dict[str, Any], model_name: str) -> str:
+    """
+    Identify the weights a model was loaded from
+
+    Models downloaded by name have no local file; their name is used as the version.
+    Stub models are identified by their seed, so their results never match real ones.
+    """
+    if model_config.get('type') == STUB_MODEL_TYPE:
+        return hashlib.sha256(stub_version(model_config, model_name).encode()).hexdigest()
+
+    model_path = model_config.get('model_path')
+    if not model_path or not os.path.exists(model_path):
+        return hashlib.sha256(model_name.encode()).hexdigest()
+
+    stat = os.stat(model_path)
+    key = (model_path, stat.st_size, stat.st_mtime)
+    with _model_versions_lock:
+        if key not in _model_versions:
+            _model_versions[key] = file_sha256(model_path)
+        return _model_versions[key]
+
+
+def params_key(model_config: Dict[str, Any], detector_type: str) -> str:
+    """
+    Hash everything besides the weights that changes a model's output
+
+    That is the whole resolved model config (thresholds, classes, labels, classifier
+    preprocessing, top_k, input_size, backend, ...) except NON_OUTPUT_CONFIG_KEYS, plus the
+    inference resolution and the tiling settings, which can come from outside the config.
+    """
+    params = {key: value for key, value in model_config.items() if key not in NON_OUTPUT_CONFIG_KEYS}
+    params.update(
+        max_side=getattr(settings, 'DETECTION_INFERENCE_MAX_SIDE', 0),
+        tiling=tile_config(detector_type, model_config)
+    )
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_cached_results(file_hashes: Iterable[str], detector_type: str, model_name: str,
+                       version: str, params: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Look up cached results for several files in one query and count the hits
+
+    Returns:
+        Dictionary mapping file hashes to cached result dictionaries
+    """
+    entries = InferenceCacheEntry.objects.filter(
+        file_sha256__in=set(file_hashes),
+        detector_type=detector_type,
+        model_name=model_name,
+        model_version=version,
+        params_key=params
+    )
+    cached = {entry.file_sha256: entry.result for entry in entries}
+
+    if cached:
+        entries.update(hits=F('hits') + 1, last_hit_at=timezone.now())
+    return cached
+
+
+def store_result(file_hash: str, detector_type: str, model_name: str, version: str, params: str,
+                 result: Dict[str, Any]) -> Optional[InferenceCacheEntry]:
+    """Cache a successful result; failed inferences are never cached"""
+    if result.get('error'):
+        return None
+
+    cached_result = {key: value for key, value in result.items() if key not in UNCACHED_RESULT_KEYS}
+    try:
+        entry, _ = InferenceCacheEntry.objects.update_or_create(
+            file_sha256=file_hash,
+            detector_type=detector_type,
+            model_name=model_name,
+            model_version=version,
+            params_key=params,
+            defaults={'result': cached_result}
+        )
+        return entry
+    except IntegrityError:
+        # Another worker cached the same file at the same time
+        return None
+    except Exception as e:
+        logger.warning(f"Could not cache {detector_type} result for {file_hash[:12]}: {str(e)}")
+        return None
@@ -0,0 +1,88 @@
+import os
+import threading
+
+from django.conf import settings
+
+# Model paths and configuration, kept apart from the inference code so views and management
+# commands can read them without importing cv2, numpy or the model backends
+
+MODELS_ROOT = os.path.join(settings.BASE_DIR, 'detection', 'cv_models')
+RESULTS_ROOT = os.path.join(settings.MEDIA_ROOT, 'detection_results')
+
+# Updated Model configuration dictionary with our specific models
+MODEL_CONFIG = {
+    'object_detection': {
+        'yolo11m': {
+            'model_path': os.path.join(MODELS_ROOT, 'yolo11m.pt'),
+            'type': 'ultralytics',
+            'threshold': 0.30,  # Increased confidence threshold
+            'iou': 0.45,  # Added IoU threshold for NMS
+            'description': 'General object recognition (COCO dataset - 80 classes)',
+            # Slicing large orthophotos into overlapping tiles is opt-in, set 'enabled' here or in
+            # DetectionConfig.config['tiling'] (see services/tiling.py)
+            'tiling': {'enabled': False, 'min_side': 4096, 'tile_size': 640, 'overlap': 0.2}
+        }
+    },
+    'military_detection': {
+        'yolo11s_military': {
+            'model_path': os.path.join(MODELS_ROOT, 'yolo11s-military.pt'),
+            'type': 'ultralytics',
+            'threshold': 0.35,  # Higher confidence for more precise military detections
+            'iou': 0.40,  # IoU threshold for NMS
+            'description': 'Military objects detection (specialized model)',
+            'tiling': {'enabled': False, 'min_side': 4096, 'tile_size': 640, 'overlap': 0.2},
+            'classes': [
+                'camouflage_soldier', 'weapon', 'military_tank', 'military_truck', 
+                'military_vehicle', 'civilian', 'soldier', 'civilian_vehicle',
+                'military_artillery', 'trench', 'military_aircraft', 'military_warship'
+            ]
+        }
+    },
+    'damage_assessment': {
+        'xbd_classifier': {
+            'model_path': os.path.join(MODELS_ROOT, 'xbd_damage_classifier.h5'),
+            'type': 'keras',
+            'labels': ['no_damage', 'minor_damage', 'major_damage', 'destroyed'],
+            'description': 'Building damage assessment from satellite imagery'
+        }
+    },
+    'emergency_recognition': {
+        'emergency_net': {
+            'model_path': os.path.join(MODELS_ROOT, 'emergency_net.h5'),
+            'type': 'keras',
+            'labels': ['normal', 'fire', 'flood', 'explosion', 'collapse', 'other_emergency'],
+            'description': 'Emergency situation recognition'
+        }
+    }
+}
+
+
+def default_model_name(detector_type: str) -> str:
+    """Return the name of the model used for a detector type (the first configured one)"""
+    return list(MODEL_CONFIG.get(detector_type, {}).keys())[0]
+
+
+_directories_lock = threading.Lock()
+_directories_ready = False
+
+
+def ensure_detection_directories():
+    """
+    Make sure the models directory and the detection results directories exist
+
+    Called on first use rather than at import, so importing the detection app never
+    touches the filesystem. Only checks the disk once per process.
+    """
+    global _directories_ready
+    if _directories_ready:
+        return
+
+    with _directories_lock:
+        os.makedirs(MODELS_ROOT, exist_ok=True)
+        os.makedirs(RESULTS_ROOT, exist_ok=True)
+
+        # Subdirectories for each detection type and for classifications
+        for detector_type in MODEL_CONFIG.keys():
+            os.makedirs(os.path.join(RESULTS_ROOT, detector_type), exist_ok=True)
+        os.makedirs(os.path.join(RESULTS_ROOT, 'classifications'), exist_ok=True)
+        _directories_ready = True
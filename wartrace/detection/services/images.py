@@ -0,0 +1,117 @@
+import logging
+import threading
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .rasters import RasterImage, is_raster
+
+logger = logging.getLogger(__name__)
+
+
+class DecodedImage:
+    """
+    An image file decoded once and shared by every detector and the annotation renderer.
+
+    The full-resolution array is decoded on first access. When max_side is set, a copy
+    whose longest side is at most max_side is also kept for inference; boxes found on it
+    are scaled back to full resolution with `scale`.
+    """
+
+    def __init__(self, file_path: str, max_side: Optional[int] = None):
+        self.file_path = file_path
+        self.max_side = max_side or None
+        self._array = None
+        self._data = None
+        self._inference_array = None
+        self._scale = 1.0
+        # Detectors running in parallel share the image, it must be decoded only once
+        self._lock = threading.RLock()
+        # Stage timings shared by the detectors (decode_ms), stored with each detection
+        self.timings = {}
+
+    def load(self):
+        """Read the encoded file into memory, so decoding it later doesn't wait on the disk"""
+        with self._lock:
+            if self._array is None and self._data is None:
+                self._data = np.fromfile(self.file_path, dtype=np.uint8)
+
+    @property
+    def array(self) -> np.ndarray:
+        """Full-resolution BGR image"""
+        with self._lock:
+            if self._array is None:
+                if self._data is not None:
+                    self._array = cv2.imdecode(self._data, cv2.IMREAD_COLOR) if self._data.size else None
+                    self._data = None
+                else:
+                    self._array = cv2.imread(self.file_path)
+                if self._array is None:
+                    logger.error(f"Failed to read image: {self.file_path}")
+                    raise ValueError(f"Could not read image file: {self.file_path}")
+            return self._array
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.array.shape
+
+    @property
+    def inference_array(self) -> np.ndarray:
+        """Image passed to the models, pre-resized if max_side is set"""
+        with self._lock:
+            if self._inference_array is None:
+                img = self.array
+                h, w = img.shape[:2]
+
+                if self.max_side and max(h, w) > self.max_side:
+                    self._scale = self.max_side / max(h, w)
+                    size = (max(1, round(w * self._scale)), max(1, round(h * self._scale)))
+                    self._inference_array = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+                else:
+                    self._scale = 1.0
+                    self._inference_array = img
+            return self._inference_array
+
+    @property
+    def scale(self) -> float:
+        """Ratio of inference_array size to full resolution"""
+        self.inference_array
+        return self._scale
+
+    def to_full_resolution(self, bbox):
+        """Map a box found on inference_array back to full-resolution pixels"""
+        scale = self.scale
+        if scale == 1.0:
+            return list(bbox)
+        return [coord / scale for coord in bbox]
+
+    def read_window(self, window) -> np.ndarray:
+        """Full-resolution pixels of an (x1, y1, x2, y2) window"""
+        x1, y1, x2, y2 = window
+        return np.ascontiguousarray(self.array[y1:y2, x1:x2])
+
+    def annotation_view(self) -> Tuple[np.ndarray, float]:
+        """Image to draw annotations on, and the scale of full-resolution boxes on it"""
+        return self.array, 1.0
+
+    def release(self):
+        """Drop the decoded arrays"""
+        self._array = None
+        self._data = None
+        self._inference_array = None
+
+
+def open_image(file_path: str, max_side: Optional[int] = None):
+    """
+    Open an image for detection
+
+    Large TIFF rasters are read window by window through RasterImage; everything else
+    (and TIFF layouts that cannot be windowed) is decoded whole by DecodedImage.
+    """
+    if is_raster(file_path):
+        try:
+            return RasterImage(file_path, max_side)
+        except Exception as e:
+            logger.warning(f"Reading {file_path} without windowing: {str(e)}")
+    return DecodedImage(file_path, max_side)
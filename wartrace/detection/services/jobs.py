@@ -0,0 +1,326 @@
+import os
+import time
+import socket
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ..models import ProcessingJob
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_id() -> str:
+    """Identify the current process in claimed jobs"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_marker_job(marker, detector_types: List[str], marker_file=None) -> Tuple[ProcessingJob, bool]:
+    """
+    Queue a marker for processing
+
+    Args:
+        marker: Marker instance
+        detector_types: List of detector types to use
+        marker_file: Only process this file of the marker (run with process_marker_file)
+
+    Returns:
+        Tuple of the job and whether it was created; if the marker already has a queued
+        or running job, that job is returned instead
+    """
+    try:
+        with transaction.atomic():
+            job = ProcessingJob.objects.create(
+                marker=marker,
+                marker_file=marker_file,
+                detector_types=detector_types,
+                files_total=1 if marker_file is not None else marker.files.count()
+            )
+        logger.info(f"Queued processing job {job.id} for marker {marker.id}")
+        return job, True
+    except IntegrityError:
+        # The unique constraint allows a single active job per marker
+        job = ProcessingJob.objects.filter(marker=marker, status__in=ProcessingJob.ACTIVE_STATUSES).first()
+        if job is None:
+            raise
+        logger.info(f"Marker {marker.id} already has active job {job.id}")
+        return job, False
+
+
+def latest_marker_job(marker_id: int) -> Optional[ProcessingJob]:
+    """Return the most recent processing job of a marker"""
+    return ProcessingJob.objects.filter(marker_id=marker_id).order_by('-created_at', '-id').first()
+
+
+def requeue_stale_jobs(stale_after: Optional[int] = None) -> int:
+    """
+    Recover jobs whose worker stopped sending heartbeats (crash, restart, deploy)
+
+    Jobs with attempts left go back to the queue, the others are marked as failed.
+
+    Returns:
+        Number of recovered jobs
+    """
+    if stale_after is None:
+        stale_after = getattr(settings, 'DETECTION_JOB_STALE_SECONDS', 600)
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    stale = ProcessingJob.objects.filter(status='processing', heartbeat_at__lt=cutoff)
+
+    requeued = stale.filter(attempts__lt=F('max_attempts')).update(status='queued', worker_id='')
+    failed = stale.update(
+        status='error',
+        error='Worker stopped responding',
+        finished_at=timezone.now()
+    )
+
+    if requeued or failed:
+        logger.warning(f"Recovered stale processing jobs: {requeued} requeued, {failed} failed")
+    return requeued + failed
+
+
+def claim_job(worker_id: Optional[str] = None) -> Optional[ProcessingJob]:
+    """
+    Atomically claim the oldest queued job
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED where the database supports it (PostgreSQL),
+    otherwise a conditional UPDATE that only one process can win (SQLite).
+
+    Args:
+        worker_id: Identifier stored on the claimed job
+
+    Returns:
+        The claimed job, or None if the queue is empty
+    """
+    worker_id = worker_id or default_worker_id()
+    requeue_stale_jobs()
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = (
+                ProcessingJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(status='queued')
+                .order_by('created_at', 'id')
+                .first()
+            )
+            if job is None:
+                return None
+
+            now = timezone.now()
+            job.status = 'processing'
+            job.attempts += 1
+            job.worker_id = worker_id
+            job.started_at = now
+            job.heartbeat_at = now
+            job.error = ''
+            job.save(update_fields=['status', 'attempts', 'worker_id', 'started_at', 'heartbeat_at', 'error'])
+            return job
+
+    candidate_ids = list(
+        ProcessingJob.objects.filter(status='queued').order_by('created_at', 'id').values_list('id', flat=True)[:10]
+    )
+    for job_id in candidate_ids:
+        now = timezone.now()
+        claimed = ProcessingJob.objects.filter(id=job_id, status='queued').update(
+            status='processing',
+            attempts=F('attempts') + 1,
+            worker_id=worker_id,
+            started_at=now,
+            heartbeat_at=now,
+            error=''
+        )
+        if claimed:
+            return ProcessingJob.objects.get(id=job_id)
+
+    return None
+
+
+def update_job_progress(job_id: int, files_done: int, files_total: int):
+    """Store per-file progress and refresh the job heartbeat"""
+    ProcessingJob.objects.filter(id=job_id).update(
+        files_done=files_done,
+        files_total=files_total,
+        heartbeat_at=timezone.now()
+    )
+
+
+def _held_job(job: ProcessingJob):
+    """The job's row, if the worker that claimed it still holds it (not released, recovered or reclaimed)"""
+    return ProcessingJob.objects.filter(id=job.id, status='processing', worker_id=job.worker_id)
+
+
+def complete_job(job: ProcessingJob, result: Dict[str, Any]) -> bool:
+    """
+    Mark a job as completed
+
+    Only applies while the worker still holds the job, so a job that was released or recovered
+    as stale (and maybe claimed again) is not overwritten by a late result.
+
+    Returns:
+        Whether the job was marked as completed
+    """
+    finished_at = timezone.now()
+    completed = _held_job(job).update(status='completed', result=result, finished_at=finished_at)
+    if not completed:
+        logger.warning(f"Job {job.id} is no longer held by worker {job.worker_id}, dropping its result")
+        return False
+
+    job.status = 'completed'
+    job.result = result
+    job.finished_at = finished_at
+    return True
+
+
+def release_job(job_id: int, worker_id: str) -> bool:
+    """
+    Put a job a worker is giving up on back in the queue (e.g. a worker stopping for a deploy)
+
+    The interrupted attempt does not count against max_attempts. Only releases the job if
+    the worker still holds it.
+
+    Returns:
+        Whether the job was requeued
+    """
+    released = ProcessingJob.objects.filter(id=job_id, status='processing', worker_id=worker_id).update(
+        status='queued',
+        worker_id='',
+        attempts=F('attempts') - 1
+    )
+    if released:
+        logger.warning(f"Job {job_id} released by worker {worker_id}, requeued")
+    return bool(released)
+
+
+def touch_jobs(job_ids: List[int]) -> int:
+    """Refresh the heartbeat of running jobs, so they are not recovered as stale while a long file is processed"""
+    return ProcessingJob.objects.filter(id__in=job_ids, status='processing').update(heartbeat_at=timezone.now())
+
+
+@contextmanager
+def job_heartbeat(job_id: int, interval: Optional[float] = None):
+    """
+    Refresh a job's heartbeat from a background thread while the block runs
+
+    Progress updates only refresh it between batches of files, and a single large file can
+    take longer than DETECTION_JOB_STALE_SECONDS. DetectionWorker sends its own heartbeats.
+    """
+    if interval is None:
+        interval = getattr(settings, 'DETECTION_WORKER_HEARTBEAT_SECONDS', 30.0)
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                try:
+                    touch_jobs([job_id])
+                except Exception as e:
+                    logger.error(f"Could not refresh the heartbeat of job {job_id}: {str(e)}")
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f"job-heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def fail_job(job: ProcessingJob, error: str) -> bool:
+    """
+    Requeue a failed job if it has attempts left, otherwise mark it as failed
+
+    Like complete_job, only applies while the worker still holds the job.
+
+    Returns:
+        Whether the failure was recorded
+    """
+    if job.attempts < job.max_attempts:
+        changes = {'status': 'queued', 'worker_id': '', 'error': error}
+    else:
+        changes = {'status': 'error', 'error': error, 'finished_at': timezone.now()}
+
+    if not _held_job(job).update(**changes):
+        logger.warning(f"Job {job.id} is no longer held by worker {job.worker_id}, dropping its failure: {error}")
+        return False
+
+    for field, value in changes.items():
+        setattr(job, field, value)
+    if job.status == 'queued':
+        logger.warning(f"Job {job.id} failed (attempt {job.attempts}/{job.max_attempts}), requeued: {error}")
+    else:
+        logger.error(f"Job {job.id} failed after {job.attempts} attempts: {error}")
+    return True
+
+
+def process_job(job: ProcessingJob) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Run a claimed job and record its outcome
+
+    Jobs with a marker_file run process_marker_file on that file, the others process_marker.
+
+    Returns:
+        Tuple of the summary returned by process_marker (None if the job failed) and whether
+        the outcome was recorded; it is dropped if the worker no longer holds the job
+    """
+    from .main import process_marker, process_marker_file
+
+    logger.info(f"Worker {job.worker_id} processing job {job.id} for marker {job.marker_id}")
+
+    def on_progress(files_done, files_total):
+        update_job_progress(job.id, files_done, files_total)
+
+    try:
+        if job.marker_file_id is not None:
+            # Same summary as process_marker, for the one file
+            start_time = time.time()
+            detections = process_marker_file(job.marker_file, job.detector_types)
+            on_progress(1, 1)
+            result = {
+                'processed': 1 if detections else 0,
+                'detections': len(detections),
+                'errors': 0,
+                'processing_time': f"{time.time() - start_time:.2f}s",
+                'marker_file_id': job.marker_file_id
+            }
+        else:
+            result = process_marker(job.marker, detector_types=job.detector_types, progress_callback=on_progress)
+        return result, complete_job(job, result)
+    except Exception as e:
+        logger.error(f"Error processing job {job.id}: {str(e)}")
+        logger.error(traceback.format_exc())
+        return None, fail_job(job, str(e))
+
+
+def run_queued_jobs(worker_id: Optional[str] = None, max_jobs: Optional[int] = None) -> int:
+    """
+    Claim and process queued jobs until the queue is empty
+
+    Args:
+        worker_id: Identifier stored on claimed jobs
+        max_jobs: Stop after this many jobs
+
+    Returns:
+        Number of processed jobs
+    """
+    worker_id = worker_id or default_worker_id()
+    processed = 0
+
+    while max_jobs is None or processed < max_jobs:
+        job = claim_job(worker_id)
+        if job is None:
+            break
+        with job_heartbeat(job.id):
+            process_job(job)
+        processed += 1
+
+    return processed
@@ -1,172 +1,172 @@
 import os
+import gc
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2
 from pathlib import Path
-from typing import Dict, List, Tuple, Any, Union, Optional
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Tuple, Any, Union, Optional
 import logging
 import traceback
 import random
 import time
 
 from django.conf import settings
+from django.db import connection, transaction
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 
 from ..models import Detection, ObjectDetection, ClassificationResult
+from .config import MODEL_CONFIG, MODELS_ROOT, RESULTS_ROOT, default_model_name, ensure_detection_directories
+from .images import DecodedImage, open_image
+from .rendering import COLOR_PALETTE, draw_modern_annotations
+from .tiling import detect_tiled, should_tile, tile_config
+from .backends import missing_weights_policy, model_task, resolve_model_config
+from .cache import cache_enabled, file_sha256, get_cached_results, model_version, params_key, store_result
+from .stub import load_stub_model
+from .threads import apply_thread_budget, configure_tensorflow, thread_budget
+from .video import VIDEO_EXTENSIONS, VideoFrame, is_video, iter_keyframes, video_info, video_sampling
 
 logger = logging.getLogger(__name__)
 
-# Define the paths
-MODELS_ROOT = os.path.join(settings.BASE_DIR, 'detection', 'cv_models')
-RESULTS_ROOT = os.path.join(settings.MEDIA_ROOT, 'detection_results')
-
-# Ensure directories exist
-os.makedirs(MODELS_ROOT, exist_ok=True)
-os.makedirs(RESULTS_ROOT, exist_ok=True)
-
-# Updated Model configuration dictionary with our specific models
-MODEL_CONFIG = {
-    'object_detection': {
-        'yolo11m': {
-            'model_path': os.path.join(MODELS_ROOT, 'yolo11m.pt'),
-            'type': 'ultralytics',
-            'threshold': 0.30,  # Increased confidence threshold
-            'iou': 0.45,  # Added IoU threshold for NMS
-            'description': 'General object recognition (COCO dataset - 80 classes)'
-        }
-    },
-    'military_detection': {
-        'yolo11s_military': {
-            'model_path': os.path.join(MODELS_ROOT, 'yolo11s-military.pt'),
-            'type': 'ultralytics',
-            'threshold': 0.35,  # Higher confidence for more precise military detections
-            'iou': 0.40,  # IoU threshold for NMS
-            'description': 'Military objects detection (specialized model)',
-            'classes': [
-                'camouflage_soldier', 'weapon', 'military_tank', 'military_truck', 
-                'military_vehicle', 'civilian', 'soldier', 'civilian_vehicle',
-                'military_artillery', 'trench', 'military_aircraft', 'military_warship'
-            ]
-        }
-    },
-    'damage_assessment': {
-        'xbd_classifier': {
-            'model_path': os.path.join(MODELS_ROOT, 'xbd_damage_classifier.h5'),
-            'type': 'keras',
-            'labels': ['no_damage', 'minor_damage', 'major_damage', 'destroyed'],
-            'description': 'Building damage assessment from satellite imagery'
-        }
-    },
-    'emergency_recognition': {
-        'emergency_net': {
-            'model_path': os.path.join(MODELS_ROOT, 'emergency_net.h5'),
-            'type': 'keras',
-            'labels': ['normal', 'fire', 'flood', 'explosion', 'collapse', 'other_emergency'],
-            'description': 'Emergency situation recognition'
-        }
-    }
-}
+def _peak_rss_mb() -> Optional[float]:
+    """Return the peak resident memory of the current process in MB, where the platform reports it"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
 
-# Ensure detection results directories exist
-def ensure_detection_directories():
-    """Make sure all required directories for detection results exist"""
-    # Main results directory
-    os.makedirs(RESULTS_ROOT, exist_ok=True)
-    
-    # Create subdirectories for each detection type
-    for detector_type in MODEL_CONFIG.keys():
-        detector_dir = os.path.join(RESULTS_ROOT, detector_type)
-        os.makedirs(detector_dir, exist_ok=True)
-    
-    # Directory for classifications
-    classifications_dir = os.path.join(RESULTS_ROOT, 'classifications')
-    os.makedirs(classifications_dir, exist_ok=True)
+def _elapsed_ms(start_time: float) -> float:
+    """Milliseconds since a time.perf_counter() reading"""
+    return (time.perf_counter() - start_time) * 1000
 
-# Call this function to ensure directories exist when the module is loaded
-ensure_detection_directories()
+def _process_rss_mb() -> float:
+    """Return the resident memory of the current process in MB"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        import resource
+        # ru_maxrss is the peak RSS in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
 
-# Modern color palette for object visualization (RGBA for overlay transparency handling)
-COLOR_PALETTE = {
-    # Military object colors - using more modern, distinct colors with reduced transparency
-    'camouflage_soldier': (52, 96, 73, 0.5),     # Camo green
-    'weapon': (145, 30, 30, 0.6),                # Dark red
-    'military_tank': (94, 23, 35, 0.6),          # Burgundy
-    'military_truck': (155, 62, 21, 0.6),        # Rust
-    'military_vehicle': (201, 70, 24, 0.6),      # Orange-red
-    'civilian': (20, 158, 140, 0.5),             # Teal
-    'soldier': (38, 82, 153, 0.5),               # Blue
-    'civilian_vehicle': (76, 175, 80, 0.5),      # Green
-    'military_artillery': (110, 28, 36, 0.6),    # Brown-red
-    'trench': (94, 78, 23, 0.5),                 # Brown
-    'military_aircraft': (48, 63, 159, 0.5),     # Royal blue
-    'military_warship': (26, 35, 126, 0.5),      # Navy blue
-    
-    # Common COCO object colors with reduced transparency
-    'person': (63, 81, 181, 0.5),                # Indigo
-    'bicycle': (33, 150, 243, 0.5),              # Blue
-    'car': (0, 188, 212, 0.5),                   # Cyan
-    'motorcycle': (0, 150, 136, 0.5),            # Teal
-    'airplane': (76, 175, 80, 0.5),              # Green
-    'bus': (139, 195, 74, 0.5),                  # Light green
-    'train': (205, 220, 57, 0.5),                # Lime
-    'truck': (255, 235, 59, 0.5),                # Yellow
-    'boat': (255, 193, 7, 0.5),                  # Amber
-    'traffic light': (255, 152, 0, 0.5),         # Orange
-    'fire hydrant': (255, 87, 34, 0.5),          # Deep orange
-    'stop sign': (244, 67, 54, 0.5),             # Red
-    'bench': (156, 39, 176, 0.5),                # Purple
-    
-    # Default for other classes
-    'default': (158, 158, 158, 0.5)              # Gray
-}
+def _model_memory_mb(model, model_type: str, rss_delta_mb: float) -> float:
+    """Estimate the memory held by a model from its weights, falling back to the measured RSS growth"""
+    try:
+        if model_type == 'ultralytics':
+            module = model.model
+            weight_bytes = sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+            return weight_bytes / (1024 * 1024)
+        if model_type == 'keras':
+            # Keras weights are float32
+            return model.count_params() * 4 / (1024 * 1024)
+    except Exception as e:
+        logger.warning(f"Could not measure model weights, using RSS growth instead: {str(e)}")
+    return max(rss_delta_mb, 0.0)
 
 class ModelService:
     """Service for handling ML model operations"""
     
-    def __init__(self):
-        self.loaded_models = {}
+    def __init__(self, max_memory_mb: Optional[float] = None):
+        # Loaded models in least-recently-used order (oldest first)
+        self.loaded_models = OrderedDict()
+        self.max_memory_mb = max_memory_mb
+        self._lock = threading.RLock()
+        # Per-model concurrency limits and the threads running detectors side by side
+        self._model_slots = {}
+        self._executor = None
+        self._executor_workers = 0
+        # Threads per backend, set before the first model loads (see services/threads.py)
+        self.thread_budget = None
+        self.thread_settings = None
         logger.info("Model service initialized")
     
+    @property
+    def memory_budget_mb(self) -> float:
+        """Memory budget for loaded models in MB (0 means unlimited)"""
+        if self.max_memory_mb is not None:
+            return self.max_memory_mb
+        return getattr(settings, 'DETECTION_MODEL_MEMORY_MB', 0)
+    
+    def configure_threads(self, workers: Optional[int] = None, budget: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """
+        Size the torch/TensorFlow/OpenCV thread pools of this process
+        
+        Args:
+            workers: Number of worker processes sharing the CPU (defaults to DETECTION_WORKER_PROCESSES)
+            budget: Explicit 'intra_op'/'inter_op' thread counts, overriding the settings
+            
+        Returns:
+            The thread budget in use
+        """
+        with self._lock:
+            self.thread_budget = budget or thread_budget(workers)
+            self.thread_settings = apply_thread_budget(self.thread_budget)
+            return self.thread_budget
+    
     def get_model(self, detector_type: str, model_name: str = None) -> Any:
         """Load and cache a model based on detector type and model name"""
         # Use first available model if model_name not specified
         if model_name is None:
-            model_name = list(MODEL_CONFIG.get(detector_type, {}).keys())[0]
+            model_name = default_model_name(detector_type)
         
         model_key = f"{detector_type}_{model_name}"
         logger.info(f"Requesting model: {model_key}")
         
-        # Return cached model if already loaded
-        if (model_key in self.loaded_models):
-            logger.info(f"Using cached model: {model_key}")
-            return self.loaded_models[model_key]
+        with self._lock:
+            # Return cached model if already loaded
+            if (model_key in self.loaded_models):
+                logger.info(f"Using cached model: {model_key}")
+                model_data = self.loaded_models[model_key]
+                self.loaded_models.move_to_end(model_key)
+                model_data['last_used'] = time.time()
+                model_data['uses'] += 1
+                return model_data
+            
+            return self._load_model(detector_type, model_name, model_key)
+    
+    def _load_model(self, detector_type: str, model_name: str, model_key: str) -> Any:
+        """Load a model, cache it and evict least recently used models over the memory budget"""
+        ensure_detection_directories()
         
         # Get model config
         try:
-            model_config = MODEL_CONFIG[detector_type][model_name]
+            # Exported ONNX/OpenVINO variants replace the PyTorch weights when they are faster
+            model_config = resolve_model_config(detector_type, model_name, MODEL_CONFIG[detector_type][model_name])
         except KeyError:
             logger.error(f"Model not found: {detector_type}/{model_name}")
             return None
         
+        # Thread pools must be sized before the first model starts them
+        if self.thread_budget is None:
+            self.configure_threads()
+        
         # Load model based on type
         model_path = model_config['model_path']
         model_type = model_config['type']
+        rss_before = _process_rss_mb()
+        start_time = time.time()
         
         try:
             if model_type == 'ultralytics':
                 try:
                     from ultralytics import YOLO
-                    start_time = time.time()
                     
                     if os.path.exists(model_path):
                         logger.info(f"Loading YOLO model from {model_path}")
                         model = YOLO(model_path)
                         logger.info(f"Loaded YOLO model from {model_path} in {time.time() - start_time:.2f}s")
-                    else:
+                    elif missing_weights_policy() == 'download':
                         # If model file doesn't exist, attempt to download it
                         logger.warning(f"Model file not found at {model_path}, attempting to download")
                         model = YOLO(model_name)  # This will try to download from ultralytics
+                    else:
+                        logger.error(f"YOLO model file not found: {model_path}")
+                        return None
                 except ImportError:
                     logger.error("Ultralytics package not installed, please install with: pip install ultralytics")
                     return None
@@ -174,9 +174,32 @@ class ModelService:
                     logger.error(f"Error loading YOLO model: {str(e)}")
                     logger.error(traceback.format_exc())
                     return None
+            elif model_type in ('onnx', 'openvino'):
+                try:
+                    from ultralytics import YOLO
+                    
+                    # Exported graphs run on CPU through the same YOLO interface
+                    model = YOLO(model_path, task='detect')
+                    logger.info(f"Loaded {model_type} model from {model_path} in {time.time() - start_time:.2f}s")
+                except Exception as e:
+                    logger.error(f"Error loading {model_type} model: {str(e)}")
+                    logger.error(traceback.format_exc())
+                    return None
+            elif model_type == 'tflite':
+                try:
+                    from .quantization import TFLiteClassifier
+                    
+                    # Quantized classifiers run through the same predict() interface as Keras
+                    model = TFLiteClassifier(model_path, num_threads=self.thread_budget['intra_op'])
+                    logger.info(f"Loaded TFLite model from {model_path} in {time.time() - start_time:.2f}s")
+                except Exception as e:
+                    logger.error(f"Error loading TFLite model: {str(e)}")
+                    logger.error(traceback.format_exc())
+                    return None
             elif model_type == 'keras':
                 try:
                     import tensorflow as tf
+                    configure_tensorflow(self.thread_budget)
                     if os.path.exists(model_path):
                         model = tf.keras.models.load_model(model_path)
                         logger.info(f"Loaded Keras model from {model_path}")
@@ -190,15 +213,33 @@ class ModelService:
                     logger.error(f"Error loading Keras model: {str(e)}")
                     logger.error(traceback.format_exc())
                     return None
+            elif model_type == 'stub':
+                # Deterministic stand-in that needs no weights, for offline tests and load tests
+                model = load_stub_model(model_config)
+                logger.info(f"Loaded stub {model_config.get('task', 'model')} for {detector_type}/{model_name}")
             else:
                 logger.error(f"Unsupported model type: {model_type}")
                 return None
-                
+            
+            load_time = time.time() - start_time
+            memory_mb = _model_memory_mb(model, model_type, _process_rss_mb() - rss_before)
+            
             # Cache the loaded model
             self.loaded_models[model_key] = {
                 'model': model,
-                'config': model_config
+                'config': model_config,
+                'detector_type': detector_type,
+                'model_name': model_name,
+                'memory_mb': memory_mb,
+                'load_time': load_time,
+                'warmup_time': None,
+                'loaded_at': time.time(),
+                'last_used': time.time(),
+                'uses': 1
             }
+            logger.info(f"Cached model {model_key} ({memory_mb:.1f} MB, loaded in {load_time:.2f}s)")
+            
+            self._evict_over_budget(keep=model_key)
             
             return self.loaded_models[model_key]
         except Exception as e:
@@ -206,6 +247,122 @@ class ModelService:
             logger.error(traceback.format_exc())
             return None
     
+    def _evict_over_budget(self, keep: Optional[str] = None):
+        """Unload least recently used models until the loaded models fit in the memory budget"""
+        budget = self.memory_budget_mb
+        if not budget:
+            return
+        
+        with self._lock:
+            total = sum(data['memory_mb'] for data in self.loaded_models.values())
+            for model_key in list(self.loaded_models.keys()):
+                if total <= budget:
+                    break
+                if model_key == keep:
+                    continue
+                
+                evicted = self.loaded_models.pop(model_key)
+                total -= evicted['memory_mb']
+                logger.info(f"Evicted model {model_key} ({evicted['memory_mb']:.1f} MB) to stay within {budget} MB")
+            
+            if total > budget:
+                logger.warning(f"Loaded models use {total:.1f} MB, more than the {budget} MB budget")
+        
+        gc.collect()
+    
+    def unload_model(self, detector_type: str, model_name: str) -> bool:
+        """Remove a model from the cache"""
+        with self._lock:
+            removed = self.loaded_models.pop(f"{detector_type}_{model_name}", None)
+        if removed is not None:
+            gc.collect()
+        return removed is not None
+    
+    def preload(self, detector_types: Optional[List[str]] = None, warm_up: bool = True) -> List[str]:
+        """
+        Load models ahead of the first request
+        
+        Args:
+            detector_types: Detector types to load (defaults to DETECTION_PRELOAD_MODELS)
+            warm_up: Run a dummy inference after loading each model
+            
+        Returns:
+            Keys of the loaded models
+        """
+        if detector_types is None:
+            detector_types = getattr(settings, 'DETECTION_PRELOAD_MODELS', [])
+        
+        loaded = []
+        for detector_type in detector_types:
+            if detector_type not in MODEL_CONFIG:
+                logger.warning(f"Cannot preload unknown detector type: {detector_type}")
+                continue
+            
+            model_data = self.get_model(detector_type)
+            if not model_data:
+                continue
+            
+            if warm_up:
+                self.warm_up(model_data)
+            loaded.append(f"{detector_type}_{model_data['model_name']}")
+        
+        logger.info(f"Preloaded models: {loaded}")
+        return loaded
+    
+    def warm_up(self, model_data: Dict[str, Any]):
+        """Run a dummy inference so lazy initialisation happens before the first real request"""
+        model = model_data['model']
+        config = model_data['config']
+        start_time = time.time()
+        
+        try:
+            if model_task(config) == 'detect':
+                dummy = np.zeros((640, 640, 3), dtype=np.uint8)
+                model(dummy, conf=config.get('threshold', 0.30), iou=config.get('iou', 0.45), verbose=False)
+            elif model_task(config) == 'classify':
+                input_shape = tuple(dim or 1 for dim in model.input_shape[1:])
+                model.predict(np.zeros((1,) + input_shape, dtype=np.float32), verbose=0)
+            
+            model_data['warmup_time'] = time.time() - start_time
+            logger.info(f"Warmed up {model_data['detector_type']}_{model_data['model_name']} in {model_data['warmup_time']:.2f}s")
+        except Exception as e:
+            logger.error(f"Error warming up model: {str(e)}")
+            logger.error(traceback.format_exc())
+    
+    def status(self) -> Dict[str, Any]:
+        """Describe the loaded models, their memory use and the running detection pipelines"""
+        from .pipeline import pipeline_status
+        from .preload import memory_usage, preload_status
+        
+        with self._lock:
+            models = [
+                {
+                    'key': model_key,
+                    'detector_type': data['detector_type'],
+                    'model_name': data['model_name'],
+                    'type': data['config']['type'],
+                    'memory_mb': round(data['memory_mb'], 1),
+                    'load_time': round(data['load_time'], 3),
+                    'warmup_time': round(data['warmup_time'], 3) if data['warmup_time'] is not None else None,
+                    'loaded_at': data['loaded_at'],
+                    'last_used': data['last_used'],
+                    'uses': data['uses']
+                }
+                for model_key, data in self.loaded_models.items()
+            ]
+        
+        return {
+            'pid': os.getpid(),
+            'models': models,
+            'total_memory_mb': round(sum(model['memory_mb'] for model in models), 1),
+            'memory_budget_mb': self.memory_budget_mb,
+            'process_rss_mb': round(_process_rss_mb(), 1),
+            'memory': memory_usage(),
+            'preloaded': preload_status(),
+            'threads': self.thread_settings,
+            'pipelines': pipeline_status()
+        }
+    
     def process_image(self, file_path: str, detector_types: List[str]) -> Dict[str, Any]:
         """
         Process an image with multiple detector types
@@ -217,494 +374,1208 @@ class ModelService:
         Returns:
             Dictionary of results per detector type
         """
-        logger.info(f"Processing image {file_path} with detector types: {detector_types}")
+        return self.process_images([file_path], detector_types, batch_size=1).get(file_path, {})
+    
+    def process_images(self, file_paths: List[str], detector_types: List[str],
+                       batch_size: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Process several images with multiple detector types, batching images per forward pass
+        
+        Each image is decoded once per batch and the decoded array is shared by every
+        detector type and by the annotation renderer.
+        
+        Args:
+            file_paths: Paths to the image files
+            detector_types: List of detector types to use
+            batch_size: Maximum number of images per forward pass (defaults to DETECTION_BATCH_SIZE)
+            
+        Returns:
+            Dictionary mapping each file path to its results per detector type
+        """
+        if batch_size is None:
+            batch_size = getattr(settings, 'DETECTION_BATCH_SIZE', 8)
+        batch_size = max(1, int(batch_size))
+        max_side = getattr(settings, 'DETECTION_INFERENCE_MAX_SIDE', 0)
+        
+        logger.info(f"Processing {len(file_paths)} images with detector types: {detector_types} (batch size {batch_size})")
         results = {}
         
-        # Process each detector type
-        for detector_type in detector_types:
-            if detector_type not in MODEL_CONFIG:
-                logger.warning(f"Unknown detector type: {detector_type}")
-                continue
+        # Classifier inputs are small, so they are collected over all decode batches and
+        # predicted together instead of once per batch
+        classifier_types = [detector_type for detector_type in detector_types if self._is_classifier(detector_type)]
+        image_types = [detector_type for detector_type in detector_types if detector_type not in classifier_types]
+        classifier_models = {detector_type: self.get_model(detector_type) for detector_type in classifier_types}
+        classifier_inputs = {detector_type: [] for detector_type in classifier_types}
+        
+        for batch_start in range(0, len(file_paths), batch_size):
+            batch_paths = file_paths[batch_start:batch_start + batch_size]
+            images = [open_image(file_path, max_side=max_side) for file_path in batch_paths]
+            
+            try:
+                if image_types:
+                    batch_results = self.process_decoded_images(images, image_types)
+                else:
+                    batch_results = [{} for _ in images]
                 
-            # Get the first model for this detector type
-            model_name = list(MODEL_CONFIG[detector_type].keys())[0]
-            model_data = self.get_model(detector_type, model_name)
+                for detector_type, model_data in classifier_models.items():
+                    if model_data:
+                        classifier_inputs[detector_type].extend(
+                            self._prepare_keras_inputs(images, model_data['model'], model_data['config'])
+                        )
+            finally:
+                # Free the decoded frames before decoding the next batch
+                for image in images:
+                    image.release()
             
+            results.update(zip(batch_paths, batch_results))
+        
+        for detector_type, model_data in classifier_models.items():
             if not model_data:
                 logger.warning(f"No model loaded for {detector_type}, skipping")
                 continue
-                
-            model = model_data['model']
-            config = model_data['config']
             
-            # Process with the appropriate method based on detector type
             try:
-                if detector_type in ['object_detection', 'military_detection']:
-                    if config['type'] == 'ultralytics':
-                        # Process with YOLO model
-                        result = self._process_with_yolo(file_path, detector_type, model, config)
-                    else:
-                        logger.warning(f"Unsupported model type for {detector_type}: {config['type']}")
-                        continue
-                elif detector_type in ['damage_assessment', 'emergency_recognition']:
-                    if config['type'] == 'keras':
-                        # Process with Keras model
-                        result = self._process_with_keras(file_path, detector_type, model, config)
-                    else:
-                        logger.warning(f"Unsupported model type for {detector_type}: {config['type']}")
-                        continue
-                
-                results[detector_type] = {
+                with self._model_slot(f"{detector_type}_{model_data['model_name']}", model_data['config']):
+                    outputs = self._classify_prepared(
+                        classifier_inputs[detector_type], detector_type, model_data['model'], model_data['config']
+                    )
+            except Exception as e:
+                logger.error(f"Error processing {detector_type} for {len(file_paths)} images: {str(e)}")
+                logger.error(traceback.format_exc())
+                continue
+            
+            for file_path, output in zip(file_paths, outputs):
+                results[file_path][detector_type] = {
+                    'model_name': model_data['model_name'],
+                    'result': output
+                }
+        
+        return results
+    
+    def process_video(self, file_path: str, detector_types: List[str],
+                      batch_size: Optional[int] = None) -> Iterator[Tuple[VideoFrame, Dict[str, Any]]]:
+        """
+        Process the sampled frames of a video, batching frames per forward pass
+        
+        Frames are streamed from the file and released once their batch is processed, so
+        only one batch of frames is in memory at a time.
+        
+        Args:
+            file_path: Path to the video file
+            detector_types: List of detector types to use
+            batch_size: Maximum number of frames per forward pass (defaults to DETECTION_BATCH_SIZE)
+            
+        Yields:
+            Each sampled frame (already released) with its results per detector type
+        """
+        if batch_size is None:
+            batch_size = getattr(settings, 'DETECTION_BATCH_SIZE', 8)
+        batch_size = max(1, int(batch_size))
+        max_side = getattr(settings, 'DETECTION_INFERENCE_MAX_SIDE', 0)
+        
+        frames = []
+        for frame in iter_keyframes(file_path, max_side=max_side):
+            frames.append(frame)
+            if len(frames) == batch_size:
+                yield from self._process_video_batch(frames, detector_types)
+                frames = []
+        
+        if frames:
+            yield from self._process_video_batch(frames, detector_types)
+    
+    def _process_video_batch(self, frames: List[VideoFrame], detector_types: List[str]) -> Iterator[Tuple[VideoFrame, Dict[str, Any]]]:
+        """Run one batch of video frames through the detectors and free the frames"""
+        try:
+            batch_results = self.process_decoded_images(frames, detector_types)
+        finally:
+            for frame in frames:
+                frame.release()
+        
+        yield from zip(frames, batch_results)
+    
+    def _is_classifier(self, detector_type: str) -> bool:
+        """Whether a detector type is served by an image classifier (Keras, TFLite or a stub)"""
+        if detector_type not in MODEL_CONFIG:
+            return False
+        return model_task(MODEL_CONFIG[detector_type][default_model_name(detector_type)]) == 'classify'
+    
+    def process_decoded_images(self, images: List[DecodedImage], detector_types: List[str],
+                               postprocess: bool = True) -> List[Dict[str, Any]]:
+        """
+        Process a batch of decoded images with multiple detector types
+        
+        The detectors share the decoded frames and run side by side, so the latency of a
+        batch approaches that of the slowest detector rather than their sum.
+        
+        Args:
+            images: Decoded images, sent to each model in one forward pass
+            detector_types: List of detector types to use
+            postprocess: With False, YOLO detectors return their raw predictions for
+                _postprocess_yolo instead of results (see services/pipeline.py)
+            
+        Returns:
+            List with the results per detector type of each image
+        """
+        results = [{} for _ in images]
+        
+        known_types = []
+        for detector_type in detector_types:
+            if detector_type not in MODEL_CONFIG:
+                logger.warning(f"Unknown detector type: {detector_type}")
+                continue
+            known_types.append(detector_type)
+        
+        parallel = min(len(known_types), getattr(settings, 'DETECTION_DETECTOR_CONCURRENCY', 4))
+        if parallel <= 1:
+            outcomes = [self._run_detector(images, detector_type, postprocess) for detector_type in known_types]
+        else:
+            # The torch intra-op threads were split between side-by-side detectors when the budget was applied
+            futures = [
+                self._detector_executor(parallel).submit(self._run_detector, images, detector_type, postprocess)
+                for detector_type in known_types
+            ]
+            outcomes = [future.result() for future in futures]
+        
+        for detector_type, (model_name, batch_results) in zip(known_types, outcomes):
+            if batch_results is None:
+                continue
+            for image_results, result in zip(results, batch_results):
+                image_results[detector_type] = {
                     'model_name': model_name,
                     'result': result
                 }
-                
-            except Exception as e:
-                logger.error(f"Error processing {detector_type} for {file_path}: {str(e)}")
-                logger.error(traceback.format_exc())
         
         return results
     
-    def _process_with_yolo(self, file_path: str, detector_type: str, model, config: Dict) -> Dict:
-        """Process an image with a YOLO model"""
-        # Generate output filename and path
-        file_stem = Path(file_path).stem
-        output_filename = f"{file_stem}_{detector_type}.jpg"
+    def _detector_executor(self, workers: int) -> ThreadPoolExecutor:
+        """Thread pool shared by the detectors of concurrent batches"""
+        with self._lock:
+            if self._executor is None or self._executor_workers < workers:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='detector')
+                self._executor_workers = workers
+            return self._executor
+    
+    def _model_slot(self, model_key: str, config: Dict) -> threading.Semaphore:
+        """
+        Semaphore limiting how many batches use a model at once
         
-        # Store in detector-specific subfolder
-        output_dir = os.path.join(RESULTS_ROOT, detector_type)
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, output_filename)
+        Ultralytics predictors are not thread-safe, so models run one batch at a time unless
+        their config sets a higher 'max_concurrency'.
+        """
+        with self._lock:
+            if model_key not in self._model_slots:
+                self._model_slots[model_key] = threading.Semaphore(config.get('max_concurrency', 1))
+            return self._model_slots[model_key]
+    
+    def _run_detector(self, images: List[DecodedImage], detector_type: str,
+                      postprocess: bool = True) -> Tuple[str, Optional[List[Dict]]]:
+        """
+        Run one detector type over a batch of images
+        
+        Returns:
+            Tuple of the model name and the results per image (None if the detector could not run)
+        """
+        # Get the model for this detector type
+        model_name = default_model_name(detector_type)
+        model_data = self.get_model(detector_type, model_name)
         
+        if not model_data:
+            logger.warning(f"No model loaded for {detector_type}, skipping")
+            return model_name, None
+            
+        model = model_data['model']
+        config = model_data['config']
+        
+        # Process with the appropriate method based on detector type
         try:
-            # Run inference with the model
-            threshold = config.get('threshold', 0.30)
-            iou = config.get('iou', 0.45)
-            logger.info(f"Running inference with {detector_type} model (conf={threshold}, iou={iou})")
+            with self._model_slot(f"{detector_type}_{model_name}", config):
+                if detector_type in ['object_detection', 'military_detection']:
+                    if model_task(config) == 'detect':
+                        # Process the whole batch with one YOLO forward pass
+                        if not postprocess:
+                            return model_name, self._yolo_forward(images, detector_type, model, config, render=False)
+                        return model_name, self._process_with_yolo_batch(images, detector_type, model, config)
+                elif detector_type in ['damage_assessment', 'emergency_recognition']:
+                    if model_task(config) == 'classify':
+                        # Classify the whole batch with one Keras prediction
+                        return model_name, self._process_with_keras_batch(images, detector_type, model, config)
             
+            logger.warning(f"Unsupported model type for {detector_type}: {config['type']}")
+        except Exception as e:
+            logger.error(f"Error processing {detector_type} for {[image.file_path for image in images]}: {str(e)}")
+            logger.error(traceback.format_exc())
+        
+        return model_name, None
+    
+    def _process_with_yolo(self, image: DecodedImage, detector_type: str, model, config: Dict) -> Dict:
+        """Process an image with a YOLO model"""
+        return self._process_with_yolo_batch([image], detector_type, model, config)[0]
+    
+    def _process_with_yolo_batch(self, images: List[DecodedImage], detector_type: str, model, config: Dict) -> List[Dict]:
+        """Process a batch of decoded images with a single YOLO forward pass"""
+        predictions = self._yolo_forward(images, detector_type, model, config)
+        return [
+            self._postprocess_yolo(image, detector_type, config, prediction)
+            for image, prediction in zip(images, predictions)
+        ]
+    
+    def _yolo_forward(self, images: List[DecodedImage], detector_type: str, model, config: Dict,
+                      render: Optional[bool] = None) -> List[Dict]:
+        """
+        Run the YOLO forward pass over a batch of decoded images
+        
+        Returns one prediction per image for _postprocess_yolo: the raw ultralytics result
+        under 'result', or the finished result under 'output' for tiled and failed images.
+        """
+        threshold = config.get('threshold', 0.30)
+        iou = config.get('iou', 0.45)
+        
+        tiling = tile_config(detector_type, config)
+        
+        # Images that fail to decode get an error result, large images are tiled,
+        # the rest share one forward pass
+        predictions = [None] * len(images)
+        valid = []
+        for index, image in enumerate(images):
+            try:
+                decode_start = time.perf_counter()
+                height, width = image.shape[:2]
+                if should_tile(width, height, tiling):
+                    predictions[index] = {'output': self._process_with_yolo_tiled(image, detector_type, model, config, tiling, render)}
+                    continue
+                image.inference_array
+                # The first detector to touch the image decodes it
+                image.timings.setdefault('decode_ms', _elapsed_ms(decode_start))
+                valid.append(index)
+            except Exception as e:
+                predictions[index] = {'output': self._yolo_error_result(image, detector_type, e)}
+        
+        if not valid:
+            return predictions
+        
+        logger.info(f"Running batched inference with {detector_type} model on {len(valid)} images (conf={threshold}, iou={iou})")
+        
+        try:
             start_time = time.time()
-            results = model(file_path, conf=threshold, iou=iou)
+            batch_results = model(
+                [images[index].inference_array for index in valid],
+                conf=threshold,
+                iou=iou,
+                batch=len(valid)
+            )
             inference_time = time.time() - start_time
-            logger.info(f"Inference completed in {inference_time:.2f}s")
-            
-            # Read original image for annotation
-            original_img = cv2.imread(file_path)
-            if original_img is None:
-                logger.error(f"Failed to read image: {file_path}")
-                raise ValueError(f"Could not read image file: {file_path}")
-            
-            # Extract detection results
-            detections = []
-            result = results[0]  # First image result
-            
-            # Convert YOLO results to our format
-            for box in result.boxes:
-                label_idx = int(box.cls)
-                
-                # Use the YOLO model's class names or config's class list
-                if hasattr(result, 'names') and label_idx in result.names:
-                    label = result.names[label_idx]
-                elif 'classes' in config and label_idx < len(config['classes']):
-                    label = config['classes'][label_idx]
-                else:
-                    label = f"class_{label_idx}"
-                    
-                conf = float(box.conf)
-                
-                # Get coordinates (convert to pixels)
-                x1, y1, x2, y2 = box.xyxy[0].tolist()  # xyxy format (top-left, bottom-right)
-                
-                detections.append({
-                    'label': label,
-                    'confidence': conf,
-                    'bbox': [x1, y1, x2, y2]
-                })
-            
-            logger.info(f"Found {len(detections)} objects in image")
-            
-            # Draw annotations on the image
-            annotated_img = self._draw_modern_annotations(original_img.copy(), detections, detector_type)
-            
-            # Save the annotated image
-            cv2.imwrite(output_path, annotated_img)
-            logger.info(f"Saved annotated image to {output_path}")
-            
-            # Define the URL path for accessing the result
-            relative_path = f"detection_results/{detector_type}/{output_filename}"
+            logger.info(f"Batched inference completed in {inference_time:.2f}s")
+        except Exception as e:
+            if len(valid) == 1:
+                predictions[valid[0]] = {'output': self._yolo_error_result(images[valid[0]], detector_type, e)}
+                return predictions
             
-            # Create summary text
-            label_counts = {}
+            # Fall back to one image per pass so a single bad file doesn't fail the whole batch
+            logger.error(f"Batched YOLO inference failed, retrying images one by one: {str(e)}")
+            for index in valid:
+                predictions[index] = self._yolo_forward([images[index]], detector_type, model, config, render)[0]
+            return predictions
+        
+        # Spread the batch time over its images
+        per_image_time = inference_time / len(valid)
+        
+        for index, result in zip(valid, batch_results):
+            predictions[index] = {'result': result, 'inference_time': per_image_time, 'batch_size': len(valid)}
+        
+        return predictions
+    
+    def _postprocess_yolo(self, image: DecodedImage, detector_type: str, config: Dict, prediction: Dict,
+                          render: Optional[bool] = None) -> Dict:
+        """Turn a prediction of _yolo_forward into the result dictionary of an image"""
+        if 'output' in prediction:
+            return prediction['output']
+        
+        result = prediction['result']
+        try:
+            postprocess_start = time.perf_counter()
+            detections = self._yolo_result_to_detections(result, config)
             for det in detections:
-                label = det['label']
-                label_counts[label] = label_counts.get(label, 0) + 1
+                det['bbox'] = image.to_full_resolution(det['bbox'])
+            postprocess_ms = _elapsed_ms(postprocess_start)
             
-            summary_parts = []
-            for label, count in label_counts.items():
-                summary_parts.append(f"{count} {label}{'s' if count > 1 else ''}")
+            output = self._save_yolo_result(image, detector_type, detections, render)
+            output['inference_time'] = prediction['inference_time']
+            output['batch_size'] = prediction['batch_size']
+            input_height, input_width = image.inference_array.shape[:2]
+            output['input_width'] = input_width
+            output['input_height'] = input_height
             
-            summary = f"Found {len(detections)} objects: " + ", ".join(summary_parts) if detections else "No objects detected"
-            
-            return {
-                'detections': detections,
-                'output_path': output_path,
-                'relative_path': relative_path,
-                'summary': summary,
-                'inference_time': inference_time
-            }
-            
-        except Exception as e:
-            logger.error(f"Error in YOLO processing: {str(e)}")
-            logger.error(traceback.format_exc())
-            
-            # Create error image
-            error_img = np.zeros((400, 600, 3), dtype=np.uint8)
-            cv2.putText(
-                error_img, 
-                f"Error processing image with {detector_type}", 
-                (20, 150), 
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                0.7, 
-                (255, 255, 255), 
-                1
-            )
-            cv2.putText(
-                error_img, 
-                str(e), 
-                (20, 200), 
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                0.5, 
-                (200, 100, 100), 
-                1
+            # Ultralytics times its own letterboxing, forward pass and NMS per image
+            speed = getattr(result, 'speed', None) or {}
+            output['timings'].update(
+                read_ms=image.timings.get('read_ms'),
+                decode_ms=image.timings.get('decode_ms'),
+                preprocess_ms=speed.get('preprocess'),
+                inference_ms=speed.get('inference', prediction['inference_time'] * 1000),
+                nms_ms=speed.get('postprocess'),
+                postprocess_ms=postprocess_ms
             )
+            return output
+        except Exception as e:
+            return self._yolo_error_result(image, detector_type, e)
+    
+    def _process_with_yolo_tiled(self, image: DecodedImage, detector_type: str, model, config: Dict,
+                                 tiling: Dict, render: Optional[bool] = None) -> Dict:
+        """Process a large image tile by tile so small objects keep their full resolution"""
+        threshold = config.get('threshold', 0.30)
+        iou = config.get('iou', 0.45)
+        height, width = image.shape[:2]
+        def infer_batch(tiles):
+            tile_results = model(tiles, conf=threshold, iou=iou, batch=len(tiles), verbose=False)
+            return [self._yolo_result_to_detections(result, config) for result in tile_results]
+        
+        start_time = time.time()
+        
+        # A pass over the whole (downscaled) image keeps objects larger than a tile
+        detections = []
+        if tiling.get('full_image_pass'):
+            result = model(image.inference_array, conf=threshold, iou=iou, verbose=False)[0]
+            for det in self._yolo_result_to_detections(result, config):
+                det['bbox'] = image.to_full_resolution(det['bbox'])
+                detections.append(det)
+        
+        tiled = detect_tiled(image.read_window, width, height, infer_batch, tiling, detections)
+        inference_time = time.time() - start_time
+        logger.info(f"Tiled inference over {tiled['tiles']} tiles completed in {inference_time:.2f}s")
+        
+        output = self._save_yolo_result(image, detector_type, tiled['detections'], render)
+        output['inference_time'] = inference_time
+        output['batch_size'] = tiling['batch_size']
+        output['tiles'] = tiled['tiles']
+        output['input_width'] = output['input_height'] = tiling['tile_size']
+        # Window reads, inference and merging overlap tile by tile, so they are timed together
+        output['timings']['inference_ms'] = inference_time * 1000
+        return output
+    
+    def _yolo_result_to_detections(self, result, config: Dict) -> List[Dict]:
+        """Convert a single ultralytics result to our detection format"""
+        detections = []
+        
+        for box in result.boxes:
+            label_idx = int(box.cls)
             
-            # Save error image
-            cv2.imwrite(output_path, error_img)
+            # Use the YOLO model's class names or config's class list
+            if hasattr(result, 'names') and label_idx in result.names:
+                label = result.names[label_idx]
+            elif 'classes' in config and label_idx < len(config['classes']):
+                label = config['classes'][label_idx]
+            else:
+                label = f"class_{label_idx}"
+                
+            conf = float(box.conf)
             
-            relative_path = f"detection_results/{detector_type}/{output_filename}"
+            # Get coordinates (convert to pixels)
+            x1, y1, x2, y2 = box.xyxy[0].tolist()  # xyxy format (top-left, bottom-right)
             
-            return {
-                'detections': [],
-                'output_path': output_path,
-                'relative_path': relative_path,
-                'summary': f"Error processing image: {str(e)}"
-            }
+            detections.append({
+                'label': label,
+                'confidence': conf,
+                'bbox': [x1, y1, x2, y2]
+            })
+        
+        return detections
     
-    def _draw_modern_annotations(self, img, detections, detector_type):
-        """Draw modern, minimalistic annotations with segmentation-style labels"""
-        h, w = img.shape[:2]
-        
-        # Create a clean copy of the image for overlays
-        result_img = img.copy()
-        
-        # Apply slight brightness enhancement to original image (1.1 = 10% brighter)
-        result_img = cv2.convertScaleAbs(result_img, alpha=1.1, beta=5)
-        
-        # Configure header style based on detector type
-        if detector_type == 'object_detection':
-            header_bg_color = (37, 37, 38)  # Dark gray
-            header_accent = (66, 165, 245)  # Blue
-            header_text = "COCO Object Detection"
-        else:  # military_detection
-            header_bg_color = (37, 37, 38)  # Dark gray
-            header_accent = (239, 83, 80)   # Red
-            header_text = "Military Object Detection"
-        
-        # Calculate label font scale based on image size
-        base_font_scale = 0.4 * max(1, min(w, h) / 500)
-        
-        # Add a minimal modern header
-        header_height = int(60 * base_font_scale)
-        header_bar = np.zeros((header_height, w, 3), dtype=np.uint8)
-        header_bar[:] = header_bg_color
-        
-        # Add accent line at bottom of header
-        accent_height = int(3 * base_font_scale)
-        header_bar[-accent_height:, :] = header_accent
-        
-        # Add header text
-        font_scale = base_font_scale * 1.1
-        font_thickness = max(1, int(1.5 * base_font_scale))
-        cv2.putText(
-            header_bar,
-            header_text,
-            (int(20 * base_font_scale), int(header_height * 0.6)),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            font_scale,
-            (255, 255, 255),
-            font_thickness
-        )
+    def _result_paths(self, file_path: str, detector_type: str) -> Tuple[str, str]:
+        """Return the absolute and media-relative paths of the annotated image"""
+        # Generate output filename and path
+        file_stem = Path(file_path).stem
+        output_filename = f"{file_stem}_{detector_type}.jpg"
+        
+        # Store in detector-specific subfolder
+        output_dir = os.path.join(RESULTS_ROOT, detector_type)
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, output_filename)
+        
+        # Define the URL path for accessing the result
+        relative_path = f"detection_results/{detector_type}/{output_filename}"
+        
+        return output_path, relative_path
+    
+    def _save_yolo_result(self, image: DecodedImage, detector_type: str, detections: List[Dict],
+                          render: Optional[bool] = None) -> Dict:
+        """
+        Build the result dictionary, annotating and saving the image if raster rendering is enabled
+        
+        render overrides DETECTION_RENDER_IMAGES; the staged pipeline passes False and renders
+        in a stage of its own with _render_yolo_result.
+        """
+        logger.info(f"Found {len(detections)} objects in image")
+        
+        image_height, image_width = image.shape[:2]
+        output = {
+            'detections': detections,
+            'image_width': image_width,
+            'image_height': image_height,
+            'timings': {}
+        }
         
-        # Add the header to the result image
-        result_img = np.vstack([header_bar, result_img])
-        h = result_img.shape[0]  # Update height with header
+        # Boxes are drawn client-side from the overlay API, raster images are optional
+        if render is None:
+            render = getattr(settings, 'DETECTION_RENDER_IMAGES', False)
+        if render:
+            self._render_yolo_result(image, detector_type, output)
         
-        # Draw detections on the overlay
+        # Create summary text
+        label_counts = {}
         for det in detections:
-            x_min, y_min, x_max, y_max = map(int, det['bbox'])
-            
-            # Adjust for header
-            y_min += header_height
-            y_max += header_height
-            
-            # Make sure coordinates are within bounds
-            x_min = max(0, x_min)
-            y_min = max(0, y_min)
-            x_max = min(w, x_max)
-            y_max = min(h, y_max)
-            
             label = det['label']
-            conf = det['confidence']
-            
-            # Get color for this class
-            rgba_color = COLOR_PALETTE.get(label.lower(), COLOR_PALETTE['default'])
-            color = rgba_color[:3]  # BGR format
-            alpha = rgba_color[3]   # Transparency value
-            
-            # Create a more visible detection box (semi-transparent fill)
-            overlay = result_img.copy()
-            cv2.rectangle(overlay, (x_min, y_min), (x_max, y_max), color, -1)
-            
-            # Apply alpha blending for the fill
-            cv2.addWeighted(
-                overlay, 
-                alpha, 
-                result_img, 
-                1 - alpha, 
-                0, 
-                result_img
-            )
-            
-            # Draw a solid border (more visible)
-            border_thickness = max(2, int(3 * base_font_scale))
-            cv2.rectangle(
-                result_img, 
-                (x_min, y_min), 
-                (x_max, y_max), 
-                color, 
-                border_thickness
-            )
-            
-            # Create an improved label with better visibility
-            label_text = f"{label} {conf:.2f}"
-            font_scale = base_font_scale * 0.9  # Slightly larger font
-            thickness = max(1, int(base_font_scale * 1.2))  # Thicker text
-            
-            # Get text size for the label
-            (text_width, text_height), baseline = cv2.getTextSize(
-                label_text, 
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                font_scale, 
-                thickness
-            )
-            
-            # Add padding to label background
-            padding = int(6 * base_font_scale)
-            
-            # Make sure label doesn't go above the image
-            label_y_min = max(header_height, y_min - text_height - padding * 2)
-            
-            # Position label at top of bounding box with solid background
-            label_bg = np.array([
-                [x_min, label_y_min],
-                [x_min + text_width + padding * 2, label_y_min],
-                [x_min + text_width + padding * 2, label_y_min + text_height + padding * 2],
-                [x_min, label_y_min + text_height + padding * 2]
-            ], np.int32)
-            
-            # Draw solid label background (no transparency)
-            cv2.fillPoly(result_img, [label_bg], color)
-            
-            # Add a white border around the label for better visibility
-            cv2.polylines(result_img, [label_bg], True, (255, 255, 255), 1)
-            
-            # Draw label text in white with improved visibility
-            cv2.putText(
-                result_img,
-                label_text,
-                (x_min + padding, label_y_min + text_height + padding),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                font_scale,
-                (255, 255, 255),
-                thickness
-            )
+            label_counts[label] = label_counts.get(label, 0) + 1
+        
+        summary_parts = []
+        for label, count in label_counts.items():
+            summary_parts.append(f"{count} {label}{'s' if count > 1 else ''}")
         
-        # Add a footer with model info
-        footer_height = int(40 * base_font_scale)
-        footer_bar = np.zeros((footer_height, w, 3), dtype=np.uint8)
-        footer_bar[:] = header_bg_color
+        output['summary'] = f"Found {len(detections)} objects: " + ", ".join(summary_parts) if detections else "No objects detected"
+        
+        return output
+    
+    def _render_yolo_result(self, image: DecodedImage, detector_type: str, output: Dict):
+        """Annotate an image with the detections of its result and save it, adding the paths to the result"""
+        output_path, relative_path = self._result_paths(image.file_path, detector_type)
+        detections = output['detections']
         
-        # Add accent line at top of footer
-        footer_bar[:accent_height, :] = header_accent
+        # Draw annotations on the already decoded image (the renderer works on its own copy);
+        # large rasters are annotated on their overview
+        render_start = time.perf_counter()
+        canvas, scale = image.annotation_view()
+        if scale != 1.0:
+            canvas_detections = [dict(det, bbox=[coord * scale for coord in det['bbox']]) for det in detections]
+        else:
+            canvas_detections = detections
+        annotated_img = self._draw_modern_annotations(canvas, canvas_detections, detector_type)
+        output.setdefault('timings', {})['render_ms'] = _elapsed_ms(render_start)
         
-        # Add model info
-        model_name = list(MODEL_CONFIG[detector_type].keys())[0]
-        detection_count = f"Detections: {len(detections)}"
+        # Save the annotated image
+        encode_start = time.perf_counter()
+        success, buffer = cv2.imencode('.jpg', annotated_img)
+        if not success:
+            raise ValueError(f"Could not encode annotated image for {image.file_path}")
+        with open(output_path, 'wb') as f:
+            f.write(buffer.tobytes())
+        output['timings']['encode_ms'] = _elapsed_ms(encode_start)
+        logger.info(f"Saved annotated image to {output_path}")
         
-        # Add model info to footer
+        output['output_path'] = output_path
+        output['relative_path'] = relative_path
+    
+    def _yolo_error_result(self, image: DecodedImage, detector_type: str, error: Exception) -> Dict:
+        """Build the result dictionary for a failed image, saving an error image if raster rendering is enabled"""
+        logger.error(f"Error in YOLO processing: {str(error)}")
+        logger.error(traceback.format_exc())
+        
+        if not getattr(settings, 'DETECTION_RENDER_IMAGES', False):
+            return {
+                'detections': [],
+                'summary': f"Error processing image: {str(error)}",
+                'error': str(error)
+            }
+        
+        output_path, relative_path = self._result_paths(image.file_path, detector_type)
+        
+        # Create error image
+        error_img = np.zeros((400, 600, 3), dtype=np.uint8)
         cv2.putText(
-            footer_bar,
-            f"Model: {model_name}",
-            (int(20 * base_font_scale), int(footer_height * 0.6)),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            base_font_scale * 0.7,
-            (255, 255, 255),  # Brighter text color
+            error_img, 
+            f"Error processing image with {detector_type}", 
+            (20, 150), 
+            cv2.FONT_HERSHEY_SIMPLEX, 
+            0.7, 
+            (255, 255, 255), 
             1
         )
-        
-        # Add detection count to right side
-        (text_width, _), _ = cv2.getTextSize(
-            detection_count, 
+        cv2.putText(
+            error_img, 
+            str(error), 
+            (20, 200), 
             cv2.FONT_HERSHEY_SIMPLEX, 
-            base_font_scale * 0.7, 
+            0.5, 
+            (200, 100, 100), 
             1
         )
         
-        cv2.putText(
-            footer_bar,
-            detection_count,
-            (w - text_width - int(20 * base_font_scale), int(footer_height * 0.6)),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            base_font_scale * 0.7,
-            (255, 255, 255),  # Brighter text color
-            1
+        # Save error image
+        cv2.imwrite(output_path, error_img)
+        
+        return {
+            'detections': [],
+            'output_path': output_path,
+            'relative_path': relative_path,
+            'summary': f"Error processing image: {str(error)}",
+            'error': str(error)
+        }
+    
+    def _process_with_keras(self, image: DecodedImage, detector_type: str, model, config: Dict) -> Dict:
+        """Classify an image with a Keras model"""
+        return self._process_with_keras_batch([image], detector_type, model, config)[0]
+    
+    def _process_with_keras_batch(self, images: List[DecodedImage], detector_type: str, model, config: Dict) -> List[Dict]:
+        """Classify a batch of decoded images with one Keras prediction"""
+        inputs = self._prepare_keras_inputs(images, model, config)
+        return self._classify_prepared(inputs, detector_type, model, config)
+    
+    def _keras_input_size(self, model, config: Dict) -> Tuple[int, int]:
+        """Input (height, width) of a classifier, from the model or its config"""
+        input_shape = getattr(model, 'input_shape', None)
+        if input_shape and len(input_shape) == 4 and input_shape[1] and input_shape[2]:
+            return input_shape[1], input_shape[2]
+        return tuple(config.get('input_size', (224, 224)))
+    
+    def _prepare_keras_inputs(self, images: List[DecodedImage], model, config: Dict) -> List[Dict]:
+        """
+        Resize images to the classifier input as RGB uint8
+        
+        Normalization is left to _classify_prepared, which applies it to the whole batch at once.
+        """
+        height, width = self._keras_input_size(model, config)
+        inputs = []
+        
+        for image in images:
+            try:
+                decode_start = time.perf_counter()
+                image_height, image_width = image.shape[:2]
+                inference_array = image.inference_array
+                image.timings.setdefault('decode_ms', _elapsed_ms(decode_start))
+                
+                preprocess_start = time.perf_counter()
+                resized = cv2.resize(inference_array, (width, height), interpolation=cv2.INTER_AREA)
+                inputs.append({
+                    'array': cv2.cvtColor(resized, cv2.COLOR_BGR2RGB),
+                    'image_width': image_width,
+                    'image_height': image_height,
+                    'read_ms': image.timings.get('read_ms'),
+                    'decode_ms': image.timings['decode_ms'],
+                    'preprocess_ms': _elapsed_ms(preprocess_start)
+                })
+            except Exception as e:
+                logger.error(f"Error preparing {image.file_path} for classification: {str(e)}")
+                inputs.append({'error': e})
+        
+        return inputs
+    
+    def _normalize_keras_batch(self, batch: np.ndarray, config: Dict) -> np.ndarray:
+        """Convert a uint8 batch to the float input expected by the model"""
+        preprocessing = config.get('preprocessing', 'rescale')
+        batch = batch.astype(np.float32)
+        
+        if preprocessing == 'rescale':
+            batch *= 1.0 / 255.0
+        elif preprocessing == 'imagenet':
+            batch *= 1.0 / 255.0
+            batch -= np.array([0.485, 0.456, 0.406], dtype=np.float32)
+            batch /= np.array([0.229, 0.224, 0.225], dtype=np.float32)
+        # 'none': the model rescales its inputs itself
+        return batch
+    
+    def _classify_prepared(self, inputs: List[Dict], detector_type: str, model, config: Dict) -> List[Dict]:
+        """Run a classifier over prepared inputs in batches of the model's batch size"""
+        outputs = [None] * len(inputs)
+        valid = []
+        for index, prepared in enumerate(inputs):
+            if 'error' in prepared:
+                outputs[index] = self._classification_error_result(detector_type, prepared['error'])
+            else:
+                valid.append(index)
+        
+        if not valid:
+            return outputs
+        
+        batch_size = config.get('batch_size', getattr(settings, 'DETECTION_CLASSIFIER_BATCH_SIZE', 32))
+        batch = np.stack([inputs[index]['array'] for index in valid])
+        
+        start_time = time.time()
+        normalize_ms = predict_ms = 0.0
+        probabilities = []
+        for batch_start in range(0, len(batch), batch_size):
+            stage_start = time.perf_counter()
+            chunk = self._normalize_keras_batch(batch[batch_start:batch_start + batch_size], config)
+            normalize_ms += _elapsed_ms(stage_start)
+            
+            stage_start = time.perf_counter()
+            probabilities.append(np.asarray(model.predict(chunk, batch_size=batch_size, verbose=0)))
+            predict_ms += _elapsed_ms(stage_start)
+        probabilities = np.concatenate(probabilities)
+        inference_time = time.time() - start_time
+        
+        logger.info(
+            f"Classified {len(valid)} images with {detector_type} in {inference_time:.2f}s "
+            f"({len(valid) / max(inference_time, 1e-6):.1f} images/s, batch size {batch_size})"
         )
         
-        # Add the footer to the result image
-        result_img = np.vstack([result_img, footer_bar])
+        for index, row in zip(valid, probabilities):
+            output = self._classification_result(row, config)
+            output['inference_time'] = inference_time / len(valid)
+            output['batch_size'] = min(batch_size, len(valid))
+            output['image_width'] = inputs[index]['image_width']
+            output['image_height'] = inputs[index]['image_height']
+            output['input_height'], output['input_width'] = inputs[index]['array'].shape[:2]
+            output['timings'] = {
+                'read_ms': inputs[index].get('read_ms'),
+                'decode_ms': inputs[index].get('decode_ms'),
+                'preprocess_ms': inputs[index].get('preprocess_ms', 0.0) + normalize_ms / len(valid),
+                'inference_ms': predict_ms / len(valid)
+            }
+            outputs[index] = output
         
-        return result_img
+        return outputs
+    
+    def _classification_result(self, probabilities: np.ndarray, config: Dict) -> Dict:
+        """Convert the class probabilities of one image to our classification format"""
+        labels = config.get('labels', [])
+        probabilities = np.ravel(probabilities)
+        top_k = config.get('top_k', len(probabilities))
+        
+        classifications = []
+        for label_idx in np.argsort(probabilities)[::-1][:top_k]:
+            label = labels[label_idx] if label_idx < len(labels) else f"class_{label_idx}"
+            classifications.append({
+                'label': label,
+                'confidence': float(probabilities[label_idx])
+            })
+        
+        best = classifications[0]
+        return {
+            'classifications': classifications,
+            'summary': f"{best['label'].replace('_', ' ').capitalize()} ({best['confidence']:.0%})"
+        }
+    
+    def _classification_error_result(self, detector_type: str, error: Exception) -> Dict:
+        """Build the result dictionary for an image that could not be classified"""
+        logger.error(f"Error in {detector_type} classification: {str(error)}")
+        return {
+            'classifications': [],
+            'summary': f"Error processing image: {str(error)}",
+            'error': str(error)
+        }
+    
+    def _draw_modern_annotations(self, img, detections, detector_type):
+        """Draw modern, minimalistic annotations with segmentation-style labels"""
+        model_name = default_model_name(detector_type)
+        return draw_modern_annotations(img, detections, detector_type, model_name)
 
 # Singleton instance
 model_service = ModelService()
 
-def process_marker_file(marker_file, detector_types: List[str]) -> List[Detection]:
+# Rows per INSERT statement when storing detections
+BULK_CREATE_BATCH_SIZE = 500
+
+# File extensions the detectors can read
+PROCESSABLE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp'] + list(VIDEO_EXTENSIONS)
+
+def _processable_path(marker_file) -> Optional[str]:
+    """Return the on-disk path of a marker file if it can be processed, otherwise None"""
+    # Check if file exists
+    if not marker_file.file:
+        logger.warning(f"File not found: {marker_file.id}")
+        return None
+    
+    file_path = marker_file.file.path
+    if not os.path.exists(file_path):
+        logger.warning(f"File does not exist on disk: {file_path}")
+        return None
+        
+    file_ext = os.path.splitext(file_path)[1].lower()
+    
+    # Check if it's a processable image or video
+    if file_ext not in PROCESSABLE_EXTENSIONS:
+        logger.warning(f"Skipping non-processable file: {file_path} (format: {file_ext})")
+        return None
+    
+    return file_path
+
+def _create_detection_records(marker_file, results: Dict[str, Any], replace_types: Optional[List[str]] = None) -> List[Detection]:
     """
-    Process a marker file with the requested detector types
+    Store model service results for a marker file
+    
+    Existing detections of the reprocessed types are replaced, and the Detection,
+    ObjectDetection and ClassificationResult rows are written with bulk inserts, all in a
+    single transaction.
+    
+    Args:
+        marker_file: MarkerFile instance
+        results: Dictionary of results per detector type, as returned by ModelService.process_image
+        replace_types: Detector types whose existing detections are deleted first
+        
+    Returns:
+        List of created Detection objects
+    """
+    start_time = time.time()
+    detection_objects = []
+    detection_results = []
+    
+    peak_rss_mb = _peak_rss_mb()
+    
+    for detector_type, result_data in results.items():
+        result = result_data['result']
+        
+        # Store inference time, batch size, image size (used to scale overlays) and model input size if available
+        metadata = {
+            key: result[key]
+            for key in ('inference_time', 'batch_size', 'image_width', 'image_height', 'input_width', 'input_height',
+                        'tiles', 'cached')
+            if key in result
+        }
+        # Per-stage timings in ms (see detection_timing_stats), completed with the DB write below
+        metadata['timings'] = {key: value for key, value in result.get('timings', {}).items() if value is not None}
+        metadata['peak_rss_mb'] = peak_rss_mb
+        
+        detection_objects.append(Detection(
+            marker_file=marker_file,
+            detector_type=detector_type,
+            model_name=result_data['model_name'],
+            summary=result.get('summary', ''),
+            # Store the relative path for serving via URL
+            image_path=result.get('relative_path', ''),
+            metadata=metadata
+        ))
+        detection_results.append(result)
+    
+    try:
+        db_start = time.perf_counter()
+        with transaction.atomic():
+            if replace_types:
+                deleted, _ = marker_file.detections.filter(detector_type__in=replace_types).delete()
+                if deleted:
+                    logger.info(f"Deleted {deleted} existing detection rows for file {marker_file.id} before reprocessing")
+            
+            if not detection_objects:
+                return []
+            
+            if connection.features.can_return_rows_from_bulk_insert:
+                Detection._default_manager.bulk_create(detection_objects)
+            else:
+                # The child rows need primary keys the backend doesn't return from bulk inserts
+                for detection in detection_objects:
+                    detection.save()
+            
+            object_rows = []
+            classification_rows = []
+            for detection, result in zip(detection_objects, detection_results):
+                for det in result.get('detections', []):
+                    object_rows.append(ObjectDetection(
+                        detection=detection,
+                        label=det['label'],
+                        confidence=det['confidence'],
+                        x_min=det['bbox'][0],
+                        y_min=det['bbox'][1],
+                        x_max=det['bbox'][2],
+                        y_max=det['bbox'][3]
+                    ))
+                for classification in result.get('classifications', []):
+                    classification_rows.append(ClassificationResult(
+                        detection=detection,
+                        label=classification['label'],
+                        confidence=classification['confidence']
+                    ))
+            
+            ObjectDetection.objects.bulk_create(object_rows, batch_size=BULK_CREATE_BATCH_SIZE)
+            ClassificationResult.objects.bulk_create(classification_rows, batch_size=BULK_CREATE_BATCH_SIZE)
+            
+            # The write time is only known once the rows are in, record it with one more statement
+            db_write_ms = _elapsed_ms(db_start)
+            for detection in detection_objects:
+                detection.metadata['timings']['db_write_ms'] = db_write_ms
+            Detection._default_manager.bulk_update(detection_objects, ['metadata'])
+    except Exception as e:
+        logger.error(f"Error creating detection records for file {marker_file.id}: {str(e)}")
+        logger.error(traceback.format_exc())
+        return []
+    
+    logger.info(
+        f"Stored {len(detection_objects)} detections, {len(object_rows)} objects and "
+        f"{len(classification_rows)} classifications for file {marker_file.id} in {(time.time() - start_time) * 1000:.1f}ms"
+    )
+    return detection_objects
+
+def process_video_file(marker_file, file_path: str, detector_types: List[str], batch_size: Optional[int] = None,
+                       heartbeat: Optional[Callable[[], None]] = None) -> List[Detection]:
+    """
+    Process a video marker file frame by frame and store the results of each sampled frame
+    
+    One Detection is stored per detector type, with its objects and classifications tagged
+    with the frame index and timestamp they were found at. Rows are written as frames are
+    processed, so memory stays constant however long the video is.
     
     Args:
         marker_file: MarkerFile instance
+        file_path: Path to the video file
         detector_types: List of detector types to use
+        batch_size: Maximum number of frames per forward pass (defaults to DETECTION_BATCH_SIZE)
+        heartbeat: Called after each batch of frames, to show long videos are still being processed
         
     Returns:
         List of created Detection objects
     """
-    logger.info(f"Processing file ID {marker_file.id} with detector types: {detector_types}")
+    known_types = [detector_type for detector_type in detector_types if detector_type in MODEL_CONFIG]
+    if not known_types:
+        return []
     
-    # Check if file exists
-    if not marker_file.file:
-        logger.warning(f"File not found: {marker_file.id}")
+    try:
+        info = video_info(file_path)
+    except Exception as e:
+        logger.error(f"Error reading video {file_path}: {str(e)}")
         return []
     
+    if batch_size is None:
+        batch_size = getattr(settings, 'DETECTION_BATCH_SIZE', 8)
+    batch_size = max(1, int(batch_size))
+    sampling = video_sampling()
+    start_time = time.time()
+    
+    # Replace the previous results up front, the frames are stored as they are processed
     try:
-        file_path = marker_file.file.path
-        if not os.path.exists(file_path):
-            logger.warning(f"File does not exist on disk: {file_path}")
-            return []
-            
-        file_ext = os.path.splitext(file_path)[1].lower()
-        
-        # Check if it's a processable image
-        processable_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp']
-        if file_ext not in processable_extensions:
-            logger.warning(f"Skipping non-processable file: {file_path} (format: {file_ext})")
-            return []
-        
-        # Check for existing detections and remove if requested
-        existing_detections = marker_file.detections.filter(detector_type__in=detector_types)
-        if existing_detections.exists():
-            logger.info(f"Found {existing_detections.count()} existing detections, deleting them for reprocessing")
-            existing_detections.delete()
-        
-        # Process with model service
-        try:
-            logger.info(f"Calling model service for file {marker_file.id}")
-            start_time = time.time()
-            results = model_service.process_image(file_path, detector_types)
-            logger.info(f"Model processing completed in {time.time() - start_time:.2f}s for detector types: {list(results.keys())}")
-        except Exception as e:
-            logger.error(f"Error in model processing: {str(e)}")
-            logger.error(traceback.format_exc())
-            return []
-        
-        # Create detection records
-        detection_objects = []
-        
-        for detector_type, result_data in results.items():
-            try:
-                logger.info(f"Creating detection record for {detector_type}")
-                
-                # Create base detection record
-                detection = Detection(
+        with transaction.atomic():
+            marker_file.detections.filter(detector_type__in=detector_types).delete()
+            detections = {
+                detector_type: Detection._default_manager.create(
                     marker_file=marker_file,
                     detector_type=detector_type,
-                    model_name=result_data['model_name']
+                    model_name=default_model_name(detector_type),
+                    summary='Processing video',
+                    metadata={'video': dict(info, sampling=sampling, complete=False)}
                 )
-                
+                for detector_type in known_types
+            }
+    except Exception as e:
+        logger.error(f"Error creating detection records for video {marker_file.id}: {str(e)}")
+        logger.error(traceback.format_exc())
+        return []
+    
+    stats = {
+        detector_type: {'labels': {}, 'frames_with_results': 0, 'errors': 0, 'inference_time': 0.0, 'timings': {}}
+        for detector_type in known_types
+    }
+    object_rows = []
+    classification_rows = []
+    sampled_frames = 0
+    db_write_ms = 0.0
+    error = None
+    
+    def flush():
+        nonlocal db_write_ms
+        db_start = time.perf_counter()
+        ObjectDetection.objects.bulk_create(object_rows, batch_size=BULK_CREATE_BATCH_SIZE)
+        ClassificationResult.objects.bulk_create(classification_rows, batch_size=BULK_CREATE_BATCH_SIZE)
+        db_write_ms += _elapsed_ms(db_start)
+        object_rows.clear()
+        classification_rows.clear()
+    
+    try:
+        for frame, frame_results in model_service.process_video(file_path, known_types, batch_size=batch_size):
+            sampled_frames += 1
+            
+            for detector_type, result_data in frame_results.items():
                 result = result_data['result']
+                detector_stats = stats[detector_type]
+                detector_stats['inference_time'] += result.get('inference_time', 0.0)
+                for stage, value in result.get('timings', {}).items():
+                    if value is not None:
+                        detector_stats['timings'][stage] = detector_stats['timings'].get(stage, 0.0) + value
+                if 'error' in result:
+                    detector_stats['errors'] += 1
+                    continue
                 
-                # Store overall summary
-                detection.summary = result.get('summary', '')
-                
-                # Store the relative path for serving via URL
-                if 'relative_path' in result:
-                    detection.image_path = result['relative_path']
-                
-                # Store inference time if available
-                if 'inference_time' in result:
-                    detection.metadata = {'inference_time': result['inference_time']}
-                
-                detection.save()
-                logger.info(f"Saved detection ID {detection.id}")
-                
-                # Store individual detections
                 for det in result.get('detections', []):
-                    object_detection = ObjectDetection.objects.create(
-                        detection=detection,
+                    object_rows.append(ObjectDetection(
+                        detection=detections[detector_type],
                         label=det['label'],
                         confidence=det['confidence'],
                         x_min=det['bbox'][0],
                         y_min=det['bbox'][1],
                         x_max=det['bbox'][2],
-                        y_max=det['bbox'][3]
-                    )
-                    logger.info(f"Created object detection {object_detection.id}: {det['label']} ({det['confidence']:.2f})")
+                        y_max=det['bbox'][3],
+                        frame_index=frame.index,
+                        timestamp=frame.timestamp
+                    ))
+                    detector_stats['labels'][det['label']] = detector_stats['labels'].get(det['label'], 0) + 1
                 
-                detection_objects.append(detection)
+                classifications = result.get('classifications', [])
+                for classification in classifications:
+                    classification_rows.append(ClassificationResult(
+                        detection=detections[detector_type],
+                        label=classification['label'],
+                        confidence=classification['confidence'],
+                        frame_index=frame.index,
+                        timestamp=frame.timestamp
+                    ))
+                # Classifiers count frames by their top label
+                if classifications:
+                    top_label = classifications[0]['label']
+                    detector_stats['labels'][top_label] = detector_stats['labels'].get(top_label, 0) + 1
                 
-            except Exception as e:
-                logger.error(f"Error creating detection record: {str(e)}")
-                logger.error(traceback.format_exc())
+                if result.get('detections') or classifications:
+                    detector_stats['frames_with_results'] += 1
+            
+            if len(object_rows) + len(classification_rows) >= BULK_CREATE_BATCH_SIZE:
+                flush()
+            if heartbeat and sampled_frames % batch_size == 0:
+                heartbeat()
         
-        return detection_objects
+        flush()
+    except Exception as e:
+        logger.error(f"Error processing video {file_path}: {str(e)}")
+        logger.error(traceback.format_exc())
+        error = str(e)
+    
+    for detector_type, detection in detections.items():
+        detector_stats = stats[detector_type]
+        labels = detector_stats['labels']
+        
+        if error:
+            summary = f"Error processing video: {error}"
+        elif model_service._is_classifier(detector_type):
+            if labels:
+                top_label = max(labels, key=labels.get)
+                summary = f"{top_label.replace('_', ' ').capitalize()} in {labels[top_label]} of {sampled_frames} sampled frames"
+            else:
+                summary = f"No classifications in {sampled_frames} sampled frames"
+        elif labels:
+            summary_parts = [f"{count} {label}{'s' if count > 1 else ''}" for label, count in labels.items()]
+            summary = (
+                f"Found {sum(labels.values())} objects in {detector_stats['frames_with_results']} of "
+                f"{sampled_frames} sampled frames: " + ", ".join(summary_parts)
+            )
+        else:
+            summary = f"No objects detected in {sampled_frames} sampled frames"
+        
+        detection.summary = summary
+        # Stage timings per sampled frame, and the time spent writing all of the video's rows
+        timings = {stage: total / max(sampled_frames, 1) for stage, total in detector_stats['timings'].items()}
+        timings['db_write_ms'] = db_write_ms
+        
+        detection.metadata = {
+            'inference_time': detector_stats['inference_time'],
+            'timings': timings,
+            'peak_rss_mb': _peak_rss_mb(),
+            'batch_size': batch_size,
+            'image_width': info['width'],
+            'image_height': info['height'],
+            'video': dict(
+                info,
+                sampling=sampling,
+                sampled_frames=sampled_frames,
+                frames_with_results=detector_stats['frames_with_results'],
+                frame_errors=detector_stats['errors'],
+                complete=error is None
+            )
+        }
+        detection.save(update_fields=['summary', 'metadata', 'updated_at'])
+    
+    logger.info(
+        f"Processed {sampled_frames} sampled frames of video {marker_file.id} with {known_types} "
+        f"in {time.time() - start_time:.2f}s"
+    )
+    return list(detections.values())
+
+def _lookup_cached_results(file_paths: List[str], detector_types: List[str],
+                           stats: Optional[Dict[str, int]] = None) -> Tuple[Dict, Dict, Dict, Dict]:
+    """
+    Reuse results for files whose contents were already processed with the same model and parameters
+    
+    Returns:
+        Tuple of the results found per file, the detector types still to run per file, and the
+        file hashes and cache keys to store the fresh results under (see _store_fresh_results)
+    """
+    results = {file_path: {} for file_path in file_paths}
+    pending = {file_path: list(detector_types) for file_path in file_paths}
+    file_hashes = {}
+    cache_keys = {}
+    if not cache_enabled():
+        return results, pending, file_hashes, cache_keys
+    
+    for file_path in file_paths:
+        try:
+            file_hashes[file_path] = file_sha256(file_path)
+        except OSError as e:
+            logger.warning(f"Could not hash {file_path}, skipping result cache: {str(e)}")
+    
+    for detector_type in detector_types:
+        if detector_type not in MODEL_CONFIG:
+            continue
+        model_name = default_model_name(detector_type)
+        model_config = resolve_model_config(detector_type, model_name, MODEL_CONFIG[detector_type][model_name])
+        cache_keys[detector_type] = (model_name, model_version(model_config, model_name), params_key(model_config, detector_type))
         
+        cached = get_cached_results(file_hashes.values(), detector_type, *cache_keys[detector_type])
+        for file_path, file_hash in file_hashes.items():
+            if file_hash in cached:
+                # Timings of the run that filled the cache don't apply to this one
+                cached_result = {key: value for key, value in cached[file_hash].items() if key != 'timings'}
+                results[file_path][detector_type] = {
+                    'model_name': model_name,
+                    'result': dict(cached_result, cached=True)
+                }
+                pending[file_path].remove(detector_type)
+    
+    lookups = len(file_hashes) * len(cache_keys)
+    hits = sum(len(file_results) for file_results in results.values())
+    logger.info(f"Result cache: {hits}/{lookups} hits for {len(file_paths)} files")
+    if stats is not None:
+        stats['cache_hits'] = stats.get('cache_hits', 0) + hits
+        stats['cache_misses'] = stats.get('cache_misses', 0) + lookups - hits
+    
+    return results, pending, file_hashes, cache_keys
+
+def _store_fresh_results(file_path: str, file_results: Dict[str, Any], file_hashes: Dict[str, str],
+                         cache_keys: Dict[str, Tuple]):
+    """Add newly computed results of a file to the result cache"""
+    if file_path not in file_hashes:
+        return
+    for detector_type, result_data in file_results.items():
+        if detector_type in cache_keys:
+            store_result(file_hashes[file_path], detector_type, *cache_keys[detector_type], result_data['result'])
+
+def _render_cached_results(file_path: str, file_results: Dict[str, Any], image: Optional[DecodedImage] = None):
+    """
+    Draw the annotated images of results reused from the cache, if DETECTION_RENDER_IMAGES is on
+    
+    Image paths are not cached (UNCACHED_RESULT_KEYS), so a cached result has no annotated image
+    of its own. The file is decoded here unless its decoded image is passed in.
+    """
+    if not getattr(settings, 'DETECTION_RENDER_IMAGES', False):
+        return
+    
+    detector_types = [
+        detector_type for detector_type, result_data in file_results.items()
+        if result_data['result'].get('cached') and 'error' not in result_data['result']
+        and 'output_path' not in result_data['result'] and not model_service._is_classifier(detector_type)
+    ]
+    if not detector_types:
+        return
+    
+    decoded = image is None
+    try:
+        if decoded:
+            image = open_image(file_path)
+        for detector_type in detector_types:
+            model_service._render_yolo_result(image, detector_type, file_results[detector_type]['result'])
+    except Exception as e:
+        logger.error(f"Error rendering cached results of {file_path}: {str(e)}")
+    finally:
+        if decoded and image is not None:
+            image.release()
+
+def process_marker_file(marker_file, detector_types: List[str]) -> List[Detection]:
+    """
+    Process a marker file with the requested detector types
+    
+    Args:
+        marker_file: MarkerFile instance
+        detector_types: List of detector types to use
+        
+    Returns:
+        List of created Detection objects
+    """
+    logger.info(f"Processing file ID {marker_file.id} with detector types: {detector_types}")
+    
+    try:
+        return process_marker_files([marker_file], detector_types).get(marker_file.id, [])
     except Exception as e:
         logger.error(f"Error in process_marker_file: {str(e)}")
         logger.error(traceback.format_exc())
         return []
 
-def process_marker(marker) -> Dict[str, int]:
+def process_marker_files(marker_files, detector_types: List[str], batch_size: Optional[int] = None,
+                         stats: Optional[Dict[str, int]] = None,
+                         heartbeat: Optional[Callable[[], None]] = None) -> Dict[int, List[Detection]]:
+    """
+    Process several marker files with the requested detector types, batching images per forward pass
+    
+    Args:
+        marker_files: Iterable of MarkerFile instances
+        detector_types: List of detector types to use
+        batch_size: Maximum number of images per forward pass (defaults to DETECTION_BATCH_SIZE)
+        stats: Optional dictionary in which result cache hits and misses are counted
+        heartbeat: Called while long videos are processed
+        
+    Returns:
+        Dictionary mapping marker file IDs to their created Detection objects
+    """
+    # Collect the files that can actually be processed, videos are streamed frame by frame
+    files_by_path = {}
+    detections_by_file = {}
+    for marker_file in marker_files:
+        file_path = _processable_path(marker_file)
+        if not file_path:
+            continue
+        if is_video(file_path):
+            detections_by_file[marker_file.id] = process_video_file(
+                marker_file, file_path, detector_types, batch_size=batch_size, heartbeat=heartbeat
+            )
+        else:
+            files_by_path[file_path] = marker_file
+    
+    if not files_by_path:
+        return detections_by_file
+    
+    results, pending, file_hashes, cache_keys = _lookup_cached_results(list(files_by_path), detector_types, stats)
+    
+    # Group the remaining work by detector types so each group is batched together
+    groups = {}
+    for file_path, remaining_types in pending.items():
+        if remaining_types:
+            groups.setdefault(tuple(remaining_types), []).append(file_path)
+    
+    # Process with model service
+    for group_types, group_paths in groups.items():
+        try:
+            logger.info(f"Calling model service for {len(group_paths)} files")
+            start_time = time.time()
+            fresh_results = model_service.process_images(group_paths, list(group_types), batch_size=batch_size)
+            logger.info(f"Model processing completed in {time.time() - start_time:.2f}s for {len(group_paths)} files")
+        except Exception as e:
+            logger.error(f"Error in model processing: {str(e)}")
+            logger.error(traceback.format_exc())
+            continue
+        
+        for file_path, file_results in fresh_results.items():
+            results[file_path].update(file_results)
+            _store_fresh_results(file_path, file_results, file_hashes, cache_keys)
+    
+    for file_path in files_by_path:
+        _render_cached_results(file_path, results[file_path])
+    
+    # Create detection records for each file
+    detections_by_file.update({
+        marker_file.id: _create_detection_records(marker_file, results.get(file_path, {}), detector_types)
+        for file_path, marker_file in files_by_path.items()
+    })
+    return detections_by_file
+
+def process_marker(marker, batch_size: Optional[int] = None, detector_types: Optional[List[str]] = None,
+                   progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict[str, int]:
     """
     Process all files for a marker based on its detection settings
     
     Args:
         marker: Marker instance
+        batch_size: Maximum number of images per forward pass (defaults to DETECTION_BATCH_SIZE)
+        detector_types: Detector types to use instead of the marker's detection settings
+        progress_callback: Called with (files done, files total) after each batch of files
         
     Returns:
         Summary of processed files and detections
     """
     logger.info(f"Starting process_marker for marker ID {marker.id}")
     
-    detector_types = []
-    
-    # Check which detector types are enabled - use the correct field names
-    if marker.object_detection:
-        detector_types.append('object_detection')
-    if marker.camouflage_detection:  # Model field name
-        detector_types.append('military_detection')  # Detector type name
-    if marker.damage_assessment:
-        detector_types.append('damage_assessment')
-    if marker.thermal_analysis:  # Model field name
-        detector_types.append('emergency_recognition')  # Detector type name
+    if detector_types is None:
+        detector_types = []
+        
+        # Check which detector types are enabled - use the correct field names
+        if marker.object_detection:
+            detector_types.append('object_detection')
+        if marker.camouflage_detection:  # Model field name
+            detector_types.append('military_detection')  # Detector type name
+        if marker.damage_assessment:
+            detector_types.append('damage_assessment')
+        if marker.thermal_analysis:  # Model field name
+            detector_types.append('emergency_recognition')  # Detector type name
     
     logger.info(f"Enabled detector types: {detector_types}")
     
@@ -718,7 +1589,8 @@ def process_marker(marker) -> Dict[str, int]:
     error_count = 0
     start_time = time.time()
     
-    # Process all files
+    # Collect the files that exist on disk
+    marker_files = []
     for marker_file in marker.files.all():
         try:
             file_path = marker_file.file.path
@@ -727,22 +1599,68 @@ def process_marker(marker) -> Dict[str, int]:
                 logger.warning(f"File not found on disk: {file_path}")
                 error_count += 1
                 continue
-                
-            logger.info(f"Processing file {marker_file.id} with detector types {detector_types}")
-            detections = process_marker_file(marker_file, detector_types)
             
-            if detections:
-                processed_count += 1
-                detection_count += len(detections)
-                logger.info(f"Created {len(detections)} detections for file {marker_file.id}")
-            else:
-                logger.info(f"No detections created for file {marker_file.id}")
-                
+            marker_files.append(marker_file)
         except Exception as e:
             logger.error(f"Error processing file {marker_file.id}: {str(e)}")
             logger.error(traceback.format_exc())
             error_count += 1
     
+    # Process all files in batches
+    if batch_size is None:
+        batch_size = getattr(settings, 'DETECTION_BATCH_SIZE', 8)
+    batch_size = max(1, int(batch_size))
+    
+    # Classifiers predict every file of a chunk together, so chunks grow to their batch size
+    chunk_size = batch_size
+    if any(model_service._is_classifier(detector_type) for detector_type in detector_types):
+        chunk_size = max(batch_size, getattr(settings, 'DETECTION_CLASSIFIER_BATCH_SIZE', 32))
+    
+    logger.info(f"Processing {len(marker_files)} files with detector types {detector_types}")
+    detections_by_file = {}
+    cache_stats = {'cache_hits': 0, 'cache_misses': 0}
+    if getattr(settings, 'DETECTION_PIPELINE', 'sequential') == 'staged':
+        from .pipeline import process_marker_files_staged
+        
+        # All files go through one pipeline, so reading and decoding overlap inference throughout
+        try:
+            detections_by_file = process_marker_files_staged(
+                marker_files, detector_types, batch_size, stats=cache_stats, progress_callback=progress_callback
+            )
+            # Images a stage failed on are stored with error results
+            error_count += cache_stats.pop('failed_files', 0)
+        except Exception as e:
+            logger.error(f"Error processing files for marker {marker.id}: {str(e)}")
+            logger.error(traceback.format_exc())
+            error_count += len(marker_files)
+    else:
+        for batch_start in range(0, len(marker_files), chunk_size):
+            batch_files = marker_files[batch_start:batch_start + chunk_size]
+            heartbeat = None
+            if progress_callback:
+                heartbeat = lambda files_done=batch_start: progress_callback(files_done, len(marker_files))
+            try:
+                detections_by_file.update(process_marker_files(
+                    batch_files, detector_types, batch_size=batch_size, stats=cache_stats, heartbeat=heartbeat
+                ))
+            except Exception as e:
+                logger.error(f"Error processing files for marker {marker.id}: {str(e)}")
+                logger.error(traceback.format_exc())
+                error_count += len(batch_files)
+            
+            if progress_callback:
+                progress_callback(batch_start + len(batch_files), len(marker_files))
+    
+    for marker_file in marker_files:
+        detections = detections_by_file.get(marker_file.id, [])
+        
+        if detections:
+            processed_count += 1
+            detection_count += len(detections)
+            logger.info(f"Created {len(detections)} detections for file {marker_file.id}")
+        else:
+            logger.info(f"No detections created for file {marker_file.id}")
+    
     # Calculate total processing time
     total_time = time.time() - start_time
     
@@ -750,8 +1668,13 @@ def process_marker(marker) -> Dict[str, int]:
         'processed': processed_count,
         'detections': detection_count,
         'errors': error_count,
-        'processing_time': f"{total_time:.2f}s"
+        'processing_time': f"{total_time:.2f}s",
+        'cache_hits': cache_stats['cache_hits'],
+        'cache_misses': cache_stats['cache_misses']
     }
+    if 'pipeline' in cache_stats:
+        # Queue depth and utilization per stage, to find the bottleneck of a run
+        result['pipeline'] = cache_stats['pipeline']
     
     logger.info(f"Finished processing marker {marker.id}: {result}")
     return result
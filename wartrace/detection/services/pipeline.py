@@ -0,0 +1,577 @@
+import time
+import queue
+import logging
+import threading
+import traceback
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import connections
+
+from .images import open_image
+from .main import (
+    MODEL_CONFIG, default_model_name, model_service, _create_detection_records, _elapsed_ms, _lookup_cached_results,
+    _processable_path, _render_cached_results, _store_fresh_results, process_video_file
+)
+from .video import is_video
+
+logger = logging.getLogger(__name__)
+
+# Stages of the detection pipeline and their default worker threads. Reading files and
+# rendering wait on the disk, so they get a second worker; the models run one batch at a time.
+DETECTION_STAGES = (
+    ('load', 2),
+    ('preprocess', 1),
+    ('infer', 1),
+    ('postprocess', 1),
+    ('render', 1),
+    ('persist', 1)
+)
+
+# Pipelines running in this process, reported by ModelService.status()
+_running = {}
+_running_lock = threading.Lock()
+_last_stats = {}
+
+# Marks the end of the input in a stage queue
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a StagedPipeline
+
+    `fn` receives one item, or a list of up to `batch_size` items, and returns what is passed
+    to the next stage (None drops the item); when it raises, the pipeline's on_error decides
+    what becomes of the items. Each stage reads from its own bounded queue, so a slow stage
+    makes the stages before it wait instead of letting items pile up in memory.
+    """
+
+    def __init__(self, name: str, fn: Callable, workers: int = 1, queue_size: int = 8, batch_size: int = 1,
+                 batch_timeout: float = 0.05, teardown: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.batch_size = max(1, batch_size)
+        # How long a batching stage waits for more items once it has one
+        self.batch_timeout = batch_timeout
+        # Run by each worker thread when it exits (e.g. closing its database connection)
+        self.teardown = teardown
+
+
+class StagedPipeline:
+    """
+    Runs items through stages connected by bounded queues, each stage on its own worker threads
+
+    Stages overlap: while one batch is in the models, the next files are read and decoded
+    and the previous ones are rendered and stored. OpenCV, the model runtimes and the database
+    driver release the GIL during their work, so threads are enough to keep the CPU busy
+    during disk and database I/O.
+    """
+
+    def __init__(self, stages: List[Stage], name: str = 'pipeline',
+                 on_error: Optional[Callable[[Any, str, Exception], Any]] = None):
+        self.name = name
+        self.stages = stages
+        # Called with (item, stage name, error) for each item of a stage call that raised; returns
+        # the item to pass on (e.g. marked as failed, for the last stage to record) or None to drop it
+        self.on_error = on_error
+        self._queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+        self._lock = threading.Lock()
+        self._outputs = []
+        self._stats = [
+            {'processed': 0, 'errors': 0, 'busy': 0.0, 'blocked': 0.0, 'max_depth': 0, 'depth_sum': 0, 'depth_samples': 0}
+            for _ in stages
+        ]
+        self._active_workers = [stage.workers for stage in stages]
+        self._started_at = None
+        self._finished_at = None
+
+    def run(self, items: Iterable[Any]) -> List[Any]:
+        """
+        Push the items through every stage and wait for them to come out
+
+        Returns:
+            The outputs of the last stage, in completion order
+        """
+        self._started_at = time.perf_counter()
+        with _running_lock:
+            _running[id(self)] = self
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work, args=(index,), name=f"{self.name}-{stage.name}-{worker}", daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for item in items:
+                self._put(-1, item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._queues[0].put(_DONE)
+            for thread in threads:
+                thread.join()
+
+            self._finished_at = time.perf_counter()
+            with _running_lock:
+                _running.pop(id(self), None)
+                _last_stats.clear()
+                _last_stats.update(self.stats())
+
+        return self._outputs
+
+    def _put(self, index: int, item: Any):
+        """Pass an item to the stage after `index`, or to the outputs after the last stage"""
+        if index + 1 == len(self.stages):
+            with self._lock:
+                self._outputs.append(item)
+            return
+
+        next_queue = self._queues[index + 1]
+        blocked_start = time.perf_counter()
+        next_queue.put(item)
+        stats = self._stats[index + 1]
+        with self._lock:
+            depth = next_queue.qsize()
+            stats['max_depth'] = max(stats['max_depth'], depth)
+            stats['depth_sum'] += depth
+            stats['depth_samples'] += 1
+            if index >= 0:
+                # Time a full queue held this stage back
+                self._stats[index]['blocked'] += time.perf_counter() - blocked_start
+
+    def _take(self, index: int) -> Optional[List[Any]]:
+        """Next batch of items for a stage, or None once its input is exhausted"""
+        stage = self.stages[index]
+        stage_queue = self._queues[index]
+
+        item = stage_queue.get()
+        if item is _DONE:
+            return None
+
+        batch = [item]
+        deadline = time.perf_counter() + stage.batch_timeout
+        while len(batch) < stage.batch_size:
+            try:
+                item = stage_queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if item is _DONE:
+                # Leave the end marker for this worker's next call
+                stage_queue.put(_DONE)
+                break
+            batch.append(item)
+        return batch
+
+    def _work(self, index: int):
+        stage = self.stages[index]
+        stats = self._stats[index]
+        try:
+            while True:
+                batch = self._take(index)
+                if batch is None:
+                    break
+
+                busy_start = time.perf_counter()
+                try:
+                    outputs = stage.fn(batch) if stage.batch_size > 1 else [stage.fn(batch[0])]
+                except Exception as e:
+                    logger.error(f"Error in {stage.name} stage of {self.name}: {str(e)}")
+                    logger.error(traceback.format_exc())
+                    with self._lock:
+                        stats['errors'] += len(batch)
+                    outputs = self._failed(stage, batch, e)
+                busy = time.perf_counter() - busy_start
+
+                with self._lock:
+                    stats['processed'] += len(batch)
+                    stats['busy'] += busy
+
+                for output in outputs:
+                    if output is not None:
+                        self._put(index, output)
+        finally:
+            if stage.teardown:
+                stage.teardown()
+
+            # The last worker of a stage to finish ends the input of the next stage
+            with self._lock:
+                self._active_workers[index] -= 1
+                last = self._active_workers[index] == 0
+            if last and index + 1 < len(self.stages):
+                for _ in range(self.stages[index + 1].workers):
+                    self._queues[index + 1].put(_DONE)
+
+    def _failed(self, stage: Stage, batch: List[Any], error: Exception) -> List[Any]:
+        """Items of a failed stage call to pass on, as returned by on_error"""
+        if self.on_error is None:
+            return []
+
+        outputs = []
+        for item in batch:
+            try:
+                outputs.append(self.on_error(item, stage.name, error))
+            except Exception as e:
+                logger.error(f"Error handling a failed item in {stage.name} stage of {self.name}: {str(e)}")
+                logger.error(traceback.format_exc())
+        return outputs
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Queue depth and utilization of each stage
+
+        Utilization is the share of its workers' time a stage spent working; a stage near 1.0
+        with a full queue is the bottleneck. 'blocked' is the time it waited on the next stage.
+        """
+        end = self._finished_at or time.perf_counter()
+        elapsed = end - self._started_at if self._started_at else 0.0
+
+        with self._lock:
+            stages = [
+                {
+                    'name': stage.name,
+                    'workers': stage.workers,
+                    'batch_size': stage.batch_size,
+                    'queue_size': stage.queue_size,
+                    'queue_depth': self._queues[index].qsize(),
+                    'mean_queue_depth': round(stats['depth_sum'] / stats['depth_samples'], 2) if stats['depth_samples'] else 0.0,
+                    'max_queue_depth': stats['max_depth'],
+                    'processed': stats['processed'],
+                    'errors': stats['errors'],
+                    'busy_s': round(stats['busy'], 3),
+                    'blocked_s': round(stats['blocked'], 3),
+                    'utilization': round(stats['busy'] / (elapsed * stage.workers), 3) if elapsed else 0.0
+                }
+                for index, (stage, stats) in enumerate(zip(self.stages, self._stats))
+            ]
+            completed = len(self._outputs)
+
+        return {
+            'name': self.name,
+            'running': self._finished_at is None,
+            'elapsed_s': round(elapsed, 3),
+            'completed': completed,
+            'throughput': round(completed / elapsed, 2) if elapsed else 0.0,
+            'stages': stages
+        }
+
+
+def pipeline_status() -> Dict[str, Any]:
+    """Stats of the pipelines running in this process and of the last one that finished"""
+    with _running_lock:
+        running = list(_running.values())
+        last = dict(_last_stats) or None
+    return {'running': [pipeline.stats() for pipeline in running], 'last': last}
+
+
+def stage_workers() -> Dict[str, int]:
+    """Worker threads per detection stage, with DETECTION_PIPELINE_WORKERS overrides ('load=2,render=2')"""
+    workers = dict(DETECTION_STAGES)
+    for entry in getattr(settings, 'DETECTION_PIPELINE_WORKERS', '').split(','):
+        name, _, count = entry.partition('=')
+        name = name.strip()
+        if not name:
+            continue
+        if name not in workers or not count.strip().isdigit():
+            logger.warning(f"Ignoring DETECTION_PIPELINE_WORKERS entry {entry!r}")
+            continue
+        workers[name] = int(count)
+    return workers
+
+
+class DetectionPipeline:
+    """
+    Stages of processing marker image files: load, preprocess, infer, postprocess, render, persist
+
+    Each item is a dictionary for one file carrying its decoded image, the detector types still
+    to run (after the result cache) and its results as they are filled in. An item whose stage
+    fails is passed on with an error result for those detectors (see fail), so persist stores it.
+    """
+
+    def __init__(self, detector_types: List[str], batch_size: int,
+                 progress: Optional[Callable[[], None]] = None):
+        self.detector_types = [detector_type for detector_type in detector_types if detector_type in MODEL_CONFIG]
+        self.classifier_types = [detector_type for detector_type in self.detector_types if model_service._is_classifier(detector_type)]
+        self.progress = progress
+        self.max_side = getattr(settings, 'DETECTION_INFERENCE_MAX_SIDE', 0)
+        self.render = getattr(settings, 'DETECTION_RENDER_IMAGES', False)
+        self.models = {}
+        self.cache_keys = {}
+        self.file_hashes = {}
+        self.stats = None
+        self.failed = 0
+
+        queue_size = getattr(settings, 'DETECTION_PIPELINE_QUEUE_SIZE', 0) or 2 * batch_size
+        workers = stage_workers()
+        self.stages = [
+            Stage('load', self.load, workers['load'], queue_size),
+            Stage('preprocess', self.preprocess, workers['preprocess'], queue_size),
+            # Batches form from whatever is decoded; the models are never left waiting for a full batch
+            Stage('infer', self.infer, workers['infer'], queue_size, batch_size=batch_size),
+            Stage('postprocess', self.postprocess, workers['postprocess'], queue_size),
+            Stage('render', self.render_item, workers['render'], queue_size),
+            # Each persist thread has its own database connection
+            Stage('persist', self.persist, workers['persist'], queue_size, teardown=connections.close_all)
+        ]
+
+    def run(self, files_by_path: Dict[str, Any], stats: Optional[Dict[str, int]] = None) -> Dict[int, List]:
+        """
+        Process the files and store their detections
+
+        Returns:
+            Dictionary mapping marker file IDs to their created Detection objects
+        """
+        results, pending, self.file_hashes, self.cache_keys = _lookup_cached_results(
+            list(files_by_path), self.detector_types, stats
+        )
+        # Models load before the first batch so the load time is not charged to a stage
+        self.models = {detector_type: model_service.get_model(detector_type) for detector_type in self.detector_types}
+
+        items = (
+            {
+                'marker_file': marker_file,
+                'file_path': file_path,
+                'results': results[file_path],
+                'pending': pending[file_path],
+                'image': None,
+                'predictions': {},
+                'classifier_inputs': {}
+            }
+            for file_path, marker_file in files_by_path.items()
+        )
+
+        pipeline = StagedPipeline(self.stages, name='detection', on_error=self.fail)
+        outputs = pipeline.run(items)
+        self.stats = pipeline.stats()
+        self.failed = sum(1 for item in outputs if item.get('error'))
+        logger.info(f"Detection pipeline stats: {self.stats}")
+        return {item['marker_file'].id: item['detections'] for item in outputs}
+
+    def fail(self, item: Dict, stage: str, error: Exception) -> Dict:
+        """
+        Mark an item whose stage raised as failed and free its image
+
+        The detectors that had not produced a result get an error result, like an image the
+        models could not process; the later stages pass the item through and persist stores it.
+        """
+        try:
+            if item['image'] is not None:
+                item['image'].release()
+        finally:
+            item['image'] = None
+
+        item['error'] = f"{stage}: {str(error)}"
+        for detector_type in item['pending']:
+            if detector_type not in item['results']:
+                item['results'][detector_type] = {
+                    'model_name': default_model_name(detector_type),
+                    'result': {
+                        'detections': [],
+                        'summary': f"Error processing image: {str(error)}",
+                        'error': str(error)
+                    }
+                }
+        item['pending'] = []
+        item['predictions'] = {}
+        item['classifier_inputs'] = {}
+        # Set by persist; empty if persist is the stage that failed
+        item.setdefault('detections', [])
+        return item
+
+    def load(self, item: Dict) -> Dict:
+        """Read the file into memory"""
+        if not item['pending']:
+            return item
+
+        read_start = time.perf_counter()
+        try:
+            item['image'] = open_image(item['file_path'], max_side=self.max_side)
+            item['image'].load()
+            item['image'].timings['read_ms'] = _elapsed_ms(read_start)
+        except Exception as e:
+            # Stored as failed, like a file the models could not process
+            logger.error(f"Error reading {item['file_path']}: {str(e)}")
+            return self.fail(item, 'load', e)
+        return item
+
+    def preprocess(self, item: Dict) -> Dict:
+        """Decode the image, resize it for inference and prepare the classifier inputs"""
+        image = item['image']
+        if image is None:
+            return item
+
+        try:
+            decode_start = time.perf_counter()
+            image.inference_array
+            image.timings['decode_ms'] = _elapsed_ms(decode_start)
+        except Exception as e:
+            # Every detector records the error in its result
+            logger.error(f"Error decoding {item['file_path']}: {str(e)}")
+
+        for detector_type in self.classifier_types:
+            model_data = self.models.get(detector_type)
+            if detector_type in item['pending'] and model_data:
+                item['classifier_inputs'][detector_type] = model_service._prepare_keras_inputs(
+                    [image], model_data['model'], model_data['config']
+                )[0]
+        return item
+
+    def infer(self, batch: List[Dict]) -> List[Dict]:
+        """Run the models over a batch of decoded images"""
+        # Files share forward passes with the files that still need the same detectors
+        groups = {}
+        for item in batch:
+            image_types = tuple(
+                detector_type for detector_type in item['pending']
+                if detector_type not in self.classifier_types and detector_type in self.detector_types
+            )
+            if image_types:
+                groups.setdefault(image_types, []).append(item)
+
+        for image_types, group in groups.items():
+            predictions = model_service.process_decoded_images(
+                [item['image'] for item in group], list(image_types), postprocess=False
+            )
+            for item, item_predictions in zip(group, predictions):
+                item['predictions'].update(item_predictions)
+
+        for detector_type in self.classifier_types:
+            model_data = self.models.get(detector_type)
+            group = [item for item in batch if detector_type in item['classifier_inputs']]
+            if not group:
+                continue
+
+            try:
+                with model_service._model_slot(f"{detector_type}_{model_data['model_name']}", model_data['config']):
+                    outputs = model_service._classify_prepared(
+                        [item['classifier_inputs'].pop(detector_type) for item in group],
+                        detector_type, model_data['model'], model_data['config']
+                    )
+            except Exception as e:
+                logger.error(f"Error processing {detector_type} for {len(group)} images: {str(e)}")
+                logger.error(traceback.format_exc())
+                continue
+
+            for item, output in zip(group, outputs):
+                item['results'][detector_type] = {'model_name': model_data['model_name'], 'result': output}
+
+        return batch
+
+    def postprocess(self, item: Dict) -> Dict:
+        """Convert the raw detector predictions into results"""
+        for detector_type, prediction_data in item.pop('predictions').items():
+            config = self.models[detector_type]['config']
+            item['results'][detector_type] = {
+                'model_name': prediction_data['model_name'],
+                'result': model_service._postprocess_yolo(
+                    item['image'], detector_type, config, prediction_data['result'], render=False
+                )
+            }
+        return item
+
+    def render_item(self, item: Dict) -> Dict:
+        """Draw and save the annotated images, then free the decoded image"""
+        image = item['image']
+        if image is None:
+            # Nothing left to run on the file, or it failed; cached results still get their images
+            if self.render and not item.get('error'):
+                _render_cached_results(item['file_path'], item['results'])
+            return item
+
+        try:
+            if self.render:
+                _render_cached_results(item['file_path'], item['results'], image)
+                for detector_type, result_data in item['results'].items():
+                    result = result_data['result']
+                    if detector_type in self.classifier_types or result.get('cached') or 'error' in result:
+                        continue
+                    if 'output_path' not in result:
+                        try:
+                            model_service._render_yolo_result(image, detector_type, result)
+                        except Exception as e:
+                            logger.error(f"Error rendering {detector_type} result of {item['file_path']}: {str(e)}")
+        finally:
+            image.release()
+            item['image'] = None
+        return item
+
+    def persist(self, item: Dict) -> Dict:
+        """Store the fresh results in the cache and write the detection rows"""
+        fresh = {
+            detector_type: result_data for detector_type, result_data in item['results'].items()
+            if not result_data['result'].get('cached')
+        }
+        try:
+            _store_fresh_results(item['file_path'], fresh, self.file_hashes, self.cache_keys)
+            item['detections'] = _create_detection_records(item['marker_file'], item['results'], self.detector_types)
+        finally:
+            if self.progress:
+                self.progress()
+        return item
+
+
+def process_marker_files_staged(marker_files, detector_types: List[str], batch_size: int,
+                                stats: Optional[Dict[str, int]] = None,
+                                progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict[int, List]:
+    """
+    Process marker files through the staged pipeline
+
+    Images go through DetectionPipeline; videos are streamed frame by frame afterwards,
+    as by process_marker_files.
+
+    Args:
+        marker_files: MarkerFile instances
+        detector_types: List of detector types to use
+        batch_size: Maximum number of images per forward pass
+        stats: Optional dictionary in which result cache hits and misses are counted, the
+            pipeline stats are stored under 'pipeline' and the images that failed under 'failed_files'
+        progress_callback: Called with (files done, files total) after each file is stored
+
+    Returns:
+        Dictionary mapping marker file IDs to their created Detection objects
+    """
+    files_by_path = {}
+    videos = []
+    for marker_file in marker_files:
+        file_path = _processable_path(marker_file)
+        if not file_path:
+            continue
+        if is_video(file_path):
+            videos.append((marker_file, file_path))
+        else:
+            files_by_path[file_path] = marker_file
+
+    total = len(marker_files)
+    done = {'files': total - len(files_by_path) - len(videos)}
+    progress_lock = threading.Lock()
+
+    def progress():
+        with progress_lock:
+            done['files'] += 1
+            files_done = done['files']
+        if progress_callback:
+            progress_callback(files_done, total)
+
+    detections_by_file = {}
+    if files_by_path:
+        pipeline = DetectionPipeline(detector_types, batch_size, progress)
+        detections_by_file.update(pipeline.run(files_by_path, stats))
+        if stats is not None:
+            stats['pipeline'] = pipeline.stats
+            stats['failed_files'] = pipeline.failed
+
+    for marker_file, file_path in videos:
+        heartbeat = None
+        if progress_callback:
+            heartbeat = lambda: progress_callback(done['files'], total)
+        detections_by_file[marker_file.id] = process_video_file(
+            marker_file, file_path, detector_types, batch_size=batch_size, heartbeat=heartbeat
+        )
+        progress()
+
+    return detections_by_file
@@ -0,0 +1,174 @@
+import gc
+import os
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Model types that can be loaded before fork: their weights are plain tensors/arrays and
+# loading them starts no threads. TensorFlow and ONNX Runtime start thread pools when a
+# model or session is created, which forked children inherit without their threads.
+FORK_SAFE_MODEL_TYPES = ('ultralytics', 'stub')
+
+# Models loaded by preload_for_fork, in this process or in the parent it was forked from
+_preloaded = {'pid': None, 'models': [], 'skipped': []}
+
+
+def memory_usage(pid: Optional[int] = None) -> Dict[str, Optional[float]]:
+    """
+    Resident memory of a process in MB
+
+    rss counts every page the process maps, including the ones it shares with the
+    processes it was forked from. pss charges shared pages in equal parts to the processes
+    sharing them, so the pss of all workers adds up to their real footprint. uss only
+    counts pages private to the process, the memory one more worker would add.
+    """
+    try:
+        import psutil
+    except ImportError:
+        from .main import _process_rss_mb
+        return {'rss_mb': round(_process_rss_mb(), 1), 'pss_mb': None, 'uss_mb': None, 'shared_mb': None}
+
+    process = psutil.Process(pid)
+    try:
+        info = process.memory_full_info()
+    except psutil.AccessDenied:
+        info = process.memory_info()
+
+    mb = 1024 * 1024
+    uss = getattr(info, 'uss', None)
+    pss = getattr(info, 'pss', None)
+    return {
+        'rss_mb': round(info.rss / mb, 1),
+        'pss_mb': round(pss / mb, 1) if pss is not None else None,
+        'uss_mb': round(uss / mb, 1) if uss is not None else None,
+        'shared_mb': round((info.rss - uss) / mb, 1) if uss is not None else None
+    }
+
+
+def preloaded_models() -> List[str]:
+    """Keys of the models this process holds from preload_for_fork (its own or inherited by fork)"""
+    return list(_preloaded['models'])
+
+
+def preload_for_fork(detector_types: Optional[List[str]] = None, workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Load read-only model weights once, in a process about to fork its workers
+
+    Forked workers map the weights copy-on-write, so every worker shares the parent's pages
+    as long as nothing writes to them:
+    - models are warmed up here, so layer fusing and predictor setup (which replace the
+      weight tensors) happen before fork instead of once per worker
+    - warm-up runs on one thread, so torch doesn't start its OpenMP pool in the parent;
+      workers size their own pools in after_fork
+    - the garbage collector is kept off while loading and the surviving objects are frozen,
+      so collections in the workers never write to the pages holding them
+
+    Only FORK_SAFE_MODEL_TYPES are loaded; other detectors load in each worker as before.
+
+    Args:
+        detector_types: Detector types to load (defaults to DETECTION_PRELOAD_MODELS)
+        workers: Worker processes that will be forked, for the report
+
+    Returns:
+        The loaded and skipped models and the memory of this process before and after
+    """
+    from .backends import resolve_model_config
+    from .main import MODEL_CONFIG, default_model_name, model_service
+
+    if detector_types is None:
+        detector_types = getattr(settings, 'DETECTION_PRELOAD_MODELS', [])
+
+    fork_safe, skipped = [], []
+    for detector_type in detector_types:
+        if detector_type not in MODEL_CONFIG:
+            logger.warning(f"Cannot preload unknown detector type: {detector_type}")
+            continue
+        model_name = default_model_name(detector_type)
+        model_type = resolve_model_config(detector_type, model_name, MODEL_CONFIG[detector_type][model_name])['type']
+        if model_type in FORK_SAFE_MODEL_TYPES:
+            fork_safe.append(detector_type)
+        else:
+            skipped.append(detector_type)
+            logger.warning(f"Not preloading {detector_type} before fork: {model_type} models are loaded in each worker")
+
+    memory_before = memory_usage()
+    start_time = time.time()
+
+    gc.disable()
+    try:
+        model_service.configure_threads(budget={'intra_op': 1, 'inter_op': 1})
+        loaded = model_service.preload(fork_safe)
+        gc.collect()
+        gc.freeze()
+    finally:
+        gc.enable()
+
+    _preloaded.update(pid=os.getpid(), models=loaded, skipped=skipped)
+    report = {
+        'pid': os.getpid(),
+        'models': loaded,
+        'skipped': skipped,
+        'workers': workers,
+        'load_time': round(time.time() - start_time, 3),
+        'frozen_objects': gc.get_freeze_count(),
+        'memory_before': memory_before,
+        'memory_after': memory_usage()
+    }
+    logger.info(f"Preloaded models for forked workers: {report}")
+    return report
+
+
+def after_fork(workers: Optional[int] = None) -> Dict[str, int]:
+    """
+    Set up a worker forked from a process that ran preload_for_fork
+
+    Sizes this worker's thread pools for its share of the cores, which the parent left at
+    one thread. Returns the thread budget in use.
+    """
+    from .main import model_service
+
+    budget = model_service.configure_threads(workers)
+    logger.info(f"Worker {os.getpid()} forked from {_preloaded['pid']} with models {_preloaded['models']}: "
+                f"{memory_usage()}")
+    return budget
+
+
+def preload_status() -> Dict[str, Any]:
+    """Models shared from a parent process, for the model status endpoint"""
+    return {
+        'parent_pid': _preloaded['pid'] if _preloaded['pid'] != os.getpid() else None,
+        'models': list(_preloaded['models']),
+        'skipped': list(_preloaded['skipped']),
+        'frozen_objects': gc.get_freeze_count()
+    }
+
+
+def benchmark_fork_worker(detector_types: List[str], frames: list, preloaded: bool, workers: int, barrier, results):
+    """
+    Fork preload benchmark process: run the detectors over the frames, loading the models
+    first unless they were preloaded in the parent, then report this worker's memory while
+    every worker is still alive (shared pages are only split between live processes)
+    """
+    from .main import model_service
+    from .video import VideoFrame
+
+    if preloaded:
+        after_fork(workers)
+    else:
+        model_service.configure_threads(workers)
+        model_service.preload(detector_types)
+
+    # Decoded arrays in memory, the detectors read them like decoded video frames
+    images = [VideoFrame('benchmark', frame, index, 0.0) for index, frame in enumerate(frames)]
+    start_time = time.perf_counter()
+    model_service.process_decoded_images(images, detector_types, postprocess=False)
+    elapsed = time.perf_counter() - start_time
+
+    barrier.wait(timeout=600)
+    results.put({'pid': os.getpid(), 'memory': memory_usage(), 'elapsed': elapsed})
+    # Stay alive until every process has measured itself
+    barrier.wait(timeout=600)
@@ -0,0 +1,203 @@
+import re
+import logging
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def yolo_input_tensor(img: np.ndarray, imgsz: int) -> np.ndarray:
+    """Letterbox a BGR image into the (1, 3, imgsz, imgsz) float tensor a YOLO graph expects"""
+    h, w = img.shape[:2]
+    scale = imgsz / max(h, w)
+    resized = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_LINEAR)
+
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top = (imgsz - resized.shape[0]) // 2
+    left = (imgsz - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+
+    tensor = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB).transpose(2, 0, 1)[None]
+    return np.ascontiguousarray(tensor, dtype=np.float32) / 255.0
+
+
+def _head_prefix(node_names: Sequence[str]) -> Optional[str]:
+    """Name prefix of the detection head (the last '/model.N/' block of an ultralytics graph)"""
+    indices = [int(match.group(1)) for name in node_names for match in [re.match(r'^/model\.(\d+)/', name)] if match]
+    return f"/model.{max(indices)}/" if indices else None
+
+
+def quantize_onnx_model(source_path: str, output_path: str, images: List[np.ndarray], imgsz: int = 640) -> str:
+    """
+    Quantize an exported YOLO ONNX graph to INT8 with static calibration
+
+    Weights are quantized per channel and activations are calibrated on the given images.
+    The detection head is kept in float: it concatenates pixel box coordinates with class
+    scores, and a shared INT8 scale would wipe out the scores.
+
+    Returns:
+        Path of the quantized model
+    """
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    graph = onnx.load(source_path)
+    input_name = graph.graph.input[0].name
+    head = _head_prefix([node.name for node in graph.graph.node])
+    nodes_to_exclude = [node.name for node in graph.graph.node if head and node.name.startswith(head)]
+    del graph
+
+    class UploadCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self._tensors = (yolo_input_tensor(img, imgsz) for img in images)
+
+        def get_next(self):
+            tensor = next(self._tensors, None)
+            return None if tensor is None else {input_name: tensor}
+
+    logger.info(f"Quantizing {source_path} with {len(images)} calibration images ({len(nodes_to_exclude)} head nodes kept in float)")
+    quantize_static(
+        source_path,
+        output_path,
+        UploadCalibrationReader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        nodes_to_exclude=nodes_to_exclude
+    )
+    return output_path
+
+
+def quantize_keras_model(model, output_path: str, batches: List[np.ndarray]) -> str:
+    """
+    Convert a Keras classifier to an INT8 TFLite model, calibrated on preprocessed batches
+
+    Inputs and outputs stay float32 so the quantized model is a drop-in replacement.
+    """
+    import tensorflow as tf
+
+    def representative_dataset():
+        for batch in batches:
+            for sample in batch:
+                yield [sample[None].astype(np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    return output_path
+
+
+class TFLiteClassifier:
+    """
+    Runs a TFLite classifier behind the part of the Keras model interface ModelService uses
+    (input_shape and predict)
+    """
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        import tensorflow as tf
+
+        self.model_path = model_path
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple(None if dim < 0 else int(dim) for dim in self._input['shape_signature'])
+        self._batch_shape = None
+
+    def predict(self, batch: np.ndarray, batch_size: Optional[int] = None, verbose: int = 0) -> np.ndarray:
+        if self._batch_shape != batch.shape:
+            self.interpreter.resize_tensor_input(self._input['index'], batch.shape)
+            self.interpreter.allocate_tensors()
+            self._batch_shape = batch.shape
+
+        self.interpreter.set_tensor(self._input['index'], batch.astype(np.float32))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output['index'])
+
+
+def _iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of two (N, 4) and (M, 4) x1, y1, x2, y2 arrays"""
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (boxes_a[:, 2:] - boxes_a[:, :2]).clip(0).prod(axis=1)
+    area_b = (boxes_b[:, 2:] - boxes_b[:, :2]).clip(0).prod(axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def mean_average_precision(predictions: List[List[Dict[str, Any]]], references: List[List[Dict[str, Any]]],
+                           iou_threshold: float = 0.5) -> Tuple[float, Dict[str, float]]:
+    """
+    mAP@iou_threshold of predictions against reference detections, VOC style (all-point interpolation)
+
+    Args:
+        predictions: Detections ('label', 'confidence', 'bbox') per image
+        references: Reference detections ('label', 'bbox') per image, in the same order
+
+    Returns:
+        Tuple of the mean AP and the AP of each reference class
+    """
+    scored = defaultdict(list)      # label -> [(confidence, is_true_positive)]
+    reference_counts = defaultdict(int)
+
+    for image_predictions, image_references in zip(predictions, references):
+        by_label = defaultdict(list)
+        for ref in image_references:
+            by_label[ref['label']].append(ref['bbox'])
+            reference_counts[ref['label']] += 1
+
+        for label in {det['label'] for det in image_predictions}:
+            dets = sorted((det for det in image_predictions if det['label'] == label), key=lambda det: -det['confidence'])
+            refs = np.array(by_label.get(label, []), dtype=np.float64).reshape(-1, 4)
+            ious = _iou_matrix(np.array([det['bbox'] for det in dets], dtype=np.float64), refs) if len(refs) else None
+            matched = np.zeros(len(refs), dtype=bool)
+
+            for index, det in enumerate(dets):
+                true_positive = False
+                if ious is not None:
+                    candidates = np.where(~matched & (ious[index] >= iou_threshold))[0]
+                    if len(candidates):
+                        matched[candidates[np.argmax(ious[index, candidates])]] = True
+                        true_positive = True
+                scored[label].append((det['confidence'], true_positive))
+
+    class_ap = {}
+    for label, count in reference_counts.items():
+        results = sorted(scored.get(label, []), key=lambda item: -item[0])
+        if not results:
+            class_ap[label] = 0.0
+            continue
+
+        hits = np.array([tp for _, tp in results], dtype=np.float64)
+        true_positives = np.cumsum(hits)
+        recall = true_positives / count
+        precision = true_positives / np.arange(1, len(hits) + 1)
+
+        # Area under the precision envelope
+        recall = np.concatenate(([0.0], recall, [1.0]))
+        precision = np.concatenate(([1.0], precision, [0.0]))
+        precision = np.maximum.accumulate(precision[::-1])[::-1]
+        steps = np.where(recall[1:] != recall[:-1])[0]
+        class_ap[label] = float(np.sum((recall[steps + 1] - recall[steps]) * precision[steps + 1]))
+
+    mean_ap = float(np.mean(list(class_ap.values()))) if class_ap else 0.0
+    return mean_ap, class_ap
+
+
+def top1_agreement(predictions: List[np.ndarray], reference_labels: List[str], labels: Sequence[str]) -> float:
+    """Share of images whose top predicted label matches the stored top label"""
+    if not reference_labels:
+        return 0.0
+    agree = 0
+    for probabilities, reference in zip(predictions, reference_labels):
+        label_idx = int(np.argmax(probabilities))
+        label = labels[label_idx] if label_idx < len(labels) else f"class_{label_idx}"
+        agree += label == reference
+    return agree / len(reference_labels)
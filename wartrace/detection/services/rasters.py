@@ -0,0 +1,267 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+logger = logging.getLogger(__name__)
+
+RASTER_EXTENSIONS = ('.tif', '.tiff')
+
+# Rows decoded at once while building an overview, rounded up to the strip/tile height
+OVERVIEW_BAND_ROWS = 512
+
+Window = Tuple[int, int, int, int]
+
+
+def is_raster(file_path: str) -> bool:
+    """Whether a file is read through RasterImage instead of being decoded whole"""
+    return tifffile is not None and os.path.splitext(file_path)[1].lower() in RASTER_EXTENSIONS
+
+
+def _to_bgr8(pixels: np.ndarray, rgb: bool) -> np.ndarray:
+    """Convert raster samples (any band count or bit depth) to a contiguous BGR uint8 array"""
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+
+    if pixels.dtype == np.uint16:
+        pixels = (pixels >> 8).astype(np.uint8)
+    elif pixels.dtype != np.uint8:
+        pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+
+    bands = pixels.shape[2]
+    if bands >= 3:
+        pixels = pixels[:, :, 2::-1] if rgb else pixels[:, :, :3]
+    else:
+        pixels = np.repeat(pixels[:, :, :1], 3, axis=2)
+    return np.ascontiguousarray(pixels)
+
+
+class RasterImage:
+    """
+    A large TIFF read window by window instead of being decoded whole.
+
+    Uncompressed rasters are memory-mapped; tiled or stripped compressed rasters decode only
+    the tiles/strips intersecting a window. Detection reads regions through `read_window`,
+    while `inference_array` is a reduced-resolution overview built band by band (or taken
+    from the file's own pyramid), so peak memory does not depend on the raster size.
+
+    Exposes the same interface as DecodedImage except for `array`, which would load the
+    full raster.
+    """
+
+    def __init__(self, file_path: str, max_side: Optional[int] = None):
+        if tifffile is None:
+            raise ImportError("tifffile is required to read rasters")
+
+        self.file_path = file_path
+        self.max_side = max_side or getattr(settings, 'DETECTION_RASTER_OVERVIEW_SIDE', 4096)
+        self._tiff = tifffile.TiffFile(file_path)
+        self._lock = threading.Lock()
+        self._overview_lock = threading.Lock()
+        self._memmaps = {}
+        self._segment_cache = OrderedDict()
+        self._segment_cache_bytes = 0
+        self._inference_array = None
+        self._scale = 1.0
+        self.timings = {}
+
+        series = self._tiff.series[0]
+        self._levels = [level.keyframe for level in series.levels]
+        page = self._levels[0]
+        if not self._can_window(page):
+            self._tiff.close()
+            raise ValueError(f"Raster layout does not support windowed reads: {file_path}")
+
+        self._height, self._width = page.imagelength, page.imagewidth
+
+    @staticmethod
+    def _can_window(page) -> bool:
+        if page.is_memmappable:
+            return True
+        # Compressed rasters need several chunks, otherwise every window decodes the whole image
+        chunked = page.is_tiled or page.rowsperstrip < page.imagelength
+        return chunked and page.planarconfig == 1 and page.imagedepth == 1
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return (self._height, self._width, 3)
+
+    def load(self):
+        """Windows are read from the file on demand, nothing is read ahead"""
+
+    def _read_page_window(self, level: int, window: Window, cache: bool = True) -> np.ndarray:
+        """Read raw samples of a window from one pyramid level"""
+        page = self._levels[level]
+        x1, y1, x2, y2 = window
+
+        if page.is_memmappable:
+            if level not in self._memmaps:
+                pixels = np.memmap(
+                    self.file_path,
+                    dtype=np.dtype(self._tiff.byteorder + page.dtype.char),
+                    mode='r',
+                    offset=page.dataoffsets[0],
+                    shape=page.shape
+                )
+                if page.samplesperpixel > 1 and page.planarconfig == 2:
+                    pixels = pixels.transpose(1, 2, 0)
+                self._memmaps[level] = pixels
+            return np.array(self._memmaps[level][y1:y2, x1:x2])
+
+        # Decode only the tiles/strips that intersect the window
+        chunk_height, chunk_width = page.chunks[0], page.chunks[1]
+        chunks_across = page.chunked[1]
+        out = np.zeros((y2 - y1, x2 - x1, page.samplesperpixel), dtype=page.dtype)
+
+        indices = [
+            row * chunks_across + col
+            for row in range(y1 // chunk_height, (y2 - 1) // chunk_height + 1)
+            for col in range(x1 // chunk_width, (x2 - 1) // chunk_width + 1)
+        ]
+
+        for segment, seg_y, seg_x in self._segments(level, indices, cache):
+            seg_h = min(segment.shape[0], page.imagelength - seg_y)
+            seg_w = min(segment.shape[1], page.imagewidth - seg_x)
+
+            # Intersection of the segment and the window
+            top, bottom = max(y1, seg_y), min(y2, seg_y + seg_h)
+            left, right = max(x1, seg_x), min(x2, seg_x + seg_w)
+            if top >= bottom or left >= right:
+                continue
+            out[top - y1:bottom - y1, left - x1:right - x1] = segment[top - seg_y:bottom - seg_y, left - seg_x:right - seg_x]
+
+        return out
+
+    def _segments(self, level: int, indices, cache: bool = True):
+        """
+        Decode tiles/strips, reusing recently decoded ones
+
+        Neighbouring windows share strips and border tiles, so decoded segments are kept in
+        a small LRU cache bounded by DETECTION_RASTER_CACHE_MB.
+        """
+        page = self._levels[level]
+        found = []
+        missing = []
+        with self._lock:
+            for index in indices:
+                cached = self._segment_cache.get((level, index))
+                if cached is None:
+                    missing.append(index)
+                else:
+                    self._segment_cache.move_to_end((level, index))
+                    found.append(cached)
+
+            raw_segments = list(self._tiff.filehandle.read_segments(
+                [page.dataoffsets[index] for index in missing],
+                [page.databytecounts[index] for index in missing],
+                indices=missing
+            )) if missing else []
+
+        for data, index in raw_segments:
+            segment, (_, _, seg_y, seg_x, _), _ = page.decode(data, index, jpegtables=page.jpegtables)
+            if segment is None:
+                continue
+            decoded = (segment.reshape(segment.shape[-3:]), seg_y, seg_x)
+            found.append(decoded)
+            if cache:
+                self._cache_segment((level, index), decoded)
+
+        return found
+
+    def _cache_segment(self, key, decoded):
+        budget = getattr(settings, 'DETECTION_RASTER_CACHE_MB', 64) * 1024 * 1024
+        with self._lock:
+            self._segment_cache[key] = decoded
+            self._segment_cache_bytes += decoded[0].nbytes
+            while self._segment_cache_bytes > budget and len(self._segment_cache) > 1:
+                _, evicted = self._segment_cache.popitem(last=False)
+                self._segment_cache_bytes -= evicted[0].nbytes
+
+    def read_window(self, window: Window) -> np.ndarray:
+        """Full-resolution BGR pixels of an (x1, y1, x2, y2) window"""
+        page = self._levels[0]
+        return _to_bgr8(self._read_page_window(0, window), page.photometric == 2)
+
+    def overview(self, max_side: int) -> Tuple[np.ndarray, float]:
+        """
+        Build a reduced-resolution BGR copy of the raster
+
+        Uses the smallest pyramid level that is still larger than max_side, then shrinks it
+        band by band so only OVERVIEW_BAND_ROWS full-width rows are decoded at a time.
+
+        Returns:
+            Tuple of the overview and its scale relative to full resolution
+        """
+        scale = min(1.0, max_side / max(self._height, self._width))
+        level = 0
+        for index, page in enumerate(self._levels):
+            if max(page.imagelength, page.imagewidth) >= max(self._height, self._width) * scale:
+                level = index
+
+        page = self._levels[level]
+        level_height, level_width = page.imagelength, page.imagewidth
+        level_scale = scale * self._width / level_width
+        out_width = max(1, round(level_width * level_scale))
+        out_height = max(1, round(level_height * level_scale))
+        overview = np.empty((out_height, out_width, 3), dtype=np.uint8)
+
+        chunk_height = OVERVIEW_BAND_ROWS if page.is_memmappable else page.chunks[0]
+        band_rows = max(chunk_height, OVERVIEW_BAND_ROWS // chunk_height * chunk_height)
+
+        for band_top in range(0, level_height, band_rows):
+            band_bottom = min(level_height, band_top + band_rows)
+            out_top = round(band_top * level_scale)
+            out_bottom = out_height if band_bottom == level_height else round(band_bottom * level_scale)
+            if out_bottom <= out_top:
+                continue
+
+            # Each band is read once, so its segments are not cached
+            band = self._read_page_window(level, (0, band_top, level_width, band_bottom), cache=False)
+            band = _to_bgr8(band, page.photometric == 2)
+            overview[out_top:out_bottom] = cv2.resize(band, (out_width, out_bottom - out_top), interpolation=cv2.INTER_AREA)
+
+        logger.info(f"Built {out_width}x{out_height} overview of {self._width}x{self._height} raster {self.file_path} (level {level})")
+        return overview, out_width / self._width
+
+    @property
+    def inference_array(self) -> np.ndarray:
+        """Overview passed to the models when the raster is not tiled"""
+        with self._overview_lock:
+            if self._inference_array is None:
+                self._inference_array, self._scale = self.overview(self.max_side)
+            return self._inference_array
+
+    @property
+    def scale(self) -> float:
+        """Ratio of inference_array size to full resolution"""
+        self.inference_array
+        return self._scale
+
+    def to_full_resolution(self, bbox):
+        """Map a box found on inference_array back to full-resolution pixels"""
+        scale = self.scale
+        if scale == 1.0:
+            return list(bbox)
+        return [coord / scale for coord in bbox]
+
+    def annotation_view(self) -> Tuple[np.ndarray, float]:
+        """Image to draw annotations on, and the scale of full-resolution boxes on it"""
+        return self.inference_array, self.scale
+
+    def release(self):
+        """Drop the overview and close the file"""
+        self._inference_array = None
+        self._memmaps.clear()
+        self._segment_cache.clear()
+        self._segment_cache_bytes = 0
+        self._tiff.close()
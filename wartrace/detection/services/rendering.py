@@ -0,0 +1,263 @@
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from .images import open_image
+from .video import is_video, read_frame
+
+logger = logging.getLogger(__name__)
+
+# Modern color palette for object visualization (RGBA for overlay transparency handling)
+COLOR_PALETTE = {
+    # Military object colors - using more modern, distinct colors with reduced transparency
+    'camouflage_soldier': (52, 96, 73, 0.5),     # Camo green
+    'weapon': (145, 30, 30, 0.6),                # Dark red
+    'military_tank': (94, 23, 35, 0.6),          # Burgundy
+    'military_truck': (155, 62, 21, 0.6),        # Rust
+    'military_vehicle': (201, 70, 24, 0.6),      # Orange-red
+    'civilian': (20, 158, 140, 0.5),             # Teal
+    'soldier': (38, 82, 153, 0.5),               # Blue
+    'civilian_vehicle': (76, 175, 80, 0.5),      # Green
+    'military_artillery': (110, 28, 36, 0.6),    # Brown-red
+    'trench': (94, 78, 23, 0.5),                 # Brown
+    'military_aircraft': (48, 63, 159, 0.5),     # Royal blue
+    'military_warship': (26, 35, 126, 0.5),      # Navy blue
+    
+    # Common COCO object colors with reduced transparency
+    'person': (63, 81, 181, 0.5),                # Indigo
+    'bicycle': (33, 150, 243, 0.5),              # Blue
+    'car': (0, 188, 212, 0.5),                   # Cyan
+    'motorcycle': (0, 150, 136, 0.5),            # Teal
+    'airplane': (76, 175, 80, 0.5),              # Green
+    'bus': (139, 195, 74, 0.5),                  # Light green
+    'train': (205, 220, 57, 0.5),                # Lime
+    'truck': (255, 235, 59, 0.5),                # Yellow
+    'boat': (255, 193, 7, 0.5),                  # Amber
+    'traffic light': (255, 152, 0, 0.5),         # Orange
+    'fire hydrant': (255, 87, 34, 0.5),          # Deep orange
+    'stop sign': (244, 67, 54, 0.5),             # Red
+    'bench': (156, 39, 176, 0.5),                # Purple
+    
+    # Default for other classes
+    'default': (158, 158, 158, 0.5)              # Gray
+}
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def get_label_color(label: str) -> Tuple[Tuple[int, int, int], float]:
+    """Return the BGR colour and fill opacity used for a label"""
+    rgba_color = COLOR_PALETTE.get(label.lower(), COLOR_PALETTE['default'])
+    return rgba_color[:3], rgba_color[3]
+
+
+@lru_cache(maxsize=4096)
+def _text_size(text: str, font_scale: float, thickness: int) -> Tuple[Tuple[int, int], int]:
+    """Cached cv2.getTextSize, labels repeat a lot across boxes and images"""
+    return cv2.getTextSize(text, FONT, font_scale, thickness)
+
+
+def _blend_fill(img: np.ndarray, x_min: int, y_min: int, x_max: int, y_max: int, color: Tuple[int, int, int], alpha: float):
+    """
+    Blend the semi-transparent fill of a box into the image, in place
+
+    Only the pixels under the box are blended, the same as cv2.addWeighted of a filled copy
+    of the whole image, so boxes drawn later composite over earlier fills and labels.
+    """
+    h, w = img.shape[:2]
+    x0, x1 = max(0, min(x_min, x_max)), min(w - 1, max(x_min, x_max))
+    y0, y1 = max(0, min(y_min, y_max)), min(h - 1, max(y_min, y_max))
+    if x1 < x0 or y1 < y0:
+        return
+
+    roi = img[y0:y1 + 1, x0:x1 + 1]
+    fill = np.empty_like(roi)
+    fill[:] = color
+    roi[:] = cv2.addWeighted(fill, alpha, roi, 1 - alpha, 0)
+
+
+def draw_modern_annotations(img: np.ndarray, detections: List[Dict[str, Any]], detector_type: str, model_name: str) -> np.ndarray:
+    """
+    Draw modern, minimalistic annotations with segmentation-style labels
+
+    The output canvas (header, image, footer) is allocated once and each box fill is blended
+    over the box's own area only, in detection order. The input image is not modified.
+    """
+    h, w = img.shape[:2]
+
+    # Configure header style based on detector type
+    if detector_type == 'object_detection':
+        header_bg_color = (37, 37, 38)  # Dark gray
+        header_accent = (66, 165, 245)  # Blue
+        header_text = "COCO Object Detection"
+    else:  # military_detection
+        header_bg_color = (37, 37, 38)  # Dark gray
+        header_accent = (239, 83, 80)   # Red
+        header_text = "Military Object Detection"
+
+    # Calculate label font scale based on image size
+    base_font_scale = 0.4 * max(1, min(w, h) / 500)
+    header_height = int(60 * base_font_scale)
+    footer_height = int(40 * base_font_scale)
+    accent_height = int(3 * base_font_scale)
+
+    # Allocate the whole canvas once instead of stacking header, image and footer
+    canvas = np.empty((header_height + h + footer_height, w, 3), dtype=np.uint8)
+    header_bar = canvas[:header_height]
+    body = canvas[:header_height + h]
+    footer_bar = canvas[header_height + h:]
+
+    # Apply slight brightness enhancement to original image (1.1 = 10% brighter)
+    canvas[header_height:header_height + h] = cv2.convertScaleAbs(img, alpha=1.1, beta=5)
+
+    # Add a minimal modern header with an accent line at the bottom
+    header_bar[:] = header_bg_color
+    header_bar[-accent_height:, :] = header_accent
+    cv2.putText(
+        header_bar,
+        header_text,
+        (int(20 * base_font_scale), int(header_height * 0.6)),
+        FONT,
+        base_font_scale * 1.1,
+        (255, 255, 255),
+        max(1, int(1.5 * base_font_scale))
+    )
+
+    # Clip boxes to the image area (below the header)
+    boxes = []
+    for det in detections:
+        x_min, y_min, x_max, y_max = map(int, det['bbox'])
+        color, alpha = get_label_color(det['label'])
+        boxes.append((
+            max(0, x_min),
+            max(0, y_min + header_height),
+            min(w, x_max),
+            min(header_height + h, y_max + header_height),
+            color,
+            alpha
+        ))
+
+    border_thickness = max(2, int(3 * base_font_scale))
+    font_scale = base_font_scale * 0.9  # Slightly larger font
+    thickness = max(1, int(base_font_scale * 1.2))  # Thicker text
+    padding = int(6 * base_font_scale)
+
+    for det, (x_min, y_min, x_max, y_max, color, alpha) in zip(detections, boxes):
+        # Semi-transparent fill, over the fills and labels of the boxes drawn before
+        _blend_fill(body, x_min, y_min, x_max, y_max, color, alpha)
+
+        # Draw a solid border (more visible)
+        cv2.rectangle(body, (x_min, y_min), (x_max, y_max), color, border_thickness)
+
+        # Get text size for the label
+        label_text = f"{det['label']} {det['confidence']:.2f}"
+        (text_width, text_height), _ = _text_size(label_text, font_scale, thickness)
+
+        # Make sure label doesn't go above the image
+        label_y_min = max(header_height, y_min - text_height - padding * 2)
+
+        # Position label at top of bounding box with solid background
+        label_bg = np.array([
+            [x_min, label_y_min],
+            [x_min + text_width + padding * 2, label_y_min],
+            [x_min + text_width + padding * 2, label_y_min + text_height + padding * 2],
+            [x_min, label_y_min + text_height + padding * 2]
+        ], np.int32)
+
+        # Solid label background with a white border for better visibility
+        cv2.fillPoly(body, [label_bg], color)
+        cv2.polylines(body, [label_bg], True, (255, 255, 255), 1)
+
+        # Draw label text in white
+        cv2.putText(
+            body,
+            label_text,
+            (x_min + padding, label_y_min + text_height + padding),
+            FONT,
+            font_scale,
+            (255, 255, 255),
+            thickness
+        )
+
+    # Add a footer with model info and an accent line at the top
+    footer_bar[:] = header_bg_color
+    footer_bar[:accent_height, :] = header_accent
+
+    footer_scale = base_font_scale * 0.7
+    cv2.putText(
+        footer_bar,
+        f"Model: {model_name}",
+        (int(20 * base_font_scale), int(footer_height * 0.6)),
+        FONT,
+        footer_scale,
+        (255, 255, 255),
+        1
+    )
+
+    # Add detection count to right side
+    detection_count = f"Detections: {len(detections)}"
+    (text_width, _), _ = _text_size(detection_count, footer_scale, 1)
+    cv2.putText(
+        footer_bar,
+        detection_count,
+        (w - text_width - int(20 * base_font_scale), int(footer_height * 0.6)),
+        FONT,
+        footer_scale,
+        (255, 255, 255),
+        1
+    )
+
+    return canvas
+
+
+def label_color_hex(label: str) -> str:
+    """Return the colour of a label as a CSS hex string, matching the rendered (BGR) images"""
+    (blue, green, red), _ = get_label_color(label)
+    return f"#{red:02x}{green:02x}{blue:02x}"
+
+
+def render_detection_jpeg(file_path: str, detections: List[Dict[str, Any]], detector_type: str, model_name: str) -> bytes:
+    """
+    Render the annotated image of a detection on demand and encode it as JPEG
+
+    Raises:
+        ValueError: if the original image cannot be read or encoded
+    """
+    image = open_image(file_path)
+    try:
+        # Large rasters are drawn on their overview, with boxes scaled to it
+        img, scale = image.annotation_view()
+        if scale != 1.0:
+            detections = [dict(det, bbox=[coord * scale for coord in det['bbox']]) for det in detections]
+        annotated_img = draw_modern_annotations(img, detections, detector_type, model_name)
+    finally:
+        image.release()
+
+    success, buffer = cv2.imencode('.jpg', annotated_img)
+    if not success:
+        raise ValueError(f"Could not encode annotated image for {file_path}")
+    return buffer.tobytes()
+
+
+def render_preview_jpeg(file_path: str, max_side: int, frame_index: int = 0) -> bytes:
+    """
+    Encode a reduced-resolution JPEG of an image or of one frame of a video (the first one
+    by default), read through overviews for large rasters
+
+    Raises:
+        ValueError: if the image or frame cannot be read or encoded
+    """
+    if is_video(file_path):
+        image = read_frame(file_path, frame_index, max_side=max_side)
+    else:
+        image = open_image(file_path, max_side=max_side)
+    try:
+        success, buffer = cv2.imencode('.jpg', image.inference_array)
+    finally:
+        image.release()
+    if not success:
+        raise ValueError(f"Could not encode preview for {file_path}")
+    return buffer.tobytes()
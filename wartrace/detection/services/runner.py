@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import logging
+import threading
+import traceback
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .jobs import claim_job, default_worker_id, process_job, release_job, touch_jobs
+from .preload import memory_usage
+
+logger = logging.getLogger(__name__)
+
+
+class DetectionWorker:
+    """
+    Standalone process that claims queued jobs from the database and runs them in-process,
+    so inference nodes scale apart from the web tier (manage.py run_detection_worker)
+
+    `concurrency` threads each claim and run one job at a time. The calling thread sends the
+    heartbeats: it refreshes heartbeat_at of the running jobs, so long jobs are not recovered
+    as stale, and reports throughput. drain() stops claiming new jobs and lets the running
+    ones finish; jobs still running when the drain timeout expires are put back in the queue
+    instead of being lost with the process.
+    """
+
+    def __init__(self, worker_id: Optional[str] = None, concurrency: int = 1, poll_interval: Optional[float] = None,
+                 heartbeat_interval: Optional[float] = None, drain_timeout: Optional[float] = None,
+                 max_jobs: Optional[int] = None, exit_when_idle: bool = False, status_file: Optional[str] = None,
+                 on_heartbeat: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.worker_id = worker_id or default_worker_id()
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval if poll_interval is not None else getattr(settings, 'DETECTION_WORKER_POLL_SECONDS', 2.0)
+        self.heartbeat_interval = (heartbeat_interval if heartbeat_interval is not None
+                                   else getattr(settings, 'DETECTION_WORKER_HEARTBEAT_SECONDS', 30.0))
+        # 0 waits for the running jobs however long they take
+        self.drain_timeout = drain_timeout if drain_timeout is not None else getattr(settings, 'DETECTION_WORKER_DRAIN_SECONDS', 25.0)
+        self.max_jobs = max_jobs
+        self.exit_when_idle = exit_when_idle
+        self.status_file = status_file
+        self.on_heartbeat = on_heartbeat
+
+        self._lock = threading.Lock()
+        self._draining = threading.Event()
+        # Set to wake the heartbeat loop early (drain requested, a job thread exited)
+        self._wake = threading.Event()
+        self._drain_deadline = None
+        self._in_flight = {}
+        self._threads = []
+        self._claimed = 0
+        self._idle_threads = 0
+        self._started_at = None
+        self._stopped = False
+        self._stats = {'jobs_completed': 0, 'jobs_failed': 0, 'jobs_released': 0, 'files': 0, 'detections': 0, 'busy_s': 0.0}
+        self._last_report = {'time': None, 'jobs': 0, 'files': 0}
+
+    @property
+    def state(self) -> str:
+        if self._started_at is None:
+            return 'starting'
+        if self._stopped:
+            return 'stopped'
+        return 'draining' if self._draining.is_set() else 'running'
+
+    def drain(self):
+        """Stop claiming jobs; the running ones get drain_timeout seconds to finish"""
+        with self._lock:
+            if self._draining.is_set():
+                return
+            if self.drain_timeout > 0:
+                self._drain_deadline = time.monotonic() + self.drain_timeout
+            self._draining.set()
+            logger.info(f"Worker {self.worker_id} draining, {len(self._in_flight)} jobs running")
+        self._wake.set()
+
+    def abort(self):
+        """Stop now, putting the running jobs back in the queue"""
+        with self._lock:
+            self._drain_deadline = time.monotonic()
+            self._draining.set()
+        self._wake.set()
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Claim and run jobs until drained (or max_jobs / exit_when_idle is reached)
+
+        Call from the main thread, which installs the signal handlers that call drain().
+
+        Returns:
+            Final throughput statistics
+        """
+        self._started_at = time.time()
+        self._last_report['time'] = time.monotonic()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"detection-worker-{index}", daemon=True)
+            for index in range(self.concurrency)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Worker {self.worker_id} started with {self.concurrency} job threads")
+
+        next_heartbeat = time.monotonic()
+        while any(thread.is_alive() for thread in self._threads):
+            now = time.monotonic()
+            if now >= next_heartbeat:
+                self.heartbeat()
+                next_heartbeat = now + self.heartbeat_interval
+
+            with self._lock:
+                deadline = self._drain_deadline
+            if self._draining.is_set() and deadline is not None and now >= deadline:
+                self._release_in_flight()
+                break
+
+            wait = next_heartbeat - now
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - now))
+            self._wake.wait(timeout=max(0.05, wait))
+            self._wake.clear()
+
+        self._draining.set()
+        self._stopped = True
+        stats = self.heartbeat()
+        logger.info(f"Worker {self.worker_id} stopped: {stats}")
+        return stats
+
+    def _work(self):
+        """Job thread: claim a job, run it, repeat until draining"""
+        try:
+            while not self._draining.is_set():
+                # Reserve a claim first, so threads together never exceed max_jobs
+                with self._lock:
+                    if self.max_jobs is not None and self._claimed >= self.max_jobs:
+                        break
+                    self._claimed += 1
+
+                try:
+                    job = claim_job(self.worker_id)
+                except Exception as e:
+                    logger.error(f"Worker {self.worker_id} could not claim a job: {str(e)}")
+                    logger.error(traceback.format_exc())
+                    close_old_connections()
+                    job = None
+
+                if job is None:
+                    with self._lock:
+                        self._claimed -= 1
+                    if self.exit_when_idle and self._all_idle():
+                        break
+                    self._draining.wait(self.poll_interval)
+                    continue
+
+                self._run_job(job)
+        finally:
+            connection.close()
+            # Wake the heartbeat loop, it stops once every job thread has exited
+            self._wake.set()
+
+    def _all_idle(self) -> bool:
+        """Whether the queue was found empty by each job thread since the last claim, with no job running"""
+        with self._lock:
+            self._idle_threads += 1
+            return not self._in_flight and self._idle_threads >= self.concurrency
+
+    def _run_job(self, job):
+        with self._lock:
+            self._idle_threads = 0
+            self._in_flight[job.id] = time.monotonic()
+
+        start_time = time.monotonic()
+        result, recorded = None, True
+        try:
+            result, recorded = process_job(job)
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._in_flight.pop(job.id, None)
+                self._stats['busy_s'] += time.monotonic() - start_time
+                # A job released or recovered as stale while it ran had its outcome dropped
+                if recorded and result is None:
+                    self._stats['jobs_failed'] += 1
+                elif recorded:
+                    self._stats['jobs_completed'] += 1
+                    self._stats['files'] += job.files_total
+                    self._stats['detections'] += result.get('detections', 0)
+
+    def _release_in_flight(self):
+        """Give the jobs still running back to the queue, their threads end with the process"""
+        with self._lock:
+            job_ids = list(self._in_flight)
+        for job_id in job_ids:
+            released = release_job(job_id, self.worker_id)
+            with self._lock:
+                self._in_flight.pop(job_id, None)
+                self._stats['jobs_released'] += int(released)
+        logger.warning(f"Worker {self.worker_id} stopping before its jobs finished, released jobs {job_ids}")
+
+    def heartbeat(self) -> Dict[str, Any]:
+        """Refresh the running jobs' heartbeats and report throughput since the last heartbeat and overall"""
+        now = time.monotonic()
+        with self._lock:
+            in_flight = list(self._in_flight)
+            stats = dict(self._stats)
+            # Count the running jobs' time so far in the busy time
+            stats['busy_s'] += sum(now - started for started in self._in_flight.values())
+
+        if in_flight:
+            try:
+                touch_jobs(in_flight)
+            except Exception as e:
+                logger.error(f"Worker {self.worker_id} could not refresh job heartbeats: {str(e)}")
+            finally:
+                close_old_connections()
+
+        jobs_done = stats['jobs_completed'] + stats['jobs_failed']
+        window = max(now - self._last_report['time'], 1e-6)
+        uptime = max(time.time() - self._started_at, 1e-6)
+        report = {
+            'worker_id': self.worker_id,
+            'pid': os.getpid(),
+            'state': self.state,
+            'heartbeat_at': time.time(),
+            'uptime_s': round(uptime, 1),
+            'in_flight': in_flight,
+            **stats,
+            'busy_s': round(stats['busy_s'], 1),
+            'utilization': round(min(1.0, stats['busy_s'] / (uptime * self.concurrency)), 3),
+            'jobs_per_min': round((jobs_done - self._last_report['jobs']) * 60 / window, 2),
+            'files_per_s': round((stats['files'] - self._last_report['files']) / window, 3),
+            'total_files_per_s': round(stats['files'] / uptime, 3),
+            'memory': memory_usage()
+        }
+        self._last_report.update(time=now, jobs=jobs_done, files=stats['files'])
+
+        if self.status_file:
+            self._write_status(report)
+        if self.on_heartbeat:
+            self.on_heartbeat(report)
+        return report
+
+    def _write_status(self, report: Dict[str, Any]):
+        """Replace the status file atomically, for container health checks reading it"""
+        tmp_path = f"{self.status_file}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(report, f, indent=2)
+            os.replace(tmp_path, self.status_file)
+        except OSError as e:
+            logger.error(f"Could not write worker status to {self.status_file}: {str(e)}")
@@ -0,0 +1,159 @@
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from django.conf import settings
+
+# Model type of the stand-in models, usable in MODEL_CONFIG or substituted by resolve_model_config
+STUB_MODEL_TYPE = 'stub'
+
+# Input side of stub classifiers, matching the Keras classifiers they stand in for
+STUB_CLASSIFIER_INPUT = (224, 224)
+
+# Class names of the COCO models, for stubs of YOLO models without a class list
+COCO_LABELS = (
+    'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat', 'traffic light',
+    'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow',
+    'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee',
+    'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard',
+    'tennis racket', 'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple',
+    'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch',
+    'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard', 'cell phone',
+    'microwave', 'oven', 'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear',
+    'hair drier', 'toothbrush'
+)
+
+
+class StubBox:
+    """One box of a StubResult, with the attributes ModelService reads from ultralytics boxes"""
+
+    __slots__ = ('cls', 'conf', 'xyxy')
+
+    def __init__(self, label_idx: int, confidence: float, xyxy: Sequence[float]):
+        self.cls = label_idx
+        self.conf = confidence
+        self.xyxy = np.array([xyxy], dtype=np.float32)
+
+
+class StubResult:
+    """Prediction of a StubDetector for one image, shaped like an ultralytics Results object"""
+
+    def __init__(self, boxes: List[StubBox], names: Dict[int, str], orig_shape):
+        self.boxes = boxes
+        self.names = names
+        self.orig_shape = orig_shape
+
+
+def _image_seed(img: np.ndarray, seed: int) -> int:
+    """Seed derived from the image contents, so the same image always gets the same boxes"""
+    return zlib.crc32(np.ascontiguousarray(img[::16, ::16]).tobytes(), seed)
+
+
+class StubDetector:
+    """
+    Stand-in for a YOLO model that needs no weights
+
+    Returns `detections` synthetic boxes per image, derived from the image contents so
+    results are reproducible, and sleeps `latency_ms` per image to stand in for inference.
+    Called with the same arguments as an ultralytics model.
+    """
+
+    def __init__(self, labels: Sequence[str], detections: int = 10, latency_ms: float = 0.0, seed: int = 0):
+        self.names = dict(enumerate(labels))
+        self.detections = detections
+        self.latency_ms = latency_ms
+        self.seed = seed
+
+    def __call__(self, source: Union[np.ndarray, List[np.ndarray]], conf: float = 0.25, iou: float = 0.45,
+                 batch: Optional[int] = None, verbose: bool = False, **kwargs) -> List[StubResult]:
+        images = source if isinstance(source, list) else [source]
+        if self.latency_ms:
+            time.sleep(self.latency_ms * len(images) / 1000)
+        return [self._predict(img, conf) for img in images]
+
+    def _predict(self, img: np.ndarray, conf: float) -> StubResult:
+        height, width = img.shape[:2]
+        rng = np.random.default_rng(_image_seed(img, self.seed))
+
+        sizes = rng.uniform(0.02, 0.25, (self.detections, 2)) * (width, height)
+        corners = rng.uniform(0, 1, (self.detections, 2)) * ((width, height) - sizes)
+        confidences = rng.uniform(0.3, 1.0, self.detections)
+        label_idxs = rng.integers(0, max(1, len(self.names)), self.detections)
+
+        boxes = [
+            StubBox(int(label_idx), float(confidence), (x1, y1, x1 + w, y1 + h))
+            for (x1, y1), (w, h), confidence, label_idx in zip(corners, sizes, confidences, label_idxs)
+            if confidence >= conf
+        ]
+        return StubResult(boxes, self.names, (height, width))
+
+
+class StubClassifier:
+    """
+    Stand-in for a Keras image classifier that needs no weights
+
+    Exposes the part of the Keras interface ModelService uses (input_shape and predict).
+    Each row gets a probability vector derived from its contents, so the same image is
+    always classified the same way, and predict sleeps `latency_ms` per image.
+    """
+
+    def __init__(self, labels: Sequence[str], latency_ms: float = 0.0, seed: int = 0,
+                 input_size: Tuple[int, int] = STUB_CLASSIFIER_INPUT):
+        self.labels = list(labels)
+        self.latency_ms = latency_ms
+        self.seed = seed
+        self.input_shape = (None, input_size[0], input_size[1], 3)
+
+    def predict(self, batch: np.ndarray, batch_size: Optional[int] = None, verbose: int = 0) -> np.ndarray:
+        if self.latency_ms:
+            time.sleep(self.latency_ms * len(batch) / 1000)
+        # Inputs are normalized floats; hash a byte view so equal inputs give equal outputs
+        rows = [
+            np.random.default_rng(_image_seed(np.ascontiguousarray(row).view(np.uint8), self.seed))
+            .dirichlet(np.full(max(1, len(self.labels)), 0.5))
+            for row in batch
+        ]
+        return np.array(rows, dtype=np.float32).reshape(len(batch), max(1, len(self.labels)))
+
+
+def stub_task(model_config: Dict[str, Any]) -> str:
+    """Whether a stub model stands in for a detector ('detect') or a classifier ('classify')"""
+    return model_config.get('task') or ('classify' if model_config.get('labels') else 'detect')
+
+
+def stub_model_config(model_config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Config of a stub standing in for a configured model
+
+    Labels, classes and thresholds are kept so results look like the real model's. Latency,
+    detections per image and seed come from the model's 'stub' entry or the DETECTION_STUB_* settings.
+    """
+    options = model_config.get('stub', {})
+    return dict(
+        model_config,
+        type=STUB_MODEL_TYPE,
+        task=stub_task(model_config),
+        latency_ms=options.get('latency_ms', getattr(settings, 'DETECTION_STUB_LATENCY_MS', 0.0)),
+        detections=options.get('detections', getattr(settings, 'DETECTION_STUB_DETECTIONS', 10)),
+        seed=options.get('seed', getattr(settings, 'DETECTION_STUB_SEED', 0))
+    )
+
+
+def stub_version(model_config: Dict[str, Any], model_name: str) -> str:
+    """Identify the output of a stub, which depends on its seed and box count but not on any weights"""
+    return f"stub:{model_name}:{model_config.get('seed', 0)}:{model_config.get('detections', 10)}"
+
+
+def load_stub_model(model_config: Dict[str, Any]) -> Union[StubDetector, StubClassifier]:
+    """Build the stub model described by a stub config (hand-written stub entries fall back to the settings)"""
+    latency_ms = model_config.get('latency_ms', getattr(settings, 'DETECTION_STUB_LATENCY_MS', 0.0))
+    seed = model_config.get('seed', getattr(settings, 'DETECTION_STUB_SEED', 0))
+
+    if stub_task(model_config) == 'classify':
+        return StubClassifier(model_config['labels'], latency_ms, seed)
+
+    labels = model_config.get('classes') or COCO_LABELS
+    detections = model_config.get('detections', getattr(settings, 'DETECTION_STUB_DETECTIONS', 10))
+    return StubDetector(labels, detections, latency_ms, seed)
+
@@ -0,0 +1,160 @@
+import os
+import sys
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Environment variables read by the OpenMP/BLAS pools of torch, TensorFlow and numpy when they load
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+def available_cores() -> int:
+    """CPU cores this process may run on (respects taskset/cgroup CPU affinity)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def thread_budget(workers: Optional[int] = None) -> Dict[str, int]:
+    """
+    Threads each inference worker process may use
+
+    DETECTION_INTRA_OP_THREADS fixes the threads per operator; 0 divides the available
+    cores between the DETECTION_WORKER_PROCESSES workers so they don't oversubscribe them.
+
+    Args:
+        workers: Number of processes sharing the cores (defaults to DETECTION_WORKER_PROCESSES)
+
+    Returns:
+        Dictionary with the 'intra_op' and 'inter_op' thread counts
+    """
+    if workers is None:
+        workers = getattr(settings, 'DETECTION_WORKER_PROCESSES', 2)
+
+    intra_op = getattr(settings, 'DETECTION_INTRA_OP_THREADS', 0)
+    if intra_op <= 0:
+        intra_op = max(1, available_cores() // max(1, workers))
+    inter_op = max(1, getattr(settings, 'DETECTION_INTER_OP_THREADS', 1))
+
+    return {'intra_op': intra_op, 'inter_op': inter_op}
+
+
+def parallel_detectors() -> int:
+    """
+    Object detectors a batch can run side by side, sharing torch's intra-op threads
+
+    DETECTION_DETECTOR_CONCURRENCY, at most the number of configured object detectors;
+    classifiers run on TensorFlow's own pools.
+    """
+    from .backends import model_task
+    from .config import MODEL_CONFIG, default_model_name
+
+    detectors = sum(
+        1 for detector_type, models in MODEL_CONFIG.items()
+        if model_task(models[default_model_name(detector_type)]) == 'detect'
+    )
+    return max(1, min(detectors, getattr(settings, 'DETECTION_DETECTOR_CONCURRENCY', 4)))
+
+
+def apply_thread_budget(budget: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Size the thread pools of every inference backend in this process
+
+    Call it before the first model is loaded: torch inter-op threads and the TensorFlow
+    pools can only be set before they start, and the OpenMP variables are only read when
+    the libraries load. Pools that already started are reported as 'fixed'.
+
+    torch's intra-op setting is process-wide, so it is split here once between the detectors
+    a batch runs side by side (see parallel_detectors) rather than resized around each batch,
+    which would let concurrent jobs overwrite each other's split.
+
+    Returns:
+        The thread counts applied per backend
+    """
+    intra_op, inter_op = budget['intra_op'], budget['inter_op']
+    applied = {'budget': dict(budget)}
+
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(intra_op)
+
+    import cv2
+    cv2.setNumThreads(intra_op)
+    applied['opencv'] = intra_op
+
+    # torch is imported with ultralytics; import it now so the budget is in place before the first model
+    try:
+        import torch
+    except ImportError:
+        torch = None
+    if torch is not None:
+        torch_threads = max(1, intra_op // parallel_detectors())
+        torch.set_num_threads(torch_threads)
+        try:
+            torch.set_num_interop_threads(inter_op)
+            applied['torch'] = {'intra_op': torch_threads, 'inter_op': inter_op}
+        except RuntimeError:
+            applied['torch'] = {'intra_op': torch_threads, 'inter_op': f"fixed ({torch.get_num_interop_threads()})"}
+
+    # Only configure TensorFlow if something already imported it, it takes seconds to load
+    tf = sys.modules.get('tensorflow')
+    if tf is not None:
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+            applied['tensorflow'] = {'intra_op': intra_op, 'inter_op': inter_op}
+        except RuntimeError:
+            applied['tensorflow'] = 'fixed'
+
+    logger.info(f"Thread budget for process {os.getpid()}: {applied}")
+    return applied
+
+
+def configure_tensorflow(budget: Dict[str, int]):
+    """Apply the budget to TensorFlow right after it is imported, before it creates its pools"""
+    import tensorflow as tf
+
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(budget['intra_op'])
+        tf.config.threading.set_inter_op_parallelism_threads(budget['inter_op'])
+    except RuntimeError:
+        # Already initialized, the pools keep the size they started with
+        pass
+
+
+def benchmark_worker(settings_module: str, detector_types: List[str], budget: Dict[str, int], image_paths: List[str],
+                     batch_size: int, rounds: int, barrier, results):
+    """
+    Thread budget benchmark process: load the models with the given budget, wait for the
+    other worker processes, then time `rounds` passes over the images
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+    import django
+    django.setup()
+
+    from .images import DecodedImage
+    from .main import model_service
+
+    model_service.configure_threads(budget=budget)
+    model_service.preload(detector_types)
+    batches = [image_paths[start:start + batch_size] for start in range(0, len(image_paths), batch_size)]
+
+    # A worker that fails to start breaks the barrier instead of blocking the others forever
+    barrier.wait(timeout=600)
+    start_time = time.perf_counter()
+    cpu_start = time.process_time()
+    for _ in range(rounds):
+        for batch in batches:
+            model_service.process_decoded_images([DecodedImage(path) for path in batch], detector_types)
+
+    results.put({
+        'pid': os.getpid(),
+        'images': len(image_paths) * rounds,
+        'elapsed': time.perf_counter() - start_time,
+        'cpu_time': time.process_time() - cpu_start
+    })
@@ -0,0 +1,249 @@
+import time
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.db import DatabaseError
+
+from ..models import DetectionConfig
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the 'tiling' entry of a MODEL_CONFIG model, overridable per detector
+# through DetectionConfig.config['tiling']
+DEFAULT_TILING = {
+    'enabled': False,
+    'min_side': 4096,         # Tile images whose longest side exceeds this many pixels
+    'tile_size': 640,         # Tile side in pixels, ideally the model input size
+    'overlap': 0.2,           # Fraction of the tile shared with its neighbours
+    'batch_size': 16,         # Tiles per forward pass
+    'workers': 2,             # Threads slicing / reading tiles ahead of inference
+    'merge_metric': 'ios',    # 'iou', or 'ios' (intersection over smaller) for boxes cut by tile borders
+    'merge_threshold': 0.6,
+    'full_image_pass': True   # Also run the downscaled image to keep objects larger than a tile
+}
+
+Window = Tuple[int, int, int, int]
+
+# DetectionConfig tiling overrides by detector type, re-read after DB_CONFIG_TTL seconds
+# so admin edits reach running workers without a query per batch
+DB_CONFIG_TTL = 60.0
+_db_tiling = {}
+_db_tiling_lock = threading.Lock()
+
+
+def _db_tiling_override(detector_type: str) -> Optional[Dict[str, Any]]:
+    """DetectionConfig.config['tiling'] of a detector, cached for DB_CONFIG_TTL seconds"""
+    now = time.monotonic()
+    with _db_tiling_lock:
+        cached = _db_tiling.get(detector_type)
+        if cached is not None and now - cached[0] < DB_CONFIG_TTL:
+            return cached[1]
+
+    try:
+        db_config = (
+            DetectionConfig.objects
+            .filter(detector_type=detector_type)
+            .values_list('config', flat=True)
+            .first()
+        )
+    except DatabaseError:
+        # Not cached, the next call tries again
+        return None
+
+    override = db_config['tiling'] if isinstance(db_config, dict) and isinstance(db_config.get('tiling'), dict) else None
+    with _db_tiling_lock:
+        _db_tiling[detector_type] = (now, override)
+    return override
+
+
+def clear_tile_config_cache():
+    """Forget the cached DetectionConfig overrides, so the next tile_config reads them again"""
+    with _db_tiling_lock:
+        _db_tiling.clear()
+
+
+def tile_config(detector_type: str, model_config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Resolve the tiling options of a detector
+
+    MODEL_CONFIG values override the defaults, and DetectionConfig.config['tiling']
+    (editable in the admin, picked up within DB_CONFIG_TTL seconds) overrides both.
+    """
+    options = dict(DEFAULT_TILING)
+    options.update(model_config.get('tiling', {}))
+
+    override = _db_tiling_override(detector_type)
+    if override:
+        options.update(override)
+    return options
+
+
+def should_tile(width: int, height: int, options: Dict[str, Any]) -> bool:
+    """Whether an image of this size is processed tile by tile"""
+    return bool(options.get('enabled')) and max(width, height) > options['min_side']
+
+
+def _axis_starts(length: int, tile: int, stride: int) -> List[int]:
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    # Align the last tile with the image edge instead of padding
+    starts.append(length - tile)
+    return starts
+
+
+def tile_windows(width: int, height: int, tile_size: int, overlap: float) -> List[Window]:
+    """
+    Split an image into overlapping tiles
+
+    Returns:
+        List of (x1, y1, x2, y2) windows covering the whole image
+    """
+    stride = max(1, int(tile_size * (1 - overlap)))
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in _axis_starts(height, tile_size, stride)
+        for x in _axis_starts(width, tile_size, stride)
+    ]
+
+
+def iter_tile_batches(read_window: Callable[[Window], np.ndarray], windows: List[Window],
+                      batch_size: int, workers: int = 1) -> Iterator[Tuple[List[Window], List[np.ndarray]]]:
+    """
+    Yield batches of tiles, reading the next batches in background threads
+
+    Only `workers` batches are read ahead, so memory stays bounded by the batch size
+    regardless of the image size.
+    """
+    batches = [windows[start:start + batch_size] for start in range(0, len(windows), batch_size)]
+
+    def read_batch(batch):
+        return batch, [read_window(window) for window in batch]
+
+    if workers <= 1:
+        for batch in batches:
+            yield read_batch(batch)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = [executor.submit(read_batch, batch) for batch in batches[:workers]]
+        next_batch = len(pending)
+        while pending:
+            batch_windows, tiles = pending.pop(0).result()
+            if next_batch < len(batches):
+                pending.append(executor.submit(read_batch, batches[next_batch]))
+                next_batch += 1
+            yield batch_windows, tiles
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, labels: Optional[np.ndarray] = None,
+        threshold: float = 0.5, metric: str = 'iou') -> np.ndarray:
+    """
+    Greedy non-maximum suppression with vectorized overlap computation
+
+    Args:
+        boxes: (N, 4) array of x1, y1, x2, y2
+        scores: (N,) confidences
+        labels: Optional (N,) class ids; boxes of different classes never suppress each other
+        threshold: Overlap above which the lower-scored box is dropped
+        metric: 'iou' (intersection over union) or 'ios' (intersection over the smaller box)
+
+    Returns:
+        Indices of the kept boxes, highest score first
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=int)
+
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if labels is not None:
+        # Shift each class to its own region so one pass handles all classes
+        offsets = np.asarray(labels, dtype=np.float64) * (boxes.max() + 1)
+        boxes = boxes + offsets[:, None]
+
+    x1, y1, x2, y2 = boxes.T
+    areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    order = np.argsort(scores)[::-1]
+    keep = []
+
+    while order.size:
+        current = order[0]
+        keep.append(current)
+        rest = order[1:]
+
+        inter_w = np.clip(np.minimum(x2[current], x2[rest]) - np.maximum(x1[current], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[current], y2[rest]) - np.maximum(y1[current], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+
+        if metric == 'ios':
+            denominator = np.minimum(areas[current], areas[rest])
+        else:
+            denominator = areas[current] + areas[rest] - inter
+        overlap = inter / np.maximum(denominator, 1e-9)
+
+        order = rest[overlap <= threshold]
+
+    return np.array(keep, dtype=int)
+
+
+def merge_detections(detections: List[Dict[str, Any]], threshold: float, metric: str = 'ios') -> List[Dict[str, Any]]:
+    """Drop duplicate detections of the same object found on overlapping tiles"""
+    if len(detections) < 2:
+        return detections
+
+    label_ids = {}
+    labels = np.array([label_ids.setdefault(det['label'], len(label_ids)) for det in detections])
+    boxes = np.array([det['bbox'] for det in detections], dtype=np.float64)
+    scores = np.array([det['confidence'] for det in detections], dtype=np.float64)
+
+    keep = nms(boxes, scores, labels, threshold=threshold, metric=metric)
+    return [detections[index] for index in keep]
+
+
+def detect_tiled(read_window: Callable[[Window], np.ndarray], width: int, height: int,
+                 infer_batch: Callable[[List[np.ndarray]], List[List[Dict[str, Any]]]],
+                 options: Dict[str, Any], detections: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Run a detector over an image tile by tile and merge the detections
+
+    Args:
+        read_window: Returns the BGR pixels of an (x1, y1, x2, y2) window
+        width: Image width in pixels
+        height: Image height in pixels
+        infer_batch: Runs the model on a list of tiles and returns detections per tile,
+            with boxes relative to the tile
+        options: Tiling options from tile_config
+        detections: Full-resolution detections found otherwise (e.g. on the whole image),
+            merged with the tile detections
+
+    Returns:
+        Dictionary with the merged detections (full-resolution boxes) and the tile count
+    """
+    windows = tile_windows(width, height, options['tile_size'], options['overlap'])
+    logger.info(f"Tiling {width}x{height} image into {len(windows)} tiles of {options['tile_size']}px")
+
+    detections = list(detections or [])
+    for batch_windows, tiles in iter_tile_batches(read_window, windows, options['batch_size'], options['workers']):
+        try:
+            batch_detections = infer_batch(tiles)
+        except Exception as e:
+            logger.error(f"Error running tile batch: {str(e)}")
+            logger.error(traceback.format_exc())
+            raise
+
+        for (x_offset, y_offset, _, _), tile_detections in zip(batch_windows, batch_detections):
+            for det in tile_detections:
+                x1, y1, x2, y2 = det['bbox']
+                det['bbox'] = [x1 + x_offset, y1 + y_offset, x2 + x_offset, y2 + y_offset]
+                detections.append(det)
+
+    merged = merge_detections(detections, options['merge_threshold'], options['merge_metric'])
+    logger.info(f"Merged {len(detections)} tile detections into {len(merged)}")
+
+    return {
+        'detections': merged,
+        'tiles': len(windows)
+    }
@@ -0,0 +1,171 @@
+import os
+import time
+import logging
+from typing import Any, Dict, Iterator, Optional
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .images import DecodedImage
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v', '.mpg', '.mpeg')
+
+# Frame rate assumed when the container does not report one
+FALLBACK_FPS = 25.0
+
+# Side of the grayscale thumbnails compared to detect scene changes
+SCENE_THUMBNAIL_SIZE = (64, 36)
+
+
+def is_video(file_path: str) -> bool:
+    """Whether a file is processed as a video"""
+    return os.path.splitext(file_path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def video_sampling() -> Dict[str, Any]:
+    """
+    Keyframe sampling options
+
+    'fps' keeps frames at a fixed rate. 'scene' looks at frames at that rate but only keeps
+    those that differ from the last kept frame by more than the threshold (mean absolute
+    difference of small grayscale thumbnails, 0-1), plus at least one frame every max_gap seconds.
+    """
+    return {
+        'mode': getattr(settings, 'DETECTION_VIDEO_SAMPLING', 'scene'),
+        'fps': getattr(settings, 'DETECTION_VIDEO_FPS', 2.0),
+        'scene_threshold': getattr(settings, 'DETECTION_VIDEO_SCENE_THRESHOLD', 0.08),
+        'max_gap': getattr(settings, 'DETECTION_VIDEO_MAX_GAP', 5.0)
+    }
+
+
+class VideoFrame(DecodedImage):
+    """
+    A decoded video frame, behaving like a decoded image file for the detectors
+
+    file_path is a per-frame name next to the video, so rendered results of different
+    frames don't overwrite each other.
+    """
+
+    def __init__(self, video_path: str, array: np.ndarray, index: int, timestamp: float,
+                 max_side: Optional[int] = None):
+        stem, _ = os.path.splitext(video_path)
+        super().__init__(f"{stem}_frame{index:06d}.jpg", max_side)
+        self.video_path = video_path
+        self.index = index
+        self.timestamp = timestamp
+        self._array = array
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._array is None:
+            raise ValueError(f"Frame {self.index} of {self.video_path} was released")
+        return self._array
+
+
+def video_info(file_path: str) -> Dict[str, Any]:
+    """Frame rate, frame count, duration and frame size of a video"""
+    capture = cv2.VideoCapture(file_path)
+    try:
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video file: {file_path}")
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        fps = fps if fps and fps > 0 else FALLBACK_FPS
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        return {
+            'fps': fps,
+            'frame_count': frame_count,
+            'duration': frame_count / fps if frame_count > 0 else None,
+            'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        }
+    finally:
+        capture.release()
+
+
+def read_frame(file_path: str, index: int = 0, max_side: Optional[int] = None) -> VideoFrame:
+    """
+    Decode a single frame of a video by its index
+
+    Raises:
+        ValueError: if the video cannot be opened or has no such frame
+    """
+    capture = cv2.VideoCapture(file_path)
+    try:
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video file: {file_path}")
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        fps = fps if fps and fps > 0 else FALLBACK_FPS
+        if index:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ok, frame = capture.read()
+        if not ok:
+            raise ValueError(f"Could not read frame {index} of {file_path}")
+        return VideoFrame(file_path, frame, index, index / fps, max_side)
+    finally:
+        capture.release()
+
+
+def _scene_thumbnail(frame: np.ndarray) -> np.ndarray:
+    gray = cv2.cvtColor(cv2.resize(frame, SCENE_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    return gray.astype(np.float32) / 255.0
+
+
+def iter_keyframes(file_path: str, sampling: Optional[Dict[str, Any]] = None,
+                   max_side: Optional[int] = None) -> Iterator[VideoFrame]:
+    """
+    Stream the sampled frames of a video
+
+    Frames are read one at a time with cv2.VideoCapture; skipped frames are only grabbed,
+    not converted, and nothing but the last kept thumbnail is held between frames, so
+    memory does not grow with the length of the video.
+
+    Raises:
+        ValueError: if the video cannot be opened
+    """
+    sampling = sampling or video_sampling()
+    capture = cv2.VideoCapture(file_path)
+    if not capture.isOpened():
+        capture.release()
+        raise ValueError(f"Could not open video file: {file_path}")
+
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        fps = fps if fps and fps > 0 else FALLBACK_FPS
+        # Look at every step-th frame
+        step = max(1, round(fps / sampling['fps'])) if sampling['fps'] > 0 else 1
+        scene_mode = sampling['mode'] == 'scene'
+
+        last_thumbnail = None
+        last_kept = None
+        index = -1
+        # Time spent grabbing and decoding since the last kept frame, charged to the next one
+        decode_start = time.perf_counter()
+        while True:
+            index += 1
+            if index % step:
+                if not capture.grab():
+                    break
+                continue
+
+            ok, frame = capture.read()
+            if not ok:
+                break
+            timestamp = index / fps
+
+            if scene_mode:
+                thumbnail = _scene_thumbnail(frame)
+                changed = last_thumbnail is None or float(np.mean(np.abs(thumbnail - last_thumbnail))) > sampling['scene_threshold']
+                if not changed and timestamp - last_kept < sampling['max_gap']:
+                    continue
+                last_thumbnail = thumbnail
+
+            last_kept = timestamp
+            video_frame = VideoFrame(file_path, frame, index, timestamp, max_side)
+            video_frame.timings['decode_ms'] = (time.perf_counter() - decode_start) * 1000
+            yield video_frame
+            decode_start = time.perf_counter()
+    finally:
+        capture.release()
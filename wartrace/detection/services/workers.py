@@ -0,0 +1,150 @@
+import os
+import logging
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+from .preload import after_fork, preloaded_models
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker(settings_module: str):
+    """Set up Django in a freshly started inference worker process"""
+    if preloaded_models():
+        # Forked from a process holding the preloaded models: Django is set up and the
+        # weights are already mapped, shared copy-on-write with the parent
+        after_fork()
+        logger.info(f"Inference worker {os.getpid()} forked with models {preloaded_models()}")
+        return
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+    import django
+    django.setup()
+
+    # Size the thread pools for this worker's share of the cores, then load the
+    # configured models before the first job arrives
+    from .main import model_service
+    model_service.configure_threads()
+    model_service.preload()
+
+    logger.info(f"Inference worker {os.getpid()} started")
+
+
+def _model_status():
+    """Report the models loaded in an inference worker process"""
+    from .main import model_service
+    return model_service.status()
+
+
+def _run_jobs() -> int:
+    """Process queued jobs from the database inside an inference worker process"""
+    from django.db import close_old_connections
+    from .jobs import run_queued_jobs
+
+    close_old_connections()
+    try:
+        return run_queued_jobs()
+    finally:
+        close_old_connections()
+
+
+class InferencePool:
+    """
+    Pool of worker processes that run detection jobs.
+
+    Each worker process imports the detection service once and keeps its models loaded
+    between jobs, so web processes never load model weights themselves. Jobs are sent to
+    the workers over the executor's local multiprocessing queue. When the models were
+    preloaded before fork (see services/preload.py), the workers are forked and share them.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, start_method: Optional[str] = None):
+        self.max_workers = max_workers
+        self.start_method = start_method
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Start the worker processes on first use"""
+        with self._lock:
+            if self._executor is None:
+                max_workers = self.max_workers or getattr(settings, 'DETECTION_WORKER_PROCESSES', 2)
+                start_method = self.start_method or getattr(settings, 'DETECTION_WORKER_START_METHOD', 'spawn')
+                if self.start_method is None and preloaded_models():
+                    # Fork so the workers share the preloaded weights instead of loading their own
+                    start_method = 'fork'
+
+                logger.info(f"Starting inference pool with {max_workers} {start_method} worker processes")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context(start_method),
+                    initializer=_init_worker,
+                    initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'wartrace.settings'),)
+                )
+            return self._executor
+
+    def submit(self, fn, *args) -> Future:
+        """Submit a picklable callable to the worker processes"""
+        try:
+            return self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OOM killer), start a fresh pool and retry once
+            logger.error("Inference pool is broken, restarting it")
+            logger.error(traceback.format_exc())
+            self.shutdown(wait=False)
+            return self._get_executor().submit(fn, *args)
+
+    def submit_jobs(self) -> Future:
+        """Wake a worker to process the queued jobs in the database"""
+        if getattr(settings, 'DETECTION_EXTERNAL_WORKERS', False):
+            # run_detection_worker processes poll the queue themselves
+            future = Future()
+            future.set_result(0)
+            return future
+        return self.submit(_run_jobs)
+
+    @property
+    def is_running(self) -> bool:
+        """Check if the worker processes have been started"""
+        return self._executor is not None
+
+    def model_status(self, timeout: float = 5.0) -> List[Dict[str, Any]]:
+        """
+        Collect model status from the worker processes
+
+        One status request is sent per worker; idle workers each pick one up, busy workers
+        may not answer in time, so the result is keyed by worker pid and can be partial.
+        """
+        if not self.is_running:
+            return []
+
+        max_workers = self.max_workers or getattr(settings, 'DETECTION_WORKER_PROCESSES', 2)
+        futures = [self.submit(_model_status) for _ in range(max_workers)]
+
+        statuses = {}
+        for future in futures:
+            try:
+                status = future.result(timeout=timeout)
+                statuses[status['pid']] = status
+            except Exception as e:
+                logger.warning(f"No model status from inference worker: {str(e)}")
+        return list(statuses.values())
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+# Singleton instance
+inference_pool = InferencePool()
@@ -1,3 +1,1031 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from content.models import Marker, MarkerFile
+from .models import ClassificationResult, Detection, DetectionConfig, InferenceCacheEntry, ObjectDetection, ProcessingJob
+from .services.cache import file_sha256, get_cached_results, params_key, store_result
+from .services.jobs import (
+    claim_job, complete_job, enqueue_marker_job, fail_job, release_job, requeue_stale_jobs, run_queued_jobs
+)
+from .services.rendering import draw_modern_annotations, get_label_color
+from .services.runner import DetectionWorker
+from .services.tiling import clear_tile_config_cache, nms, tile_config, tile_windows
+
+
+def create_marker(user, **flags):
+    return Marker.objects.create(user=user, title='Marker', description='Test marker', **flags)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.marker = create_marker(self.user, object_detection=True)
+
+    def test_one_active_job_per_marker(self):
+        job, created = enqueue_marker_job(self.marker, ['object_detection'])
+        again, created_again = enqueue_marker_job(self.marker, ['object_detection'])
+
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again.id, job.id)
+
+    def test_claim_takes_oldest_queued_job_once(self):
+        first, _ = enqueue_marker_job(self.marker, ['object_detection'])
+        second, _ = enqueue_marker_job(create_marker(self.user), ['object_detection'])
+
+        claimed = claim_job('worker-a')
+        self.assertEqual(claimed.id, first.id)
+        self.assertEqual(claimed.status, 'processing')
+        self.assertEqual(claimed.attempts, 1)
+        self.assertEqual(claimed.worker_id, 'worker-a')
+
+        self.assertEqual(claim_job('worker-b').id, second.id)
+        self.assertIsNone(claim_job('worker-c'))
+
+    def test_failed_job_is_requeued_until_attempts_run_out(self):
+        job, _ = enqueue_marker_job(self.marker, ['object_detection'])
+        ProcessingJob.objects.filter(id=job.id).update(max_attempts=2)
+
+        fail_job(claim_job('worker'), 'first failure')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.worker_id, '')
+
+        fail_job(claim_job('worker'), 'second failure')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'error')
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.error, 'second failure')
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(claim_job('worker'))
+
+    def test_stale_jobs_are_requeued_or_failed(self):
+        retry, _ = enqueue_marker_job(self.marker, ['object_detection'])
+        exhausted, _ = enqueue_marker_job(create_marker(self.user), ['object_detection'])
+        claim_job('worker')
+        claim_job('worker')
+        ProcessingJob.objects.filter(id=exhausted.id).update(max_attempts=1)
+        ProcessingJob.objects.update(heartbeat_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(requeue_stale_jobs(stale_after=60), 2)
+        retry.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual(retry.status, 'queued')
+        self.assertEqual(retry.attempts, 1)
+        self.assertEqual(exhausted.status, 'error')
+
+    def test_released_job_gets_its_attempt_back(self):
+        job, _ = enqueue_marker_job(self.marker, ['object_detection'])
+        claimed = claim_job('worker-a')
+
+        self.assertFalse(release_job(job.id, 'worker-b'))
+        self.assertTrue(release_job(job.id, 'worker-a'))
+        self.assertFalse(release_job(job.id, 'worker-a'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.worker_id), ('queued', 0, ''))
+
+        # The released worker's late outcome doesn't touch the job, queued or claimed again
+        self.assertFalse(complete_job(claimed, {'processed': 1}))
+        self.assertFalse(fail_job(claimed, 'late failure'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('queued', ''))
+
+        reclaimed = claim_job('worker-b')
+        self.assertEqual(reclaimed.attempts, 1)
+        self.assertFalse(complete_job(claimed, {'processed': 1}))
+        self.assertTrue(complete_job(reclaimed, {'processed': 2}))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker_id, job.result), ('completed', 'worker-b', {'processed': 2}))
+
+    def test_fresh_jobs_are_not_stale(self):
+        enqueue_marker_job(self.marker, ['object_detection'])
+        claim_job('worker')
+
+        self.assertEqual(requeue_stale_jobs(stale_after=60), 0)
+        self.assertEqual(ProcessingJob.objects.get().status, 'processing')
+
+    def test_file_job_counts_one_file(self):
+        marker_file = MarkerFile.objects.create(marker=self.marker, file='user_uploads/a.jpg')
+        MarkerFile.objects.create(marker=self.marker, file='user_uploads/b.jpg')
+
+        job, _ = enqueue_marker_job(self.marker, ['object_detection'], marker_file=marker_file)
+        self.assertEqual(job.files_total, 1)
+        self.assertEqual(job.marker_file_id, marker_file.id)
+
+    @override_settings(DETECTION_EXTERNAL_WORKERS=True)
+    def test_process_view_queues_and_redirects_without_waiting(self):
+        MarkerFile.objects.create(marker=self.marker, file='user_uploads/a.jpg')
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('detection:process_marker', args=[self.marker.id]))
+
+        self.assertRedirects(response, f"{reverse('content:marker_detail', args=[self.marker.id])}?processing=1",
+                             fetch_redirect_response=False)
+        self.assertEqual(ProcessingJob.objects.get(marker=self.marker).status, 'queued')
+
+
+class DetectionWorkerTests(TransactionTestCase):
+    # Job threads use their own database connections, which only see committed rows
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+
+    def enqueue(self, count):
+        return [enqueue_marker_job(create_marker(self.user), ['object_detection'])[0] for _ in range(count)]
+
+    def worker(self, **kwargs):
+        return DetectionWorker(worker_id='test-worker', poll_interval=0.01, heartbeat_interval=60, **kwargs)
+
+    def test_exit_when_idle_runs_every_queued_job(self):
+        jobs = self.enqueue(3)
+
+        with mock.patch('detection.services.main.process_marker', return_value={'processed': 1, 'detections': 4}):
+            stats = self.worker(concurrency=2, exit_when_idle=True).run()
+
+        self.assertEqual((stats['jobs_completed'], stats['jobs_failed'], stats['detections']), (3, 0, 12))
+        self.assertEqual(stats['state'], 'stopped')
+        self.assertEqual(ProcessingJob.objects.filter(id__in=[job.id for job in jobs], status='completed').count(), 3)
+
+    def test_failing_job_is_retried_until_attempts_run_out(self):
+        job, = self.enqueue(1)
+
+        with mock.patch('detection.services.main.process_marker', side_effect=RuntimeError('model crashed')), \
+                self.assertLogs('detection.services.jobs', 'ERROR'):
+            stats = self.worker(exit_when_idle=True).run()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), ('error', job.max_attempts, 'model crashed'))
+        self.assertEqual(stats['jobs_failed'], job.max_attempts)
+
+    def test_max_jobs_stops_claiming(self):
+        self.enqueue(3)
+
+        with mock.patch('detection.services.main.process_marker', return_value={'processed': 1}):
+            stats = self.worker(concurrency=2, max_jobs=2).run()
+
+        self.assertEqual(stats['jobs_completed'], 2)
+        self.assertEqual(ProcessingJob.objects.filter(status='queued').count(), 1)
+
+    def test_drain_timeout_requeues_running_job_and_ignores_its_late_result(self):
+        job, = self.enqueue(1)
+        started = threading.Event()
+        finish = threading.Event()
+
+        def slow_process_marker(marker, **kwargs):
+            started.set()
+            finish.wait(10)
+            return {'processed': 1}
+
+        worker = self.worker(drain_timeout=0.1)
+        with mock.patch('detection.services.main.process_marker', side_effect=slow_process_marker):
+            runner = threading.Thread(target=lambda: setattr(self, 'stats', worker.run()))
+            runner.start()
+            self.assertTrue(started.wait(10))
+            worker.drain()
+            runner.join(10)
+
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.worker_id), ('queued', 0, ''))
+            self.assertEqual(self.stats['jobs_released'], 1)
+
+            # The abandoned job thread finishes after the job went back to the queue
+            with self.assertLogs('detection.services.jobs', 'WARNING'):
+                finish.set()
+                for thread in worker._threads:
+                    thread.join(10)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        # The dropped result is not counted as a completed job
+        self.assertEqual((worker._stats['jobs_completed'], worker._stats['jobs_released'], worker._stats['files']),
+                         (0, 1, 0))
+
+    def test_drain_waits_for_running_job(self):
+        job, = self.enqueue(1)
+        started = threading.Event()
+
+        def process_marker(marker, **kwargs):
+            started.set()
+            time.sleep(0.2)
+            return {'processed': 1}
+
+        worker = self.worker(drain_timeout=10)
+        with mock.patch('detection.services.main.process_marker', side_effect=process_marker):
+            runner = threading.Thread(target=lambda: setattr(self, 'stats', worker.run()))
+            runner.start()
+            self.assertTrue(started.wait(10))
+            worker.drain()
+            runner.join(10)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual((self.stats['jobs_completed'], self.stats['jobs_released']), (1, 0))
+
+    @override_settings(DETECTION_WORKER_HEARTBEAT_SECONDS=0.05)
+    def test_pool_jobs_send_heartbeats_while_running(self):
+        job, = self.enqueue(1)
+        heartbeats = []
+
+        def slow_process_marker(marker, **kwargs):
+            # No progress callback, like one large file
+            heartbeats.append(ProcessingJob.objects.get(id=job.id).heartbeat_at)
+            time.sleep(0.3)
+            heartbeats.append(ProcessingJob.objects.get(id=job.id).heartbeat_at)
+            return {'processed': 1}
+
+        with mock.patch('detection.services.main.process_marker', side_effect=slow_process_marker):
+            self.assertEqual(run_queued_jobs('test-worker'), 1)
+
+        self.assertGreater(heartbeats[1], heartbeats[0])
+        self.assertFalse([thread for thread in threading.enumerate() if thread.name.startswith('job-heartbeat')])
+
+
+@override_settings(DETECTION_STUB_MODELS=True, DETECTION_RESULT_CACHE=False, DETECTION_BATCH_SIZE=2)
+class ProcessMarkerTests(TransactionTestCase):
+    # The staged pipeline stores results from its own threads, which only see committed rows
+    detector_types = ['object_detection', 'damage_assessment']
+
+    def setUp(self):
+        from .services.main import model_service
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = self.settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.addCleanup(model_service.loaded_models.clear)
+
+        self.marker = create_marker(User.objects.create_user(username='owner', password='password'))
+        os.makedirs(os.path.join(media_root, 'user_uploads'))
+        rng = np.random.default_rng(0)
+        for index in range(3):
+            name = f"user_uploads/{index}.jpg"
+            cv2.imwrite(os.path.join(media_root, name), rng.integers(0, 256, (240, 320, 3), dtype=np.uint8))
+            MarkerFile.objects.create(marker=self.marker, file=name)
+
+    def process(self, pipeline):
+        from .services.main import process_marker
+
+        with self.settings(DETECTION_PIPELINE=pipeline):
+            return process_marker(self.marker, detector_types=self.detector_types)
+
+    def stored(self):
+        return sorted(
+            (detection.marker_file_id, detection.detector_type, detection.summary,
+             sorted((obj.label, round(obj.confidence, 4)) for obj in detection.objects.all()))
+            for detection in Detection._default_manager.filter(marker_file__marker=self.marker)
+        )
+
+    def test_sequential_and_staged_pipelines_store_the_same_results(self):
+        sequential = self.process('sequential')
+        sequential_rows = self.stored()
+        staged = self.process('staged')
+
+        for result in (sequential, staged):
+            self.assertEqual((result['processed'], result['errors']), (3, 0))
+            self.assertEqual(result['detections'], 6)
+        self.assertEqual(self.stored(), sequential_rows)
+        self.assertEqual([stage['name'] for stage in staged['pipeline']['stages']],
+                         ['load', 'preprocess', 'infer', 'postprocess', 'render', 'persist'])
+
+    @override_settings(DETECTION_RESULT_CACHE=True, DETECTION_RENDER_IMAGES=True)
+    def test_cached_results_are_rendered(self):
+        from django.conf import settings
+
+        results_root = os.path.join(settings.MEDIA_ROOT, 'detection_results')
+        with mock.patch('detection.services.main.RESULTS_ROOT', results_root):
+            self.assertEqual(self.process('sequential')['cache_hits'], 0)
+            for pipeline in ('sequential', 'staged'):
+                shutil.rmtree(results_root)
+                result = self.process(pipeline)
+
+                self.assertEqual((result['cache_hits'], result['cache_misses']), (6, 0))
+                detections = Detection._default_manager.filter(marker_file__marker=self.marker, detector_type='object_detection')
+                self.assertEqual(detections.count(), 3)
+                for detection in detections:
+                    self.assertTrue(detection.image_path)
+                    self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, detection.image_path)))
+
+    def test_staged_pipeline_stores_failed_files_with_error_results(self):
+        from .services.images import DecodedImage
+        from .services.main import model_service
+
+        release = mock.patch.object(DecodedImage, 'release', autospec=True, side_effect=DecodedImage.release)
+        failing = mock.patch.object(model_service, '_postprocess_yolo', side_effect=RuntimeError('postprocess failed'))
+        with release as released, failing, self.assertLogs('detection.services.pipeline', 'ERROR'):
+            result = self.process('staged')
+
+        self.assertEqual(result['errors'], 3)
+        self.assertEqual(result['pipeline']['stages'][3]['errors'], 3)
+        self.assertEqual(released.call_count, 3)
+
+        errors = Detection._default_manager.filter(marker_file__marker=self.marker, detector_type='object_detection')
+        self.assertEqual(errors.count(), 3)
+        self.assertTrue(all(detection.summary == 'Error processing image: postprocess failed' for detection in errors))
+        # The classifier ran before the failing stage, its results are kept
+        self.assertEqual(
+            Detection._default_manager.filter(marker_file__marker=self.marker, detector_type='damage_assessment').count(), 3
+        )
+
+    def test_staged_pipeline_stores_unreadable_files_as_failed(self):
+        from .services.pipeline import open_image
+
+        def open_or_fail(file_path, **kwargs):
+            if file_path.endswith('0.jpg'):
+                raise OSError('read failed')
+            return open_image(file_path, **kwargs)
+
+        with mock.patch('detection.services.pipeline.open_image', side_effect=open_or_fail), \
+                self.assertLogs('detection.services.pipeline', 'ERROR'):
+            result = self.process('staged')
+
+        self.assertEqual(result['errors'], 1)
+        unreadable = Detection._default_manager.filter(marker_file__file='user_uploads/0.jpg')
+        self.assertEqual(sorted(unreadable.values_list('detector_type', flat=True)), sorted(self.detector_types))
+        self.assertTrue(all(detection.summary == 'Error processing image: read failed' for detection in unreadable))
+        self.assertEqual(Detection._default_manager.filter(marker_file__marker=self.marker).count(), 6)
+
+
+@override_settings(DETECTION_STUB_MODELS=True, DETECTION_RESULT_CACHE=False)
+class VideoTests(TestCase):
+    # 3 seconds at 10 fps: a dark scene, a bright one, then the dark one again
+    scenes = [(0, 10, 20), (10, 20, 240), (20, 30, 20)]
+
+    def setUp(self):
+        from .services.main import model_service
+
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = self.settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.addCleanup(model_service.loaded_models.clear)
+
+        os.makedirs(os.path.join(self.media_root, 'user_uploads'))
+        self.video_path = os.path.join(self.media_root, 'user_uploads', 'video.avi')
+        writer = cv2.VideoWriter(self.video_path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48))
+        for start, end, value in self.scenes:
+            for _ in range(start, end):
+                writer.write(np.full((48, 64, 3), value, dtype=np.uint8))
+        writer.release()
+
+    def keyframes(self, **sampling):
+        from .services.video import iter_keyframes
+
+        sampling = dict({'mode': 'scene', 'fps': 10, 'scene_threshold': 0.08, 'max_gap': 100}, **sampling)
+        frames = list(iter_keyframes(self.video_path, sampling=sampling))
+        return [frame.index for frame in frames], frames
+
+    def test_fps_mode_keeps_frames_at_a_fixed_rate(self):
+        indices, frames = self.keyframes(mode='fps', fps=5)
+        self.assertEqual(indices, list(range(0, 30, 2)))
+        self.assertEqual([frame.timestamp for frame in frames[:3]], [0.0, 0.2, 0.4])
+
+        # 0 keeps every frame
+        self.assertEqual(self.keyframes(mode='fps', fps=0)[0], list(range(30)))
+
+    def test_scene_mode_keeps_scene_changes(self):
+        indices, frames = self.keyframes()
+        self.assertEqual(indices, [0, 10, 20])
+        self.assertEqual([int(frame.array.mean()) // 100 for frame in frames], [0, 2, 0])
+        self.assertEqual(frames[1].file_path, os.path.join(self.media_root, 'user_uploads', 'video_frame000010.jpg'))
+
+    def test_scene_mode_keeps_a_frame_every_max_gap(self):
+        self.assertEqual(self.keyframes(max_gap=0.5)[0], [0, 5, 10, 15, 20, 25])
+        # Frames are only looked at every 1 / fps seconds
+        self.assertEqual(self.keyframes(fps=5, max_gap=0.5)[0], [0, 6, 10, 16, 20, 26])
+
+    @override_settings(DETECTION_VIDEO_SAMPLING='fps', DETECTION_VIDEO_FPS=0, DETECTION_STUB_DETECTIONS=20)
+    def test_video_rows_are_flushed_every_bulk_batch(self):
+        from .services.main import BULK_CREATE_BATCH_SIZE, process_video_file
+
+        marker = create_marker(User.objects.create_user(username='owner', password='password'))
+        marker_file = MarkerFile.objects.create(marker=marker, file='user_uploads/video.avi')
+
+        written = []
+        bulk_create = QuerySet.bulk_create
+
+        def record_bulk_create(queryset, objs, *args, **kwargs):
+            # The row list is cleared once written, so its size is recorded here
+            if queryset.model is ObjectDetection:
+                written.append(len(objs))
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=record_bulk_create):
+            detection, = process_video_file(marker_file, self.video_path, ['object_detection'], batch_size=4)
+
+        rows = ObjectDetection.objects.filter(detection=detection)
+        self.assertEqual(sum(written), rows.count())
+        self.assertGreater(rows.count(), BULK_CREATE_BATCH_SIZE)
+        # Rows are written once they reach a bulk batch, the rest when the video ends
+        self.assertEqual(len(written), 2)
+        self.assertGreaterEqual(written[0], BULK_CREATE_BATCH_SIZE)
+        self.assertLess(written[0], BULK_CREATE_BATCH_SIZE + 20)
+
+        self.assertEqual(set(rows.values_list('frame_index', flat=True)), set(range(30)))
+        self.assertEqual(rows.filter(frame_index=10).first().timestamp, 1.0)
+        video = detection.metadata['video']
+        self.assertEqual((video['sampled_frames'], video['complete'], video['width']), (30, True, 64))
+        self.assertTrue(detection.summary.startswith(f"Found {rows.count()} objects in 30 of 30 sampled frames"))
+
+    @override_settings(DETECTION_VIDEO_SAMPLING='fps', DETECTION_VIDEO_FPS=0)
+    def test_results_page_previews_video_frames(self):
+        from .services.main import process_video_file
+
+        user = User.objects.create_user(username='owner', password='password')
+        marker = create_marker(user)
+        marker_file = MarkerFile.objects.create(marker=marker, file='user_uploads/video.avi')
+        detection, = process_video_file(marker_file, self.video_path, ['object_detection'])
+        ObjectDetection.objects.filter(detection=detection, frame_index__lt=10).delete()
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('detection:marker_results', args=[marker.id]))
+        preview_url = reverse('detection:file_preview', args=[marker_file.id])
+        file_data, = response.context['files_with_detections']
+        self.assertEqual(file_data['preview_url'], preview_url)
+        card, = file_data['detections']
+        self.assertEqual((card['preview_frame'], card['preview_url']), (10, f"{preview_url}?frame=10"))
+        self.assertContains(response, 'data-frame-index="10"')
+
+        with mock.patch('detection.views.RESULTS_ROOT', os.path.join(self.media_root, 'detection_results')):
+            frame = self.client.get(card['preview_url'])
+            self.assertEqual(self.client.get(f"{preview_url}?frame=-1").status_code, 400)
+        self.assertEqual(frame['Content-Type'], 'image/jpeg')
+        preview = cv2.imdecode(np.frombuffer(frame.content, dtype=np.uint8), cv2.IMREAD_COLOR)
+        self.assertGreater(preview.mean(), 200)
+
+
+@override_settings(DETECTION_STUB_MODELS=True)
+class ModelServiceTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = self.settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        # Every stub model counts as 100 MB
+        memory_patch = mock.patch('detection.services.main._model_memory_mb', return_value=100.0)
+        memory_patch.start()
+        self.addCleanup(memory_patch.stop)
+
+    @override_settings(DETECTION_MODEL_MEMORY_MB=250)
+    def test_least_recently_used_model_is_evicted_over_budget(self):
+        from .services.main import ModelService
+
+        service = ModelService()
+        service.get_model('object_detection')
+        service.get_model('damage_assessment')
+        # Using object_detection again makes damage_assessment the least recently used
+        service.get_model('object_detection')
+        service.get_model('emergency_recognition')
+
+        self.assertEqual(list(service.loaded_models), ['object_detection_yolo11m', 'emergency_recognition_emergency_net'])
+        self.assertEqual(service.loaded_models['object_detection_yolo11m']['uses'], 2)
+
+    @override_settings(DETECTION_MODEL_MEMORY_MB=50)
+    def test_model_larger_than_budget_stays_loaded(self):
+        from .services.main import ModelService
+
+        service = ModelService()
+        with self.assertLogs('detection.services.main', 'WARNING'):
+            service.get_model('object_detection')
+            service.get_model('damage_assessment')
+
+        self.assertEqual(list(service.loaded_models), ['damage_assessment_xbd_classifier'])
+
+    @override_settings(DETECTION_PRELOAD_MODELS=['object_detection', 'damage_assessment', 'unknown'])
+    def test_preload_loads_and_warms_up_configured_models(self):
+        from .services.main import ModelService
+
+        service = ModelService()
+        with self.assertLogs('detection.services.main', 'WARNING'):
+            loaded = service.preload()
+
+        self.assertEqual(loaded, ['object_detection_yolo11m', 'damage_assessment_xbd_classifier'])
+        for model_key in loaded:
+            self.assertIsNotNone(service.loaded_models[model_key]['warmup_time'])
+
+    @override_settings(DETECTION_MODEL_MEMORY_MB=1000)
+    def test_model_status_reports_loaded_models_to_staff(self):
+        from .services.main import model_service
+
+        self.addCleanup(model_service.loaded_models.clear)
+        model_service.preload(['object_detection'], warm_up=False)
+        user = User.objects.create_user(username='staff', password='password')
+        self.client.force_login(user)
+
+        self.assertEqual(self.client.get(reverse('detection:model_status')).status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        payload = self.client.get(reverse('detection:model_status')).json()
+
+        self.assertTrue(payload['success'])
+        self.assertEqual(payload['workers'], [])
+        web = payload['web']
+        self.assertEqual([model['key'] for model in web['models']], ['object_detection_yolo11m'])
+        self.assertEqual(web['models'][0]['type'], 'stub')
+        self.assertEqual((web['total_memory_mb'], web['memory_budget_mb']), (100.0, 1000))
+        self.assertIn('threads', web)
+
+
+class ThreadBudgetTests(TestCase):
+    def setUp(self):
+        import torch
+
+        self.addCleanup(torch.set_num_threads, torch.get_num_threads())
+        self.addCleanup(cv2.setNumThreads, cv2.getNumThreads())
+        environ = mock.patch.dict(os.environ)
+        environ.start()
+        self.addCleanup(environ.stop)
+
+    def test_torch_threads_are_split_once_between_object_detectors(self):
+        import torch
+        from .services.threads import apply_thread_budget, parallel_detectors
+
+        with self.settings(DETECTION_DETECTOR_CONCURRENCY=4):
+            # Two object detectors are configured, the classifiers don't run on torch
+            self.assertEqual(parallel_detectors(), 2)
+            applied = apply_thread_budget({'intra_op': 4, 'inter_op': 1})
+        self.assertEqual((applied['torch']['intra_op'], torch.get_num_threads()), (2, 2))
+        self.assertEqual(os.environ['OMP_NUM_THREADS'], '4')
+
+        with self.settings(DETECTION_DETECTOR_CONCURRENCY=1):
+            self.assertEqual(apply_thread_budget({'intra_op': 4, 'inter_op': 1})['torch']['intra_op'], 4)
+
+    @override_settings(DETECTION_STUB_MODELS=True, DETECTION_DETECTOR_CONCURRENCY=4)
+    def test_concurrent_batches_leave_torch_threads_alone(self):
+        from .services.main import ModelService
+        from .services.video import VideoFrame
+
+        service = ModelService()
+        service.thread_budget = {'intra_op': 2, 'inter_op': 1}
+        frames = [VideoFrame('video.mp4', np.zeros((64, 64, 3), dtype=np.uint8), index, 0.0) for index in range(2)]
+        detector_types = ['object_detection', 'military_detection', 'damage_assessment']
+
+        results = []
+
+        def run_batch():
+            results.append(service.process_decoded_images(frames, detector_types, postprocess=False))
+
+        with mock.patch('torch.set_num_threads') as set_num_threads:
+            batches = [threading.Thread(target=run_batch) for _ in range(2)]
+            for batch in batches:
+                batch.start()
+            for batch in batches:
+                batch.join(10)
+
+        set_num_threads.assert_not_called()
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(set(frame_results) == set(detector_types) for result in results for frame_results in result))
+
+
+@override_settings(DETECTION_STUB_MODELS=True)
+class PreloadTests(TestCase):
+    def setUp(self):
+        import gc
+        from .services import preload
+        from .services.main import model_service
+
+        self.addCleanup(gc.unfreeze)
+        self.addCleanup(model_service.loaded_models.clear)
+        self.addCleanup(setattr, model_service, 'thread_budget', model_service.thread_budget)
+        self.addCleanup(setattr, model_service, 'thread_settings', model_service.thread_settings)
+        preloaded = mock.patch.dict(preload._preloaded)
+        preloaded.start()
+        self.addCleanup(preloaded.stop)
+
+        # Record the thread budgets instead of resizing this process's pools
+        apply_patch = mock.patch('detection.services.main.apply_thread_budget', return_value={})
+        self.apply_thread_budget = apply_patch.start()
+        self.addCleanup(apply_patch.stop)
+
+    def test_preload_for_fork_loads_fork_safe_models_on_one_thread(self):
+        from .services.backends import resolve_model_config
+        from .services.main import model_service
+        from .services.preload import preload_for_fork, preload_status, preloaded_models
+
+        def keras_classifier(detector_type, model_name, model_config):
+            config = resolve_model_config(detector_type, model_name, model_config)
+            return dict(config, type='keras') if detector_type == 'damage_assessment' else config
+
+        with mock.patch('detection.services.backends.resolve_model_config', side_effect=keras_classifier), \
+                self.assertLogs('detection.services.preload', 'WARNING'):
+            report = preload_for_fork(['object_detection', 'damage_assessment', 'unknown'], workers=3)
+
+        self.apply_thread_budget.assert_called_once_with({'intra_op': 1, 'inter_op': 1})
+        self.assertEqual((report['models'], report['skipped']), (['object_detection_yolo11m'], ['damage_assessment']))
+        self.assertEqual(list(model_service.loaded_models), ['object_detection_yolo11m'])
+        self.assertIsNotNone(model_service.loaded_models['object_detection_yolo11m']['warmup_time'])
+        self.assertEqual(preloaded_models(), ['object_detection_yolo11m'])
+        self.assertGreater(report['frozen_objects'], 0)
+        # Loaded in this process, not inherited from a parent
+        self.assertIsNone(preload_status()['parent_pid'])
+
+    @override_settings(DETECTION_INTRA_OP_THREADS=0, DETECTION_INTER_OP_THREADS=1)
+    def test_after_fork_sizes_threads_for_the_workers_share_of_cores(self):
+        from .services.main import model_service
+        from .services.preload import after_fork
+
+        with mock.patch('detection.services.threads.available_cores', return_value=8):
+            budget = after_fork(4)
+
+        self.assertEqual(budget, {'intra_op': 2, 'inter_op': 1})
+        self.assertEqual(model_service.thread_budget, budget)
+        self.apply_thread_budget.assert_called_once_with({'intra_op': 2, 'inter_op': 1})
+
+
+class DetectionRecordTests(TestCase):
+    def setUp(self):
+        marker = create_marker(User.objects.create_user(username='owner', password='password'))
+        self.marker_file = MarkerFile.objects.create(marker=marker, file='user_uploads/a.jpg')
+        self.results = {
+            'object_detection': {'model_name': 'yolo11m', 'result': {
+                'summary': '2 objects',
+                'image_width': 640,
+                'image_height': 480,
+                'timings': {'inference_ms': 12.5, 'render_ms': None},
+                'detections': [
+                    {'label': 'car', 'confidence': 0.9, 'bbox': [1, 2, 30, 40]},
+                    {'label': 'person', 'confidence': 0.6, 'bbox': [50, 60, 70, 80]}
+                ]
+            }},
+            'damage_assessment': {'model_name': 'xbd_classifier', 'result': {
+                'summary': 'no_damage',
+                'classifications': [{'label': 'no_damage', 'confidence': 0.8}, {'label': 'destroyed', 'confidence': 0.1}]
+            }}
+        }
+
+    def create_records(self, **kwargs):
+        from .services.main import _create_detection_records
+
+        return _create_detection_records(self.marker_file, self.results, **kwargs)
+
+    def test_rows_are_written_for_every_detector(self):
+        detections = self.create_records()
+
+        self.assertEqual([detection.detector_type for detection in detections], ['object_detection', 'damage_assessment'])
+        objects = Detection._default_manager.get(detector_type='object_detection').objects.order_by('-confidence')
+        self.assertEqual([(obj.label, obj.x_min, obj.y_max) for obj in objects], [('car', 1, 40), ('person', 50, 80)])
+        classifications = ClassificationResult.objects.filter(detection__detector_type='damage_assessment')
+        self.assertEqual(sorted(c.label for c in classifications), ['destroyed', 'no_damage'])
+
+        metadata = Detection._default_manager.get(detector_type='object_detection').metadata
+        self.assertEqual((metadata['image_width'], metadata['image_height']), (640, 480))
+        self.assertEqual(metadata['timings']['inference_ms'], 12.5)
+        self.assertNotIn('render_ms', metadata['timings'])
+        self.assertIn('db_write_ms', metadata['timings'])
+
+    def test_reprocessed_types_replace_existing_rows(self):
+        self.create_records()
+        del self.results['damage_assessment']
+
+        self.create_records(replace_types=['object_detection'])
+
+        self.assertEqual(Detection._default_manager.filter(detector_type='object_detection').count(), 1)
+        self.assertEqual(Detection._default_manager.filter(detector_type='damage_assessment').count(), 1)
+        self.assertEqual(ObjectDetection.objects.count(), 2)
+
+    def test_query_count_does_not_grow_with_objects(self):
+        self.create_records()
+        self.results['object_detection']['result']['detections'] *= 20
+
+        with self.assertNumQueries(10):
+            self.create_records(replace_types=['object_detection', 'damage_assessment'])
+        self.assertEqual(ObjectDetection.objects.count(), 40)
+
+
+class TilingTests(TestCase):
+    def setUp(self):
+        clear_tile_config_cache()
+        self.addCleanup(clear_tile_config_cache)
+
+    def test_tile_windows_cover_image_with_overlap(self):
+        windows = tile_windows(1000, 700, 400, 0.25)
+
+        self.assertEqual(sorted({x for x, _, _, _ in windows}), [0, 300, 600])
+        self.assertEqual(sorted({y for _, y, _, _ in windows}), [0, 300])
+        self.assertTrue(all(x2 - x1 == 400 and y2 - y1 == 400 for x1, y1, x2, y2 in windows))
+        self.assertEqual(max(x2 for _, _, x2, _ in windows), 1000)
+        self.assertEqual(max(y2 for _, _, _, y2 in windows), 700)
+
+    def test_tile_windows_of_small_image_is_the_image(self):
+        self.assertEqual(tile_windows(300, 200, 640, 0.2), [(0, 0, 300, 200)])
+
+    def test_nms_keeps_best_box_per_object_and_class(self):
+        boxes = np.array([[0, 0, 100, 100], [5, 5, 105, 105], [0, 0, 100, 100], [200, 200, 300, 300]])
+        scores = np.array([0.6, 0.9, 0.5, 0.7])
+        labels = np.array([0, 0, 1, 0])
+
+        self.assertEqual(nms(boxes, scores, labels, threshold=0.5).tolist(), [1, 3, 2])
+        self.assertEqual(nms(boxes, scores, threshold=0.5).tolist(), [1, 3])
+        self.assertEqual(nms(np.empty((0, 4)), np.empty(0)).tolist(), [])
+
+    def test_nms_ios_drops_box_cut_by_tile_border(self):
+        boxes = np.array([[0, 0, 100, 100], [60, 0, 100, 100]])
+        scores = np.array([0.9, 0.8])
+
+        self.assertEqual(nms(boxes, scores, threshold=0.6, metric='iou').tolist(), [0, 1])
+        self.assertEqual(nms(boxes, scores, threshold=0.6, metric='ios').tolist(), [0])
+
+    def test_tiling_is_off_by_default_and_enabled_through_detection_config(self):
+        from .services.config import MODEL_CONFIG
+
+        for detector_type in ('object_detection', 'military_detection'):
+            for model_config in MODEL_CONFIG[detector_type].values():
+                self.assertFalse(tile_config(detector_type, model_config)['enabled'])
+
+        clear_tile_config_cache()
+        DetectionConfig.objects.create(detector_type='object_detection', display_name='Objects',
+                                       config={'tiling': {'enabled': True, 'tile_size': 1024}})
+        options = tile_config('object_detection', MODEL_CONFIG['object_detection']['yolo11m'])
+        self.assertTrue(options['enabled'])
+        self.assertEqual(options['tile_size'], 1024)
+
+    def test_detection_config_is_read_once_per_ttl(self):
+        with self.assertNumQueries(1):
+            tile_config('object_detection', {})
+            tile_config('object_detection', {})
+
+
+class RasterImageTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        # Smooth RGB gradient, so overviews built band by band match a whole-image resize
+        rows, cols = np.indices((300, 500))
+        self.rgb = np.stack([cols * 255 // 499, rows * 255 // 299, (rows + cols) * 255 // 798], axis=2).astype(np.uint8)
+
+    def write(self, name, **kwargs):
+        import tifffile
+
+        path = os.path.join(self.directory, name)
+        tifffile.imwrite(path, self.rgb, photometric='rgb', **kwargs)
+        return path
+
+    def open(self, path):
+        from .services.rasters import RasterImage
+
+        image = RasterImage(path)
+        self.addCleanup(image.release)
+        return image
+
+    def test_windows_match_full_array_for_every_layout(self):
+        layouts = {
+            'plain.tif': {},
+            'tiled.tif': {'tile': (64, 64), 'compression': 'zlib'},
+            'stripped.tif': {'rowsperstrip': 32, 'compression': 'zlib'}
+        }
+        bgr = self.rgb[:, :, ::-1]
+        for name, options in layouts.items():
+            image = self.open(self.write(name, **options))
+            self.assertEqual(image.shape, (300, 500, 3))
+            for x1, y1, x2, y2 in [(0, 0, 500, 300), (10, 20, 75, 90), (60, 60, 70, 70), (450, 250, 500, 300)]:
+                np.testing.assert_array_equal(image.read_window((x1, y1, x2, y2)), bgr[y1:y2, x1:x2], err_msg=name)
+
+    def test_uncompressed_rasters_are_memory_mapped_and_compressed_decode_segments(self):
+        from .services.images import DecodedImage, open_image
+
+        plain = self.open(self.write('plain.tif'))
+        plain.read_window((0, 0, 100, 100))
+        self.assertEqual((len(plain._memmaps), len(plain._segment_cache)), (1, 0))
+
+        tiled = self.open(self.write('tiled.tif', tile=(64, 64), compression='zlib'))
+        tiled.read_window((0, 0, 100, 100))
+        self.assertEqual(len(tiled._memmaps), 0)
+        self.assertEqual(sorted(tiled._segment_cache), [(0, 0), (0, 1), (0, 8), (0, 9)])
+
+        # One compressed strip would decode the whole image for every window
+        single_strip = self.write('single_strip.tif', rowsperstrip=300, compression='zlib')
+        with self.assertLogs('detection.services.images', 'WARNING'):
+            self.assertIsInstance(open_image(single_strip), DecodedImage)
+
+    @override_settings(DETECTION_RASTER_CACHE_MB=0.03)
+    def test_tile_cache_keeps_recently_used_tiles_within_budget(self):
+        # 64x64 RGB tiles are 12 kB, the budget holds two
+        image = self.open(self.write('tiled.tif', tile=(64, 64), compression='zlib'))
+        tiles = [(col * 64, 0, col * 64 + 64, 64) for col in range(3)]
+        for tile in tiles:
+            image.read_window(tile)
+        self.assertEqual(list(image._segment_cache), [(0, 1), (0, 2)])
+
+        filehandle = type(image._tiff.filehandle)
+        read_segments = mock.patch.object(filehandle, 'read_segments', autospec=True, side_effect=filehandle.read_segments)
+        with read_segments as reads:
+            image.read_window(tiles[1])
+            self.assertEqual(reads.call_count, 0)
+            image.read_window(tiles[0])
+            self.assertEqual(reads.call_count, 1)
+        self.assertEqual(list(image._segment_cache), [(0, 1), (0, 0)])
+
+    @override_settings(DETECTION_RASTER_OVERVIEW_SIDE=100)
+    def test_overview_is_built_band_by_band_within_overview_side(self):
+        image = self.open(self.write('tiled.tif', tile=(64, 64), compression='zlib'))
+        with mock.patch('detection.services.rasters.OVERVIEW_BAND_ROWS', 64), \
+                mock.patch.object(image, '_read_page_window', wraps=image._read_page_window) as read_window:
+            overview = image.inference_array
+
+        self.assertEqual(overview.shape, (60, 100, 3))
+        self.assertEqual(image.scale, 0.2)
+        self.assertEqual(image.to_full_resolution([10, 20, 30, 40]), [50, 100, 150, 200])
+        windows = [call.args[1] for call in read_window.call_args_list]
+        self.assertEqual([(y1, y2) for _, y1, _, y2 in windows], [(0, 64), (64, 128), (128, 192), (192, 256), (256, 300)])
+        self.assertTrue(all(call.kwargs == {'cache': False} for call in read_window.call_args_list))
+        self.assertEqual(len(image._segment_cache), 0)
+
+        expected = cv2.resize(np.ascontiguousarray(self.rgb[:, :, ::-1]), (100, 60), interpolation=cv2.INTER_AREA)
+        self.assertLessEqual(np.abs(overview.astype(int) - expected.astype(int)).max(), 2)
+
+
+@override_settings(DETECTION_STUB_MODELS=False, DETECTION_MISSING_WEIGHTS='fail')
+class ModelBackendTests(SimpleTestCase):
+    def setUp(self):
+        from .services.backends import _registry_cache
+
+        self.models_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.models_root, ignore_errors=True)
+        for name in ('yolo.pt', 'yolo.onnx', 'yolo_openvino', 'yolo_int8.onnx'):
+            with open(os.path.join(self.models_root, name), 'wb') as f:
+                f.write(name.encode())
+        self.config = {'type': 'ultralytics', 'model_path': os.path.join(self.models_root, 'yolo.pt')}
+
+        registry_path = os.path.join(self.models_root, 'exports.json')
+        registry = mock.patch('detection.services.backends.registry_path', return_value=registry_path)
+        registry.start()
+        self.addCleanup(registry.stop)
+        registry_cache = mock.patch.dict(_registry_cache, {'mtime': None, 'data': {}})
+        registry_cache.start()
+        self.addCleanup(registry_cache.stop)
+
+    def resolve(self, exports=None, sha256=None, installed=('onnx', 'openvino', 'onnx_int8'), preference='auto',
+                config=None):
+        """Backend chosen for an export registry of onnx, openvino and onnx_int8 exports, with per-case changes"""
+        import json
+        from .services.backends import _registry_cache, resolve_model_config
+        from .services.cache import model_version
+
+        entry = {
+            'source': {'path': 'yolo.pt', 'sha256': sha256 or model_version(self.config, 'yolo'), 'latency_ms': 100.0},
+            'exports': {
+                'onnx': {'path': 'yolo.onnx', 'latency_ms': 60.0, 'parity': {'passed': True}},
+                'openvino': {'path': 'yolo_openvino', 'latency_ms': 40.0, 'parity': {'passed': True}},
+                'onnx_int8': {'path': 'yolo_int8.onnx', 'latency_ms': 20.0, 'parity': {'passed': True}}
+            }
+        }
+        for backend, changes in (exports or {}).items():
+            entry['exports'][backend] = dict(entry['exports'].get(backend, {}), **changes)
+        with open(os.path.join(self.models_root, 'exports.json'), 'w') as f:
+            json.dump({'object_detection/yolo': entry}, f)
+        _registry_cache['mtime'] = None
+
+        with self.settings(DETECTION_BACKEND=preference), \
+                mock.patch('detection.services.backends.backend_available', side_effect=lambda backend: backend in installed):
+            resolved = resolve_model_config('object_detection', 'yolo', dict(self.config, **(config or {})))
+        return resolved.get('backend')
+
+    def test_backend_selection_rules(self):
+        cases = [
+            ('auto picks the lowest latency leaving out int8', {}, 'openvino'),
+            ('int8 is picked by auto for models allowing it', {'config': {'allow_int8': True}}, 'onnx_int8'),
+            ('int8 is used when preferred', {'preference': 'onnx_int8'}, 'onnx_int8'),
+            ('exports of other weights are stale', {'sha256': '0' * 64}, None),
+            ('failed parity is skipped', {'exports': {'openvino': {'parity': {'passed': False}}}}, 'onnx'),
+            ('missing parity check is skipped', {'exports': {'openvino': {'parity': {}}}}, 'onnx'),
+            ('missing file is skipped', {'exports': {'openvino': {'path': 'missing.xml'}}}, 'onnx'),
+            ('unavailable runtime is skipped', {'installed': ('onnx',)}, 'onnx'),
+            ('exports slower than the source are not used',
+             {'exports': {'openvino': {'latency_ms': 150.0}, 'onnx': {'latency_ms': 120.0}}}, None),
+            ('explicit preference wins over latency', {'preference': 'onnx'}, 'onnx'),
+            ('model config preference wins over the setting', {'config': {'backend': 'onnx'}}, 'onnx'),
+            ('unusable preferred backend falls back to the source', {'preference': 'onnx', 'installed': ('openvino',)}, None),
+            ('source preference keeps the original weights', {'preference': 'source'}, None),
+        ]
+        with self.assertLogs('detection.services.backends', 'WARNING') as logs:
+            for description, case, expected in cases:
+                with self.subTest(description):
+                    self.assertEqual(self.resolve(**case), expected)
+
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('are stale', logs.output[0])
+
+
+class ResultCacheTests(TestCase):
+    config = {'type': 'keras', 'model_path': '/models/classifier.h5', 'labels': ['a', 'b'], 'description': 'Classifier'}
+
+    def write_file(self, content):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_params_key_covers_output_affecting_config(self):
+        key = params_key(self.config, 'damage_assessment')
+
+        self.assertEqual(params_key(dict(self.config), 'damage_assessment'), key)
+        self.assertEqual(params_key(dict(self.config, description='Renamed', batch_size=4), 'damage_assessment'), key)
+        for change in ({'preprocessing': 'imagenet'}, {'top_k': 1}, {'input_size': [299, 299]}, {'labels': ['b', 'a']}):
+            self.assertNotEqual(params_key(dict(self.config, **change), 'damage_assessment'), key, change)
+        with self.settings(DETECTION_INFERENCE_MAX_SIDE=1280):
+            self.assertNotEqual(params_key(self.config, 'damage_assessment'), key)
+
+    def test_same_content_hits_and_other_content_or_params_miss(self):
+        file_hash = file_sha256(self.write_file(b'image'))
+        params = params_key(self.config, 'damage_assessment')
+        store_result(file_hash, 'damage_assessment', 'xbd', 'v1', params,
+                     {'classifications': [], 'output_path': '/tmp/out.jpg'})
+
+        copy_hash = file_sha256(self.write_file(b'image'))
+        cached = get_cached_results([copy_hash], 'damage_assessment', 'xbd', 'v1', params)
+        self.assertEqual(cached, {file_hash: {'classifications': []}})
+        self.assertEqual(InferenceCacheEntry.objects.get().hits, 1)
+
+        other_hash = file_sha256(self.write_file(b'other image'))
+        self.assertEqual(get_cached_results([other_hash], 'damage_assessment', 'xbd', 'v1', params), {})
+        top_1 = params_key(dict(self.config, top_k=1), 'damage_assessment')
+        self.assertEqual(get_cached_results([file_hash], 'damage_assessment', 'xbd', 'v1', top_1), {})
+        self.assertEqual(get_cached_results([file_hash], 'damage_assessment', 'xbd', 'v2', params), {})
+
+    def test_failed_results_are_not_cached(self):
+        self.assertIsNone(store_result('0' * 64, 'damage_assessment', 'xbd', 'v1', 'params', {'error': 'failed'}))
+        self.assertFalse(InferenceCacheEntry.objects.exists())
+
+    def test_cache_stats_sums_job_hits_in_database(self):
+        staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        marker = create_marker(staff)
+        for status, hits, misses in (('completed', 3, 1), ('completed', 1, 3), ('error', 5, 5)):
+            ProcessingJob.objects.create(marker=marker, status=status,
+                                         result={'cache_hits': hits, 'cache_misses': misses})
+        ProcessingJob.objects.create(marker=marker, status='completed', result={'processed': 0})
+        self.client.force_login(staff)
+
+        data = self.client.get(reverse('detection:cache_stats')).json()
+
+        self.assertEqual((data['job_cache_hits'], data['job_cache_misses'], data['hit_rate']), (4, 4, 0.5))
+
+
+class FilePreviewTests(TestCase):
+    def test_preview_requires_login(self):
+        marker = create_marker(User.objects.create_user(username='owner', password='password'))
+        marker_file = MarkerFile.objects.create(marker=marker, file='user_uploads/a.tif')
+        url = reverse('detection:file_preview', args=[marker_file.id])
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('next=', response['Location'])
+
+
+class TimingStatsTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username='staff', password='password', is_staff=True))
+        self.url = reverse('detection:detection_timing_stats')
+
+    def test_non_integer_parameters_are_rejected(self):
+        self.assertEqual(self.client.get(self.url, {'limit': 'all'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'days': '1.5'}).status_code, 400)
+
+    def test_out_of_range_parameters_are_clamped(self):
+        for params in ({'limit': '-1'}, {'limit': '0'}, {'limit': '10000000'}, {'days': '-3'}, {'days': '99999999999'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 200, params)
+
+
+class RenderingTests(SimpleTestCase):
+    def test_overlapping_fills_composite_in_detection_order(self):
+        img = np.full((200, 200, 3), 100, dtype=np.uint8)
+        detections = [
+            {'label': 'soldier', 'confidence': 0.9, 'bbox': [20, 60, 120, 160]},
+            {'label': 'weapon', 'confidence': 0.8, 'bbox': [80, 100, 180, 190]}
+        ]
+        annotated = draw_modern_annotations(img, detections, 'military_detection', 'model')
+        header_height = int(60 * 0.4)
+
+        def blend(base, label):
+            color, alpha = get_label_color(label)
+            fill = np.empty((1, 1, 3), dtype=np.uint8)
+            fill[:] = color
+            return cv2.addWeighted(fill, alpha, base, 1 - alpha, 0)
+
+        base = cv2.convertScaleAbs(img[:1, :1], alpha=1.1, beta=5)
+        only_first = annotated[header_height + 90, 50]
+        overlap = annotated[header_height + 140, 100]
+
+        np.testing.assert_array_equal(only_first, blend(base, 'soldier')[0, 0])
+        np.testing.assert_array_equal(overlap, blend(blend(base, 'soldier'), 'weapon')[0, 0])
+        self.assertEqual(img.max(), 100)
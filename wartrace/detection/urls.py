@@ -12,8 +12,14 @@ urlpatterns = [
     # File-level endpoints
     path('files/<int:file_id>/process/', views.process_file_view, name='process_file'),
     path('files/<int:file_id>/results/', views.file_detection_results, name='file_results'),
+    path('files/<int:file_id>/preview/', views.file_preview, name='file_preview'),
     
     # API endpoints
     path('api/markers/<int:marker_id>/process/', views.process_marker_api, name='process_marker_api'),
     path('api/markers/<int:marker_id>/auto-process/', views.auto_process_marker, name='auto_process_marker'),
+    path('api/detections/<int:detection_id>/overlay/', views.detection_overlay, name='detection_overlay'),
+    path('api/detections/<int:detection_id>/export/', views.export_detection_image, name='export_detection_image'),
+    path('api/models/status/', views.model_status, name='model_status'),
+    path('api/cache/stats/', views.cache_stats, name='cache_stats'),
+    path('api/stats/timings/', views.detection_timing_stats, name='detection_timing_stats'),
 ]
@@ -4,6 +4,8 @@ import traceback
 import logging
 import threading
 import time
+import heapq
+from datetime import timedelta
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse, HttpResponse
 from django.contrib.auth.decorators import login_required
@@ -12,22 +14,23 @@ from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from django.urls import reverse
 from django.db import models, transaction
+from django.db.models.fields.json import KT
+from django.db.models.functions import Cast
 from django.conf import settings
 from django.contrib import messages
-from concurrent.futures import ThreadPoolExecutor
+from django.utils import timezone
 
 from content.models import Marker, MarkerFile
-from .models import Detection, ObjectDetection, ClassificationResult, DetectionConfig
-from .services.main import process_marker, process_marker_file, model_service, MODEL_CONFIG, ensure_detection_directories
+from .models import Detection, ObjectDetection, ClassificationResult, DetectionConfig, ProcessingJob, InferenceCacheEntry
+# The inference, rendering and raster modules import cv2 and numpy; they are imported
+# in the views that use them so loading the URLconf stays fast
+from .services.config import MODEL_CONFIG, RESULTS_ROOT
+from .services.workers import inference_pool
+from .services.jobs import enqueue_marker_job, latest_marker_job
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-# Global worker pool for processing
-worker_pool = ThreadPoolExecutor(max_workers=2)
-# Track processing status
-processing_markers = {}
-
 def can_edit_marker(user, marker):
     """Check if user can edit the marker"""
     return user.is_staff or marker.user == user
@@ -97,21 +100,22 @@ def process_marker_view(request, marker_id):
                 'detector_types': detector_types
             })
     
-    # Process the marker
+    # Queue the marker; the marker page polls marker_processing_status until the job is done
     try:
-        # Use the processing service
-        from .services.main import process_marker
-        result = process_marker(marker)
-        
-        # Show success message
-        messages.success(request, f"Processing complete: {result['processed']} files processed with {result['detections']} detections.")
+        job, created = enqueue_marker_job(marker, detector_types)
+        if not created:
+            messages.warning(request, "Processing already in progress.")
+            return redirect('detection:marker_results', marker_id=marker.id)
         
+        # Wake the inference workers without waiting: they may have other markers queued
+        inference_pool.submit_jobs()
+        messages.info(request, "Processing started.")
     except Exception as e:
         logger.exception(f"Error processing marker {marker_id}: {str(e)}")
         messages.error(request, f"Error during processing: {str(e)}")
+        return redirect('detection:marker_results', marker_id=marker.id)
     
-    # Redirect to the results page
-    return redirect('detection:marker_results', marker_id=marker.id)
+    return redirect(f"{reverse('content:marker_detail', args=[marker.id])}?processing=1")
 
 @login_required
 @require_http_methods(["POST"])
@@ -127,7 +131,7 @@ def process_marker_api(request, marker_id):
         }, status=403)
     
     # Check if already processing
-    if marker_id in processing_markers and processing_markers[marker_id]['status'] == 'processing':
+    if ProcessingJob.objects.filter(marker=marker, status__in=ProcessingJob.ACTIVE_STATUSES).exists():
         return JsonResponse({
             'success': False,
             'message': 'Processing already in progress'
@@ -158,24 +162,7 @@ def process_marker_api(request, marker_id):
         marker.save()
         
         # Start processing in background
-        processing_markers[marker_id] = {
-            'status': 'processing',
-            'progress': 0,
-            'detector_types': detector_types
-        }
-        
-        # Start background processing task
-        worker_pool.submit(
-            process_marker_background,
-            marker, 
-            detector_types
-        )
-        
-        return JsonResponse({
-            'success': True,
-            'message': 'Processing started',
-            'detector_types': detector_types
-        })
+        return start_marker_job(marker, detector_types)
     
     except Exception as e:
         logger.error(f"Error starting processing: {str(e)}")
@@ -197,18 +184,47 @@ def marker_processing_status(request, marker_id):
             'message': 'Permission denied'
         }, status=403)
     
-    # Get current status
-    if marker_id in processing_markers:
-        status_data = processing_markers[marker_id]
-        return JsonResponse({
-            'status': status_data['status'],
-            'progress': status_data.get('progress', 0),
-            'result': status_data.get('result')
-        })
-    else:
+    # Get current status from the most recent job
+    job = latest_marker_job(marker_id)
+    if job is None:
         return JsonResponse({
             'status': 'idle'
         })
+    
+    if job.status == 'completed':
+        result = job.result or {}
+        result_data = {
+            'success': True,
+            'message': 'Processing completed successfully',
+            'processed': result.get('processed', 0),
+            'detections': result.get('detections', 0),
+            'result_images': result.get('detections', 0),
+            'processing_time': result.get('processing_time')
+        }
+    elif job.status == 'error':
+        result_data = {
+            'success': False,
+            'message': f'Error during processing: {job.error}'
+        }
+    else:
+        result_data = None
+    
+    return JsonResponse({
+        # Queued jobs are reported as processing, the page only distinguishes running from finished
+        'status': 'processing' if job.is_active else job.status,
+        'progress': job.progress,
+        'result': result_data,
+        'job': {
+            'id': job.id,
+            'status': job.status,
+            'attempts': job.attempts,
+            'files_done': job.files_done,
+            'files_total': job.files_total,
+            'created_at': job.created_at.isoformat(),
+            'started_at': job.started_at.isoformat() if job.started_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None
+        }
+    })
 
 @login_required
 @require_http_methods(["POST"])
@@ -224,13 +240,6 @@ def auto_process_marker(request, marker_id):
         }, status=403)
     
     try:
-        # Check if already processing
-        if marker_id in processing_markers and processing_markers[marker_id]['status'] == 'processing':
-            return JsonResponse({
-                'success': False,
-                'message': 'Processing already in progress'
-            })
-        
         # Map model types to detector types
         model_map = {
             'object_detection': marker.object_detection,
@@ -249,24 +258,7 @@ def auto_process_marker(request, marker_id):
             })
         
         # Start processing in background
-        processing_markers[marker_id] = {
-            'status': 'processing',
-            'progress': 0,
-            'detector_types': detector_types
-        }
-        
-        # Start background processing task
-        worker_pool.submit(
-            process_marker_background,
-            marker, 
-            detector_types
-        )
-        
-        return JsonResponse({
-            'success': True,
-            'message': 'Processing started',
-            'detector_types': detector_types
-        })
+        return start_marker_job(marker, detector_types)
     
     except Exception as e:
         logger.error(f"Error starting auto processing: {str(e)}")
@@ -276,52 +268,35 @@ def auto_process_marker(request, marker_id):
             'message': f'Error starting processing: {str(e)}'
         }, status=500)
 
-def process_marker_background(marker, detector_types):
-    """Process a marker in background thread"""
-    marker_id = marker.id
+def start_marker_job(marker, detector_types):
+    """Queue a processing job for a marker and wake the inference workers"""
+    job, created = enqueue_marker_job(marker, detector_types)
     
-    try:
-        logger.info(f"Starting background processing for marker {marker_id}")
-        
-        # Process marker with selected detector types
-        result = process_marker(marker)
-        
-        # Update status to completed
-        processing_markers[marker_id] = {
-            'status': 'completed',
-            'progress': 100,
-            'detector_types': detector_types,
-            'result': {
-                'success': True,
-                'message': 'Processing completed successfully',
-                'processed': result.get('processed', 0),
-                'detections': result.get('detections', 0),
-                'result_images': result.get('detections', 0),
-                'processing_time': result.get('processing_time')
-            }
-        }
-        logger.info(f"Completed background processing for marker {marker_id}: {result}")
+    # Check if already processing
+    if not created:
+        return JsonResponse({
+            'success': False,
+            'message': 'Processing already in progress'
+        })
     
-    except Exception as e:
-        logger.error(f"Error in background processing for marker {marker_id}: {str(e)}")
-        logger.error(traceback.format_exc())
-        
-        # Update status to error
-        processing_markers[marker_id] = {
-            'status': 'error',
-            'progress': 0,
-            'detector_types': detector_types,
-            'result': {
-                'success': False,
-                'message': f'Error during processing: {str(e)}'
-            }
-        }
+    # Any free worker process claims the job from the database
+    inference_pool.submit_jobs()
+    
+    return JsonResponse({
+        'success': True,
+        'message': 'Processing started',
+        'detector_types': detector_types,
+        'job_id': job.id
+    })
 
 @login_required
 def marker_detection_results(request, marker_id):
     """
     Display all detection results for a marker
     """
+    from .services.rasters import is_raster
+    from .services.video import is_video
+    
     marker = get_object_or_404(Marker, id=marker_id)
 
     # Check if user has permission to view this marker
@@ -361,6 +336,13 @@ def marker_detection_results(request, marker_id):
             file_objects_count = sum(d.objects.count() for d in file_detections)
             total_objects += file_objects_count
             
+            # Browsers cannot display TIFF rasters or a video in an <img>, show a reduced-resolution JPEG instead
+            video_file = is_video(marker_file.file.name)
+            if video_file or is_raster(marker_file.file.name):
+                preview_url = reverse('detection:file_preview', args=[marker_file.id])
+            else:
+                preview_url = marker_file.file.url
+            
             # Enhance detection objects with additional data
             enhanced_detections = []
             for detection in file_detections:
@@ -383,6 +365,11 @@ def marker_detection_results(request, marker_id):
                     label = obj.label
                     object_classes[label] = object_classes.get(label, 0) + 1
                 
+                # Boxes of a video are drawn over one frame, the first the detector found objects in
+                preview_frame = None
+                if video_file:
+                    preview_frame = detection.objects.aggregate(frame=models.Min('frame_index'))['frame'] or 0
+                
                 enhanced_detections.append({
                     'id': detection.id,
                     'detector_type': detection.detector_type,
@@ -390,14 +377,18 @@ def marker_detection_results(request, marker_id):
                     'model_name': detection.model_name,
                     'summary': detection.summary,
                     'image_url': detection.image_url,
+                    'is_object_detection': detection.is_object_detection,
                     'object_count': detection.objects.count(),
                     'object_classes': object_classes,
                     'inference_time': inference_time,
-                    'objects': detection.objects.all()
+                    'objects': detection.objects.all(),
+                    'preview_frame': preview_frame,
+                    'preview_url': f"{preview_url}?frame={preview_frame}" if video_file else preview_url
                 })
             
             files_with_detections.append({
                 'file': marker_file,
+                'preview_url': preview_url,
                 'detections': enhanced_detections,
                 'detection_count': len(enhanced_detections)
             })
@@ -458,10 +449,9 @@ def detection_detail(request, detection_id):
         config = DetectionConfig.objects.get(detector_type=detector_type)
         display_name = config.display_name
         
-        # Get model description from model configuration
-        model_info = model_service.get_model(detector_type, detection.model_name)
-        if model_info and 'config' in model_info:
-            model_description = model_info['config'].get('description', '')
+        # Get model description from model configuration (without loading the model here)
+        model_config = MODEL_CONFIG.get(detector_type, {}).get(detection.model_name, {})
+        model_description = model_config.get('description', '')
     except DetectionConfig.DoesNotExist:
         pass
     except Exception as e:
@@ -484,6 +474,84 @@ def detection_detail(request, detection_id):
     
     return render(request, 'detection/detection_detail.html', context)
 
+@login_required
+def detection_overlay(request, detection_id):
+    """API endpoint with the boxes of a detection, drawn over the original image in the browser"""
+    from .services.rendering import get_label_color, label_color_hex
+    
+    detection = get_object_or_404(Detection, id=detection_id)
+    marker_file = detection.marker_file
+    marker = marker_file.marker
+    
+    # Check if user has permission to view this marker
+    if marker.visibility == 'private' and (not request.user.is_authenticated or marker.user != request.user):
+        return JsonResponse({
+            'success': False,
+            'message': 'Permission denied'
+        }, status=403)
+    
+    metadata = detection.metadata or {}
+    # Video frames all have the video's size
+    video = metadata.get('video') or {}
+    objects = []
+    for obj in detection.objects.all():
+        _, fill_opacity = get_label_color(obj.label)
+        objects.append({
+            'id': obj.id,
+            'label': obj.label,
+            'confidence': obj.confidence,
+            'bbox': [obj.x_min, obj.y_min, obj.x_max, obj.y_max],
+            'color': label_color_hex(obj.label),
+            'fill_opacity': fill_opacity,
+            # Set for videos: the frame the object was found in and its time in seconds
+            'frame_index': obj.frame_index,
+            'timestamp': obj.timestamp
+        })
+    
+    return JsonResponse({
+        'success': True,
+        'detection_id': detection.id,
+        'detector_type': detection.detector_type,
+        'model_name': detection.model_name,
+        'image_url': marker_file.file.url if marker_file.file else None,
+        'image_width': metadata.get('image_width') or video.get('width'),
+        'image_height': metadata.get('image_height') or video.get('height'),
+        'objects': objects
+    })
+
+@login_required
+def export_detection_image(request, detection_id):
+    """Render and download the annotated image of a detection"""
+    from .services.rendering import render_detection_jpeg
+    
+    detection = get_object_or_404(Detection, id=detection_id)
+    marker_file = detection.marker_file
+    marker = marker_file.marker
+    
+    # Check if user has permission to view this marker
+    if marker.visibility == 'private' and (not request.user.is_authenticated or marker.user != request.user):
+        return render(request, '403.html', status=403)
+    
+    detections = [
+        {
+            'label': obj.label,
+            'confidence': obj.confidence,
+            'bbox': [obj.x_min, obj.y_min, obj.x_max, obj.y_max]
+        }
+        for obj in detection.objects.all()
+    ]
+    
+    try:
+        image_data = render_detection_jpeg(marker_file.file.path, detections, detection.detector_type, detection.model_name)
+    except Exception as e:
+        logger.error(f"Error exporting detection {detection_id}: {str(e)}")
+        return HttpResponse('Could not render detection image', status=404)
+    
+    filename = f"{os.path.splitext(os.path.basename(marker_file.file.name))[0]}_{detection.detector_type}.jpg"
+    response = HttpResponse(image_data, content_type='image/jpeg')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 @login_required
 def available_models(request):
     """API endpoint to get available detection models"""
@@ -532,3 +600,208 @@ def file_detection_results(request, file_id):
     
     # Redirect to marker results for simplicity
     return redirect('detection:marker_results', marker_id=marker.id)
+
+@login_required
+def file_preview(request, file_id):
+    """
+    Serve a reduced-resolution JPEG of an uploaded image, generated once from its overview
+    
+    Videos are previewed by one frame, the one given by the `frame` parameter (the first by default).
+    """
+    from .services.rendering import render_preview_jpeg
+    from .services.video import is_video
+    
+    marker_file = get_object_or_404(MarkerFile, id=file_id)
+    marker = marker_file.marker
+    
+    # Check if user has permission to view this marker
+    if marker.visibility == 'private' and (not request.user.is_authenticated or marker.user != request.user):
+        return render(request, '403.html', status=403)
+    
+    file_path = marker_file.file.path
+    frame_index = 0
+    preview_name = f"{marker_file.id}.jpg"
+    if is_video(file_path):
+        try:
+            frame_index = int(request.GET.get('frame', 0))
+        except ValueError:
+            return HttpResponse('Invalid frame', status=400)
+        if frame_index < 0:
+            return HttpResponse('Invalid frame', status=400)
+        preview_name = f"{marker_file.id}_frame{frame_index:06d}.jpg"
+    preview_path = os.path.join(RESULTS_ROOT, 'previews', preview_name)
+    
+    try:
+        if not os.path.exists(preview_path) or os.path.getmtime(preview_path) < os.path.getmtime(file_path):
+            image_data = render_preview_jpeg(file_path, getattr(settings, 'DETECTION_RASTER_PREVIEW_SIDE', 2048), frame_index)
+            os.makedirs(os.path.dirname(preview_path), exist_ok=True)
+            with open(preview_path, 'wb') as f:
+                f.write(image_data)
+        else:
+            with open(preview_path, 'rb') as f:
+                image_data = f.read()
+    except Exception as e:
+        logger.error(f"Error rendering preview of file {file_id}: {str(e)}")
+        return HttpResponse('Could not render preview', status=404)
+    
+    return HttpResponse(image_data, content_type='image/jpeg')
+
+@login_required
+def model_status(request):
+    """API endpoint describing the loaded models and their memory use"""
+    from .services.main import model_service
+    
+    if not request.user.is_staff:
+        return JsonResponse({
+            'success': False,
+            'message': 'Permission denied'
+        }, status=403)
+    
+    return JsonResponse({
+        'success': True,
+        'web': model_service.status(),
+        'workers': inference_pool.model_status()
+    })
+
+@login_required
+def cache_stats(request):
+    """API endpoint reporting how often inference results are served from the content-hash cache"""
+    if not request.user.is_staff:
+        return JsonResponse({
+            'success': False,
+            'message': 'Permission denied'
+        }, status=403)
+    
+    by_detector = (
+        InferenceCacheEntry.objects
+        .values('detector_type')
+        .annotate(entries=models.Count('id'), hits=models.Sum('hits'))
+        .order_by('detector_type')
+    )
+    
+    # Hit rate across completed jobs, as recorded by process_marker, summed by the database
+    totals = ProcessingJob.objects.filter(status='completed').aggregate(
+        hits=models.Sum(Cast(KT('result__cache_hits'), models.IntegerField())),
+        misses=models.Sum(Cast(KT('result__cache_misses'), models.IntegerField()))
+    )
+    hits = totals['hits'] or 0
+    misses = totals['misses'] or 0
+    
+    return JsonResponse({
+        'success': True,
+        'enabled': getattr(settings, 'DETECTION_RESULT_CACHE', True),
+        'entries': InferenceCacheEntry.objects.count(),
+        'detectors': list(by_detector),
+        'job_cache_hits': hits,
+        'job_cache_misses': misses,
+        'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None
+    })
+
+# Stage timings stored in Detection.metadata['timings'], in pipeline order
+TIMING_STAGES = ['read_ms', 'decode_ms', 'preprocess_ms', 'inference_ms', 'nms_ms', 'postprocess_ms', 'render_ms', 'encode_ms', 'db_write_ms']
+# Bounds of the detection_timing_stats query parameters
+TIMING_STATS_MAX_DAYS = 3650
+TIMING_STATS_MAX_LIMIT = 50000
+
+def _percentiles(values):
+    """p50/p95/mean/max of a list of timings"""
+    import numpy as np
+    
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        'p50': round(float(np.percentile(values, 50)), 2),
+        'p95': round(float(np.percentile(values, 95)), 2),
+        'mean': round(float(values.mean()), 2),
+        'max': round(float(values.max()), 2)
+    }
+
+@login_required
+def detection_timing_stats(request):
+    """
+    API endpoint aggregating the per-stage timings stored with recent detections by detector
+    and model, with the slowest inputs of each
+    
+    Query parameters: days (default 7, at most TIMING_STATS_MAX_DAYS), detector_type,
+    limit (detections read, default 5000, clamped to 1..TIMING_STATS_MAX_LIMIT)
+    """
+    if not request.user.is_staff:
+        return JsonResponse({
+            'success': False,
+            'message': 'Permission denied'
+        }, status=403)
+    
+    try:
+        days = int(request.GET.get('days', 7))
+        limit = int(request.GET.get('limit', 5000))
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'message': 'days and limit must be integers'
+        }, status=400)
+    
+    # Bound the rows read per request, and keep the cutoff date representable
+    days = min(max(days, 1), TIMING_STATS_MAX_DAYS)
+    limit = min(max(limit, 1), TIMING_STATS_MAX_LIMIT)
+    
+    detections = Detection._default_manager.filter(created_at__gte=timezone.now() - timedelta(days=days))
+    if request.GET.get('detector_type'):
+        detections = detections.filter(detector_type=request.GET['detector_type'])
+    rows = detections.order_by('-created_at').values_list('id', 'marker_file_id', 'detector_type', 'model_name', 'metadata')[:limit]
+    
+    groups = {}
+    for detection_id, file_id, detector_type, model_name, metadata in rows:
+        group = groups.setdefault((detector_type, model_name), {
+            'detections': 0, 'cached': 0, 'stages': {}, 'peak_rss_mb': [], 'inputs': []
+        })
+        group['detections'] += 1
+        
+        metadata = metadata if isinstance(metadata, dict) else {}
+        timings = metadata.get('timings')
+        # Cached results and detections stored before timings were recorded have nothing to add
+        if metadata.get('cached') or not timings:
+            group['cached'] += bool(metadata.get('cached'))
+            continue
+        
+        for stage, value in timings.items():
+            group['stages'].setdefault(stage, []).append(value)
+        if metadata.get('peak_rss_mb'):
+            group['peak_rss_mb'].append(metadata['peak_rss_mb'])
+        group['inputs'].append((sum(timings.values()), detection_id, file_id, metadata))
+    
+    stats = []
+    for (detector_type, model_name), group in sorted(groups.items()):
+        stages = {
+            stage: _percentiles(group['stages'][stage])
+            for stage in TIMING_STAGES + sorted(set(group['stages']) - set(TIMING_STAGES))
+            if stage in group['stages']
+        }
+        stats.append({
+            'detector_type': detector_type,
+            'model_name': model_name,
+            'detections': group['detections'],
+            'timed': len(group['inputs']),
+            'cached': group['cached'],
+            'stages': stages,
+            'total_ms': _percentiles([total for total, *_ in group['inputs']]) if group['inputs'] else None,
+            'peak_rss_mb': round(max(group['peak_rss_mb']), 1) if group['peak_rss_mb'] else None,
+            'slowest': [
+                {
+                    'detection_id': detection_id,
+                    'file_id': file_id,
+                    'total_ms': round(total, 2),
+                    'image_width': metadata.get('image_width'),
+                    'image_height': metadata.get('image_height'),
+                    'input_width': metadata.get('input_width'),
+                    'input_height': metadata.get('input_height'),
+                    'batch_size': metadata.get('batch_size'),
+                    'tiles': metadata.get('tiles')
+                }
+                for total, detection_id, file_id, metadata in heapq.nlargest(5, group['inputs'], key=lambda item: item[0])
+            ]
+        })
+    
+    return JsonResponse({
+        'success': True,
+        'days': days,
+        'detectors': stats
+    })
@@ -111,3 +111,73 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# AI detection
+# Maximum number of images sent to a detector in a single forward pass
+DETECTION_BATCH_SIZE = int(os.environ.get('DETECTION_BATCH_SIZE', '8'))
+# Number of inference worker processes and how they are started ('spawn' keeps torch/TF thread pools out of forked children)
+DETECTION_WORKER_PROCESSES = int(os.environ.get('DETECTION_WORKER_PROCESSES', '2'))
+DETECTION_WORKER_START_METHOD = os.environ.get('DETECTION_WORKER_START_METHOD', 'spawn')
+# torch/TensorFlow/OpenCV threads per worker process (0 = available cores divided by DETECTION_WORKER_PROCESSES),
+# and inter-op threads running independent graph branches side by side (see bench_threads)
+DETECTION_INTRA_OP_THREADS = int(os.environ.get('DETECTION_INTRA_OP_THREADS', '0'))
+DETECTION_INTER_OP_THREADS = int(os.environ.get('DETECTION_INTER_OP_THREADS', '1'))
+# Running jobs without a heartbeat for this long are requeued (or failed after their last attempt)
+DETECTION_JOB_STALE_SECONDS = int(os.environ.get('DETECTION_JOB_STALE_SECONDS', '600'))
+# Detector types loaded and warmed up when an inference worker starts (comma separated)
+DETECTION_PRELOAD_MODELS = [t for t in os.environ.get('DETECTION_PRELOAD_MODELS', '').split(',') if t]
+# Memory budget for loaded models per process in MB; least recently used models are evicted (0 = unlimited)
+DETECTION_MODEL_MEMORY_MB = int(os.environ.get('DETECTION_MODEL_MEMORY_MB', '0'))
+# Longest image side passed to the models; larger images are resized once per file and shared by all detectors (0 = full resolution)
+DETECTION_INFERENCE_MAX_SIDE = int(os.environ.get('DETECTION_INFERENCE_MAX_SIDE', '0'))
+# Write annotated JPEGs for every detection; otherwise boxes are drawn in the browser and rasters are rendered on export
+DETECTION_RENDER_IMAGES = os.environ.get('DETECTION_RENDER_IMAGES', 'False') == 'True'
+# Reuse stored results for identical files (same SHA-256, detector, model weights and thresholds)
+DETECTION_RESULT_CACHE = os.environ.get('DETECTION_RESULT_CACHE', 'True') == 'True'
+# Large TIFF rasters are read window by window; these bound the overview and decoded-tile cache sizes
+DETECTION_RASTER_OVERVIEW_SIDE = int(os.environ.get('DETECTION_RASTER_OVERVIEW_SIDE', '4096'))
+DETECTION_RASTER_PREVIEW_SIDE = int(os.environ.get('DETECTION_RASTER_PREVIEW_SIDE', '2048'))
+DETECTION_RASTER_CACHE_MB = int(os.environ.get('DETECTION_RASTER_CACHE_MB', '64'))
+# Detector types run side by side on each batch (1 runs them one after another); each process's torch
+# threads are divided once between the object detectors that can run side by side
+DETECTION_DETECTOR_CONCURRENCY = int(os.environ.get('DETECTION_DETECTOR_CONCURRENCY', '4'))
+# Images per Keras prediction; classifier inputs are collected across a marker's files up to this size
+DETECTION_CLASSIFIER_BATCH_SIZE = int(os.environ.get('DETECTION_CLASSIFIER_BATCH_SIZE', '32'))
+# Inference backend: 'auto' picks the fastest registered export (see export_onnx and quantize_models),
+# 'source' keeps the original weights, or force 'onnx', 'onnx_int8', 'openvino' or 'tflite_int8'.
+# A model's 'backend' entry in MODEL_CONFIG overrides this per detector. INT8 exports are only picked
+# by 'auto' for models with 'allow_int8': True in MODEL_CONFIG.
+DETECTION_BACKEND = os.environ.get('DETECTION_BACKEND', 'auto')
+# Videos are streamed frame by frame: 'scene' keeps frames that differ from the last kept one (checked at
+# DETECTION_VIDEO_FPS, at least one every DETECTION_VIDEO_MAX_GAP seconds), 'fps' keeps frames at a fixed rate
+DETECTION_VIDEO_SAMPLING = os.environ.get('DETECTION_VIDEO_SAMPLING', 'scene')
+DETECTION_VIDEO_FPS = float(os.environ.get('DETECTION_VIDEO_FPS', '2'))
+DETECTION_VIDEO_SCENE_THRESHOLD = float(os.environ.get('DETECTION_VIDEO_SCENE_THRESHOLD', '0.08'))
+DETECTION_VIDEO_MAX_GAP = float(os.environ.get('DETECTION_VIDEO_MAX_GAP', '5'))
+# Missing weights files: 'download' fetches YOLO weights by name, 'fail' skips the detector,
+# 'stub' runs a deterministic stand-in (no network, for air-gapped CI)
+DETECTION_MISSING_WEIGHTS = os.environ.get('DETECTION_MISSING_WEIGHTS', 'download')
+# Replace every model with a deterministic stub returning synthetic boxes/classes, to load-test the
+# queue, persistence and rendering without real models
+DETECTION_STUB_MODELS = os.environ.get('DETECTION_STUB_MODELS', 'False') == 'True'
+DETECTION_STUB_LATENCY_MS = float(os.environ.get('DETECTION_STUB_LATENCY_MS', '0'))
+DETECTION_STUB_DETECTIONS = int(os.environ.get('DETECTION_STUB_DETECTIONS', '10'))
+DETECTION_STUB_SEED = int(os.environ.get('DETECTION_STUB_SEED', '0'))
+# 'sequential' processes marker files chunk by chunk; 'staged' runs them through the load/preprocess/infer/
+# postprocess/render/persist stages with bounded queues so I/O overlaps inference (see services/pipeline.py)
+DETECTION_PIPELINE = os.environ.get('DETECTION_PIPELINE', 'sequential')
+# Worker threads per stage, e.g. 'load=2,render=2' (unlisted stages keep their defaults)
+DETECTION_PIPELINE_WORKERS = os.environ.get('DETECTION_PIPELINE_WORKERS', '')
+# Items each stage queue holds (0 = twice DETECTION_BATCH_SIZE)
+DETECTION_PIPELINE_QUEUE_SIZE = int(os.environ.get('DETECTION_PIPELINE_QUEUE_SIZE', '0'))
+# Jobs are run by standalone `manage.py run_detection_worker` processes: web processes only queue them
+# instead of starting their own inference pool. Set it wherever the worker runs (the Procfile sets it for
+# the web process), otherwise each web worker also starts a pool and loads its own copy of the models
+DETECTION_EXTERNAL_WORKERS = os.environ.get('DETECTION_EXTERNAL_WORKERS', 'False') == 'True'
+# run_detection_worker: seconds between queue polls when idle, between heartbeats (job heartbeat_at,
+# throughput report; inference pool workers send job heartbeats at the same interval), and given to
+# running jobs on SIGTERM before they are put back in the queue (0 waits for them); keep the drain under
+# the platform's stop grace period
+DETECTION_WORKER_POLL_SECONDS = float(os.environ.get('DETECTION_WORKER_POLL_SECONDS', '2'))
+DETECTION_WORKER_HEARTBEAT_SECONDS = float(os.environ.get('DETECTION_WORKER_HEARTBEAT_SECONDS', '30'))
+DETECTION_WORKER_DRAIN_SECONDS = float(os.environ.get('DETECTION_WORKER_DRAIN_SECONDS', '25'))